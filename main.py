@@ -1,3 +1,5 @@
+import argparse
+import io
 import os
 import sys
 from pathlib import Path
@@ -5,12 +7,22 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent))
 
 from src.logger import setup_logger
-from src.parser import parse_command
+from src.parser import parse_pipeline, split_background
+from src.pipeline import run_pipeline
+from src.jobs import JobCancelled, JobManager
 from src.commands.basic import BasicCommands
 from src.commands.archive import ArchiveCommands
 from src.commands.grep import GrepCommand
+from src.commands.index import IndexCommands
+from src.commands.trash import TrashCommands
+from src.commands.jobs import JobCommands
 from src.commands.history import HistoryManager, UndoManager, HistoryCommands
 
+try:
+    import readline
+except ImportError:  # Windows
+    readline = None
+
 logger = setup_logger()
 
 class ShellManager:
@@ -18,29 +30,50 @@ class ShellManager:
         self.current_dir = os.getcwd()
         self.history_manager = HistoryManager()
         self.undo_manager = UndoManager()
+        self.job_manager = JobManager()
         
         # Инициализация команд
         self.basic_cmds = BasicCommands(self.history_manager, self.undo_manager)
         self.archive_cmds = ArchiveCommands(self.history_manager, self.undo_manager)
         self.grep_cmd = GrepCommand()
+        self.index_cmds = IndexCommands()
+        self.trash_cmds = TrashCommands(self.undo_manager)
         self.history_cmds = HistoryCommands(self.history_manager, self.undo_manager)
+        self.job_cmds = JobCommands(self.job_manager)
         
         # Регистрация команд
         self.commands = {
             'ls': self.basic_cmds.ls,
             'cd': self.basic_cmds.cd,
             'cat': self.basic_cmds.cat,
+            'head': self.basic_cmds.head,
+            'tail': self.basic_cmds.tail,
             'cp': self.basic_cmds.cp,
+            'sync': self.basic_cmds.sync,
             'mv': self.basic_cmds.mv,
             'rm': self.basic_cmds.rm,
+            'trash': self.trash_cmds.trash,
             'zip': self.archive_cmds.zip,
             'unzip': self.archive_cmds.unzip,
             'tar': self.archive_cmds.tar,
             'untar': self.archive_cmds.untar,
             'grep': self.grep_cmd.grep,
+            'index': self.index_cmds.index,
             'history': self.history_cmds.history,
             'clear_history': self.history_cmds.clear_history,
             'undo': self.history_cmds.undo,
+            'redo': self.history_cmds.redo,
+            'jobs': self.job_cmds.jobs,
+            'wait': self.job_cmds.wait,
+            'kill': self.job_cmds.kill,
+        }
+
+        # Команды, которые могут быть стадиями конвейера (cmd1 | cmd2)
+        self.stream_commands = {
+            'cat': self.basic_cmds.cat_stream,
+            'head': self.basic_cmds.head_stream,
+            'tail': self.basic_cmds.tail_stream,
+            'grep': self.grep_cmd.grep_stream,
         }
 
         logger.info("ShellManager инициализирован")
@@ -48,21 +81,45 @@ class ShellManager:
     def run_shell(self):
         logger.info("Запуск Mini Shell")
         print("Добро пожаловать в Mini Shell")
-        print("Доступные команды: ls, cd, cat, cp, mv, rm, zip, unzip, tar, untar, grep, history, clear_history, undo, exit")
+        print("Доступные команды: ls, cd, cat, head, tail, cp, sync, mv, rm, trash, zip, unzip, tar, untar, grep, index, history, clear_history, undo, redo, jobs, wait, kill, exit")
+        print("Команда с & в конце выполняется в фоне")
         print("Для работы с именами файлов/директорий, содержащими пробелы, необходимо использовать двойные кавычки")
         print("-" * 60)
+
+        if readline is not None and 'libedit' not in (readline.__doc__ or ''):
+            # Ctrl-R запускает поиск по всей сохранённой истории (history -r),
+            # уже набранный текст становится начальным запросом
+            readline.parse_and_bind(r'"\C-r": "\C-ahistory -r \C-j"')
     
         while True:
             try:
+                # Итоги фоновых задач, завершившихся с прошлой команды
+                self.job_manager.report()
+                self._prefill_input()
+
                 # Отображение текущей директории перед полем ввода команд
                 prompt = f"{os.path.basename(self.current_dir)}$ "
                 command_line = input(prompt).strip()
             
                 if not command_line:
                     continue
+
+                command_line, background = split_background(command_line)
+                if background:
+                    self.history_manager.add_command(f"{command_line} &")
+                    self._start_job(command_line)
+                    continue
             
-                # Парсим команду и аргументы с обработкой кавычек
-                cmd, args = parse_command(command_line)
+                # Конвейер: стадии соединяются потоками, а не строками в памяти
+                stages = parse_pipeline(command_line)
+                if len(stages) > 1:
+                    self.history_manager.add_command(command_line)
+                    self._run_pipeline(stages, command_line)
+                    self.current_dir = os.getcwd()
+                    continue
+
+                # Команда и аргументы с обработкой кавычек
+                cmd, args = stages[0]
             
                 # Обработка ошибок парсинга
                 if cmd is None:
@@ -71,11 +128,13 @@ class ShellManager:
                         logger.error(f"Ошибка парсинга команды: {args[0]}")
                     continue
             
-                # Добавляем команду в историю оболочки
-                self.history_manager.add_command(command_line)
+                # Добавляем команду в историю оболочки (кроме вызовов поиска по Ctrl-R)
+                if not command_line.startswith("history -r"):
+                    self.history_manager.add_command(command_line)
             
                 # Обработка встроенных команд
                 if cmd in ['exit', 'quit']:
+                    self._stop_jobs()
                     logger.info("Выход из оболочки")
                     break
             
@@ -94,6 +153,7 @@ class ShellManager:
                 logger.info("Прервано пользователем")
                 continue
             except EOFError:
+                self._stop_jobs()
                 print("\nВыход из оболочки")
                 logger.info("Выход из оболочки по EOF")
                 break
@@ -101,10 +161,37 @@ class ShellManager:
                 print(f"Ошибка: {e}")
                 logger.exception(f"Необработанное исключение: {e}")
     
+    def _prefill_input(self):
+        """Подстановка команды, выбранной через history -r, в следующую строку ввода"""
+        selected = self.history_cmds.pending_input
+        if not selected:
+            return
+        self.history_cmds.pending_input = None
+        if readline is None:
+            print(f"Найдено: {selected}")
+            return
+
+        def hook():
+            readline.insert_text(selected)
+            readline.redisplay()
+            readline.set_pre_input_hook(None)
+
+        readline.set_pre_input_hook(hook)
+
     def execute_command(self, command_line):
         """Выполняет одну команду"""
         try:
-            cmd, args = parse_command(command_line)
+            command_line, background = split_background(command_line)
+            if background:
+                self._start_job(command_line)
+                return True
+
+            stages = parse_pipeline(command_line)
+            if len(stages) > 1:
+                self._run_pipeline(stages, command_line)
+                return True
+
+            cmd, args = stages[0]
             if not cmd:
                 return True
             
@@ -124,16 +211,167 @@ class ShellManager:
             logger.exception(f"Ошибка при выполнении команды '{command_line}': {e}")
             return True
 
-def main():
+    def run_batch(self, lines, fail_fast=False):
+        """Выполнение команд без интерактивного ввода: из сценария, -c или stdin.
+
+        Приглашение не выводится, история пишется пакетами. Код выхода — 0, если
+        все команды вернули True, иначе 1; exit N завершает сценарий с кодом N.
+        Перед завершением сценарий дожидается своих фоновых задач.
+        Подтверждения (rm -r) не читают строки сценария: ввода у команд нет,
+        и они получают конец файла, как фоновые задачи"""
+        stdin = sys.stdin
+        sys.stdin = io.StringIO()
+        with self.history_manager.batch():
+            try:
+                return self._run_lines(lines, fail_fast)
+            finally:
+                self.job_manager.wait()
+                self.job_manager.report()
+                sys.stdin = stdin
+
+    def _run_lines(self, lines, fail_fast):
+        """Выполнение строк сценария; возвращает код выхода"""
+        exit_code = 0
+        for line_no, command_line in enumerate(lines, 1):
+            command_line = command_line.strip()
+            if not command_line or command_line.startswith('#'):
+                continue
+
+            command_line, background = split_background(command_line)
+            stages = parse_pipeline(command_line)
+            cmd, args = stages[0]
+            if background:
+                self.history_manager.add_command(f"{command_line} &")
+                ok = self._start_job(command_line)
+            elif len(stages) > 1:
+                self.history_manager.add_command(command_line)
+                ok = self._run_pipeline(stages, command_line)
+            elif cmd is None:
+                print(f"Строка {line_no}: ошибка парсинга: {args[0] if args else ''}")
+                logger.error(f"Ошибка парсинга команды в строке {line_no}: {command_line}")
+                ok = False
+            elif cmd in ['exit', 'quit']:
+                if args and args[0].lstrip('-').isdigit():
+                    return int(args[0])
+                return exit_code
+            else:
+                self.history_manager.add_command(command_line)
+                ok = self._run(cmd, args, command_line)
+
+            if not ok:
+                exit_code = 1
+                if fail_fast:
+                    logger.info(f"Сценарий остановлен на строке {line_no} (--fail-fast)")
+                    break
+
+        return exit_code
+
+    def _start_job(self, command_line):
+        """Запуск команды или конвейера в фоне с текущей рабочей директорией"""
+        stages = parse_pipeline(command_line)
+        cmd, args = stages[0]
+        if cmd is None:
+            print(f"Ошибка парсинга: {args[0] if args else 'Пустая команда'}")
+            logger.error(f"Ошибка парсинга фоновой команды: {command_line}")
+            return False
+        if cmd in ['exit', 'quit']:
+            print(f"Команду {cmd} нельзя выполнить в фоне")
+            return False
+
+        # Задача может ждать в очереди, пока вводятся другие команды: её номер
+        # в истории запоминается сейчас, при вводе строки с &
+        cmd_index = self.history_manager.count()
+
+        def target():
+            try:
+                with self.history_manager.command_index(cmd_index):
+                    if len(stages) > 1:
+                        return self._run_pipeline(stages, command_line)
+                    return self._run(cmd, args, command_line)
+            except JobCancelled:
+                # Операция, прерванная на середине, откатывается по журналу отмены
+                self.undo_manager.recover_interrupted()
+                raise
+
+        job = self.job_manager.start(command_line, target, os.getcwd())
+        print(f"[{job.id}] {command_line}")
+        return True
+
+    def _stop_jobs(self):
+        """Прерывание фоновых задач при выходе из оболочки"""
+        jobs = [job for job in self.job_manager.jobs() if not job.finished]
+        for job in jobs:
+            self.job_manager.kill(job.id)
+        if jobs:
+            self.job_manager.wait(timeout=5)
+            print(f"Прервано фоновых задач: {len(jobs)}")
+        self.job_manager.report()
+
+    def _run(self, cmd, args, command_line):
+        """Выполнение одной команды; True, если она завершилась успешно"""
+        handler = self.commands.get(cmd)
+        if handler is None:
+            print(f"Неизвестная команда: {cmd}")
+            logger.warning(f"Неизвестная команда: {cmd}")
+            return False
+        try:
+            return bool(handler(args))
+        except Exception as e:
+            print(f"Ошибка при выполнении команды: {e}")
+            logger.exception(f"Ошибка при выполнении команды '{command_line}': {e}")
+            return False
+
+    def _run_pipeline(self, stages, command_line):
+        """Выполнение конвейера; True, если последняя стадия завершилась успешно"""
+        if stages[0][0] is None:
+            print(f"Ошибка парсинга: {stages[0][1][0]}")
+            logger.error(f"Ошибка парсинга конвейера: {command_line}")
+            return False
+        try:
+            ok = run_pipeline(stages, self.stream_commands)
+        except Exception as e:
+            print(f"Ошибка при выполнении команды: {e}")
+            logger.exception(f"Ошибка при выполнении конвейера '{command_line}': {e}")
+            return False
+        if ok:
+            logger.info(f"{command_line} OK")
+        return ok
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Mini Shell — мини-оболочка с файловыми командами")
+    parser.add_argument("script", nargs="?", help="файл сценария (.msh): по команде в строке")
+    parser.add_argument("-c", dest="command", help="выполнить команду (или строки команд) и выйти")
+    parser.add_argument("--fail-fast", action="store_true",
+                        help="остановиться на первой неуспешной команде")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
     """Точка входа в программу"""
+    options = parse_arguments(argv)
     try:
         # Создаем необходимые директории
         Path("logs").mkdir(exist_ok=True)
         Path("data").mkdir(exist_ok=True)
         
-        # Запускаем оболочку
         manager = ShellManager()
+
+        # Пакетный режим: -c, файл сценария или команды из перенаправленного stdin
+        if options.command is not None or options.script or not sys.stdin.isatty():
+            try:
+                if options.command is not None:
+                    return manager.run_batch(options.command.splitlines(), options.fail_fast)
+                if options.script:
+                    with open(options.script, 'r', encoding='utf-8') as f:
+                        return manager.run_batch(f, options.fail_fast)
+                return manager.run_batch(sys.stdin, options.fail_fast)
+            finally:
+                manager.history_manager.close()
+
+        # Запускаем оболочку
         manager.run_shell()
+        manager.history_manager.close()
         
         logger.info("Работа оболочки завершена")
         print("\nРабота оболочки завершена. До свидания!")
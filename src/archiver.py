@@ -0,0 +1,651 @@
+import bz2
+import gzip
+import heapq
+import io
+import json
+import lzma
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import uuid
+import zipfile
+import zlib
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from .copier import CopyStats
+from .walker import walk
+
+# Сжатие упирается в CPU, поэтому потоков столько же, сколько ядер
+# (zlib отпускает GIL на время сжатия)
+DEFAULT_ARCHIVE_JOBS = os.cpu_count() or 1
+
+DEFAULT_ZIP_LEVEL = 6
+
+# Размер блока при чтении и записи членов архива
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+
+# Сжатый член до этого размера держится в памяти, больше — во временном файле
+ZIP_SPOOL_SIZE = 4 * 1024 * 1024
+
+# Кодеки tar: расширения архива, функция сжатия блока и размер блока.
+# Блоки сжимаются независимо и склеиваются в многочленный поток (gzip members,
+# bz2/xz streams), который читают и gzip/bzip2/xz, и tarfile
+TAR_CODECS = {
+    'gz': (('.tar.gz', '.tgz'), lambda block: gzip.compress(block, 6, mtime=0), 1024 * 1024),
+    'bz2': (('.tar.bz2', '.tbz2'), lambda block: bz2.compress(block, 9), 900 * 1000),
+    'xz': (('.tar.xz', '.txz'), lambda block: lzma.compress(block, preset=6), 8 * 1024 * 1024),
+    'none': (('.tar',), None, None),
+}
+
+# Кодеки для чтения с произвольного места: каждый блок ParallelCompressor —
+# отдельный член gzip или поток bz2/xz, и распаковку можно начать с любого из них
+TAR_READERS = {
+    'gz': lambda f: gzip.GzipFile(fileobj=f, mode='rb'),
+    'bz2': bz2.BZ2File,
+    'xz': lzma.LZMAFile,
+    'none': lambda f: f,
+}
+
+# Суффикс файла индекса рядом с архивом (tar --index)
+TAR_INDEX_SUFFIX = '.idx'
+
+# Первый член инкрементального архива (tar --incremental): уровень и удалённые пути
+TAR_INCREMENTAL_MEMBER = '.incremental.json'
+
+# Сигнатуры сжатых потоков для определения кодека по содержимому
+COMPRESSED_MAGIC = ((b'\x1f\x8b', gzip.open), (b'BZh', bz2.open), (b'\xfd7zXZ\x00', lzma.open))
+
+# Уже сжатые форматы: повторное сжатие тратит CPU без выигрыша в размере,
+# поэтому такие файлы сохраняются без сжатия (STORE)
+STORED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.aac', '.ogg', '.opus', '.flac', '.m4a',
+    '.mp4', '.m4v', '.mkv', '.mov', '.avi', '.webm',
+    '.zip', '.gz', '.tgz', '.bz2', '.tbz2', '.xz', '.txz', '.zst', '.7z', '.rar',
+    '.jar', '.apk', '.docx', '.xlsx', '.pptx', '.odt', '.epub',
+}
+
+
+def _deflate_member(path, zinfo, level):
+    """Сжатие файла в отдельном потоке: CRC и размеры записываются в zinfo,
+    сжатые данные — в буфер. Если сжатие не уменьшило размер, буфер None"""
+    spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    crc = 0
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(ARCHIVE_CHUNK_SIZE), b''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            spool.write(compressor.compress(chunk))
+    spool.write(compressor.flush())
+
+    if spool.tell() >= size:
+        spool.close()
+        return None
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.file_size = size
+    zinfo.compress_size = spool.tell()
+    zinfo.CRC = crc
+    spool.seek(0)
+    return spool
+
+
+def _write_compressed(zf, zinfo, data):
+    """Дозапись в архив члена, сжатого заранее. ZipFile не умеет принимать
+    готовые сжатые данные, поэтому заголовок пишется так же, как это делает
+    сам ZipFile.open('w'), а центральный каталог по-прежнему пишет close()"""
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zinfo.header_offset = zf.fp.tell()
+    zf.fp.write(zinfo.FileHeader(zip64))
+    shutil.copyfileobj(data, zf.fp, ARCHIVE_CHUNK_SIZE)
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+    zf.start_dir = zf.fp.tell()
+
+
+def write_zip(folder, archive_path, jobs=DEFAULT_ARCHIVE_JOBS, level=DEFAULT_ZIP_LEVEL):
+    """Создание ZIP-архива из содержимого каталога (как make_archive: пути
+    относительно folder, с записями каталогов).
+
+    Файлы сжимаются пулом потоков, а записываются в архив в порядке обхода;
+    одновременно сжимается не больше 2 * jobs файлов, поэтому память не
+    зависит от размера дерева. Уже сжатые форматы и уровень 0 — без сжатия.
+    При ошибке недописанный архив удаляется. Возвращает CopyStats"""
+    folder = os.fspath(folder)
+    archive_path = os.fspath(archive_path)
+    stats = CopyStats()
+    pending = deque()
+
+    def flush(limit):
+        while len(pending) > limit:
+            entry_path, zinfo, future = pending.popleft()
+            data = future.result() if future is not None else None
+            if data is None:
+                # Каталоги и файлы без сжатия пишет сам ZipFile
+                zf.write(entry_path, zinfo.filename, compress_type=zipfile.ZIP_STORED)
+            else:
+                with data:
+                    _write_compressed(zf, zinfo, data)
+            if not zinfo.is_dir():
+                stats.add(zf.getinfo(zinfo.filename).file_size)
+
+    try:
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=level) as zf, \
+                ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            for entry in walk(folder, ignore_files=(), with_dirs=True, skip_vcs=False):
+                if os.path.abspath(entry.path) == os.path.abspath(archive_path):
+                    # Архив внутри архивируемого каталога не должен попасть сам в себя
+                    continue
+                arcname = os.path.relpath(entry.path, folder)
+                zinfo = zipfile.ZipInfo.from_file(entry.path, arcname, strict_timestamps=False)
+                future = None
+                if (not zinfo.is_dir() and level > 0
+                        and os.path.splitext(entry.name)[1].lower() not in STORED_EXTENSIONS):
+                    future = pool.submit(_deflate_member, entry.path, zinfo, level)
+                pending.append((entry.path, zinfo, future))
+                flush(2 * max(1, jobs))
+            flush(0)
+    except BaseException:
+        for _, _, future in pending:
+            if future is not None:
+                future.cancel()
+        if os.path.exists(archive_path):
+            os.unlink(archive_path)
+        raise
+
+    return stats.finish()
+
+
+def tar_codec_for(archive_path):
+    """Кодек по расширению архива; для незнакомых расширений — gz, как раньше"""
+    name = os.fspath(archive_path).lower()
+    for codec, (suffixes, _, _) in TAR_CODECS.items():
+        if name.endswith(suffixes):
+            return codec
+    return 'gz'
+
+
+class ParallelCompressor:
+    """Файловый объект для записи, сжимающий данные блоками в пуле потоков
+    (zlib, bz2 и lzma отпускают GIL). Сжатые блоки пишутся в fileobj в исходном
+    порядке; в работе не больше 2 * jobs блоков, поэтому память ограничена"""
+
+    def __init__(self, fileobj, compress, block_size, jobs=DEFAULT_ARCHIVE_JOBS):
+        self.fileobj = fileobj
+        self.compress = compress
+        self.block_size = block_size
+        self.jobs = max(1, jobs)
+        self._pool = ThreadPoolExecutor(max_workers=self.jobs)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._offset = 0
+        self._submitted = 0
+        self._written = 0
+        # Точки, с которых можно начать распаковку: (смещение в архиве, смещение в данных)
+        self.restart_points = []
+        self.closed = False
+
+    def write(self, data):
+        self._buffer += data
+        self._offset += len(data)
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def tell(self):
+        """Позиция в несжатых данных (нужна tarfile)"""
+        return self._offset
+
+    def _submit(self, block):
+        self._pending.append((self._pool.submit(self.compress, block), self._submitted))
+        self._submitted += len(block)
+        self._drain(2 * self.jobs)
+
+    def _drain(self, limit):
+        while len(self._pending) > limit:
+            future, offset = self._pending.popleft()
+            data = future.result()
+            self.restart_points.append((self._written, offset))
+            self.fileobj.write(data)
+            self._written += len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._buffer or not self._offset:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            self._drain(0)
+        finally:
+            for future, _ in self._pending:
+                future.cancel()
+            self._pool.shutdown()
+
+
+def open_decompressed(path):
+    """Файл на чтение с распаковкой по сигнатуре (gz, bz2, xz или без сжатия)"""
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    for magic, opener in COMPRESSED_MAGIC:
+        if head.startswith(magic):
+            return opener(path, 'rb')
+    return open(path, 'rb')
+
+
+@contextmanager
+def open_tar_stream(path):
+    """Последовательное чтение tar без перемотки. Потоковый режим tarfile
+    ('r|*') читает только первый член gzip и первый поток bz2/xz, поэтому
+    распаковка идёт через gzip/bz2/lzma, понимающие многочленные потоки"""
+    fileobj = open_decompressed(path)
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+            yield tar
+    finally:
+        fileobj.close()
+
+
+def write_tar(folder, archive_path, codec='gz', jobs=DEFAULT_ARCHIVE_JOBS, index=False, snapshot=None):
+    """Создание tar-архива с каталогом folder внутри. Сжатие — параллельно
+    по блокам (см. TAR_CODECS). При index рядом пишется индекс для быстрого
+    списка и выборочной распаковки. При ошибке недописанный архив удаляется.
+
+    С snapshot архив инкрементальный: в него попадают только новые и
+    изменённые с прошлого архива цепочки файлы (и все каталоги), а первым
+    членом — заголовок с уровнем и списком удалённых. Возвращает заголовок
+    (None для обычного архива)"""
+    folder = os.fspath(folder)
+    archive_path = os.fspath(archive_path)
+    _, compress, block_size = TAR_CODECS[codec]
+    header = selected = None
+    if snapshot is not None:
+        snapshot = os.fspath(snapshot)
+        chain, levels = load_snapshot(snapshot, folder)
+        if any(os.path.abspath(level['archive']) == os.path.abspath(archive_path) for level in levels):
+            raise FileExistsError(f"Архив {archive_path} уже входит в цепочку снимка {snapshot}")
+        manifest = _scan_manifest(folder, (archive_path, snapshot, snapshot + '.tmp'))
+        previous = _fold_levels(levels)
+        changed = {name: entry for name, entry in manifest.items() if previous.get(name) != entry}
+        # Сменивший тип путь (файл <-> каталог) перед распаковкой тоже удаляется
+        deleted = sorted(name for name, entry in previous.items()
+                         if name not in manifest or manifest[name][3] != entry[3])
+        selected = {name for name, entry in changed.items() if not entry[3]}
+        header = {
+            'chain': chain or uuid.uuid4().hex,
+            'level': len(levels),
+            'root': os.path.basename(folder),
+            'files': len(selected),
+            'deleted': deleted,
+        }
+    try:
+        with open(archive_path, 'wb') as raw:
+            out = raw if compress is None else ParallelCompressor(raw, compress, block_size, jobs)
+            try:
+                with tarfile.open(fileobj=out, mode='w') as tar:
+                    if header is not None:
+                        _add_incremental_header(tar, header)
+                    tar.add(folder, arcname=os.path.basename(folder),
+                            filter=_member_filter(tar, folder, archive_path, selected))
+                    members = tar.getmembers()
+            finally:
+                if out is not raw:
+                    out.close()
+        restart_points = [(0, 0)] if out is raw else out.restart_points
+    except BaseException:
+        if os.path.exists(archive_path):
+            os.unlink(archive_path)
+        raise
+
+    index_path = archive_path + TAR_INDEX_SUFFIX
+    if index:
+        _write_tar_index(archive_path, codec, restart_points, members)
+    elif os.path.exists(index_path):
+        # Индекс от прежнего архива с тем же именем больше не действителен
+        os.unlink(index_path)
+
+    if header is not None:
+        # Снимок обновляется только после того, как архив полностью записан
+        st = os.stat(archive_path)
+        levels.append({
+            'archive': os.path.abspath(archive_path),
+            'archive_size': st.st_size,
+            'archive_mtime_ns': st.st_mtime_ns,
+            'changed': changed,
+            'deleted': deleted,
+        })
+        _save_snapshot(snapshot, header['chain'], os.path.abspath(folder), levels)
+    return header
+
+
+def _scan_manifest(folder, skipped):
+    """Манифест каталога: {имя члена: [размер, mtime_ns, inode, каталог ли]}"""
+    skipped = {os.path.abspath(path) for path in skipped}
+    base = os.path.basename(folder)
+    manifest = {}
+    for entry in walk(folder, ignore_files=(), with_dirs=True, with_symlinks=True, skip_vcs=False):
+        if os.path.abspath(entry.path) in skipped:
+            continue
+        st = entry.stat(follow_symlinks=False)
+        is_dir = entry.is_dir(follow_symlinks=False)
+        name = base + '/' + os.path.relpath(entry.path, folder).replace(os.sep, '/')
+        manifest[name] = [0 if is_dir else st.st_size, st.st_mtime_ns, st.st_ino, is_dir]
+    return manifest
+
+
+def _fold_levels(levels):
+    """Состояние каталога на момент последнего архива цепочки"""
+    manifest = {}
+    for level in levels:
+        for name in level['deleted']:
+            manifest.pop(name, None)
+        manifest.update(level['changed'])
+    return manifest
+
+
+def load_snapshot(snapshot_path, folder):
+    """Цепочка снимка: (идентификатор, уровни). Уровни обрываются на первом
+    архиве, которого нет или который изменился (например, удалён undo), —
+    следующий архив тогда строится относительно последнего уцелевшего"""
+    try:
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None, []
+    if data['root'] != os.path.abspath(folder):
+        raise ValueError(f"Снимок {snapshot_path} относится к каталогу {data['root']}")
+    levels = []
+    for level in data['levels']:
+        try:
+            st = os.stat(level['archive'])
+        except OSError:
+            break
+        if (st.st_size, st.st_mtime_ns) != (level['archive_size'], level['archive_mtime_ns']):
+            break
+        levels.append(level)
+    return (data['chain'] if levels else None), levels
+
+
+def _save_snapshot(snapshot_path, chain, root, levels):
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'chain': chain, 'root': root, 'levels': levels}, f, ensure_ascii=False)
+    os.replace(tmp_path, snapshot_path)
+
+
+def _add_incremental_header(tar, header):
+    data = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    info = tarfile.TarInfo(TAR_INCREMENTAL_MEMBER)
+    info.size = len(data)
+    info.mtime = time.time()
+    info.offset = tar.offset
+    tar.addfile(info, io.BytesIO(data))
+
+
+def read_incremental_header(archive_path):
+    """Заголовок инкрементального архива или None для обычного"""
+    with open_tar_stream(archive_path) as tar:
+        member = next(iter(tar), None)
+        if member is None or member.name != TAR_INCREMENTAL_MEMBER:
+            return None
+        return json.load(tar.extractfile(member))
+
+
+def skip_incremental_header(member, path):
+    """Фильтр распаковки: 'data' без заголовка инкрементального архива"""
+    if member.name == TAR_INCREMENTAL_MEMBER:
+        return None
+    return tarfile.data_filter(member, path)
+
+
+def extract_tar_chain(archive_paths, extract_path):
+    """Восстановление из цепочки инкрементальных архивов: уровень 0, затем
+    остальные по порядку. Цепочка проверяется до распаковки; удалённые в
+    очередном архиве пути удаляются перед распаковкой его членов"""
+    extract_path = os.path.realpath(extract_path)
+    headers = []
+    for archive_path in archive_paths:
+        header = read_incremental_header(archive_path)
+        if header is None:
+            raise ValueError(f"{archive_path} не является инкрементальным архивом")
+        headers.append(header)
+    levels = [header['level'] for header in headers]
+    if levels != list(range(len(headers))):
+        raise ValueError(f"Нужна цепочка уровней 0, 1, 2... по порядку, получено: {levels}")
+    if len({header['chain'] for header in headers}) > 1:
+        raise ValueError("Архивы относятся к разным цепочкам снимков")
+
+    os.makedirs(extract_path, exist_ok=True)
+    for archive_path, header in zip(archive_paths, headers):
+        for name in header['deleted']:
+            _remove_member(extract_path, name)
+        with open_tar_stream(archive_path) as tar:
+            for member in tar:
+                if member.name != TAR_INCREMENTAL_MEMBER:
+                    tar.extract(member, extract_path, filter='data')
+    return headers
+
+
+def _remove_member(extract_path, name):
+    """Удаление пути из распакованного дерева; ссылки удаляются сами, без перехода по ним"""
+    parent = _safe_target(extract_path, os.path.dirname(name) or '.')
+    base = os.path.basename(name)
+    if base in ('', '.', '..'):
+        raise PermissionError(f"Некорректное имя в списке удалённых: {name}")
+    target = os.path.join(parent, base)
+    if os.path.isdir(target) and not os.path.islink(target):
+        shutil.rmtree(target)
+    elif os.path.lexists(target):
+        os.unlink(target)
+
+
+def _write_tar_index(archive_path, codec, restart_points, members):
+    st = os.stat(archive_path)
+    data = {
+        'codec': codec,
+        'archive_size': st.st_size,
+        'archive_mtime_ns': st.st_mtime_ns,
+        'restart_points': restart_points,
+        'members': [[m.name, m.offset, m.size, int(m.mtime), m.isdir()] for m in members],
+    }
+    index_path = archive_path + TAR_INDEX_SUFFIX
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+
+
+def load_tar_index(archive_path):
+    """Индекс архива или None, если его нет или архив с тех пор изменился"""
+    try:
+        with open(os.fspath(archive_path) + TAR_INDEX_SUFFIX, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        st = os.stat(archive_path)
+    except (OSError, ValueError):
+        return None
+    if (data.get('archive_size'), data.get('archive_mtime_ns')) != (st.st_size, st.st_mtime_ns):
+        return None
+    return data
+
+
+def list_tar(archive_path):
+    """Члены tar-архива: [(имя, размер, mtime, каталог ли)]. С индексом
+    архив не читается вовсе, без него — один последовательный проход"""
+    index = load_tar_index(archive_path)
+    if index is not None:
+        return [(name, size, mtime, is_dir) for name, _, size, mtime, is_dir in index['members']]
+    with open_tar_stream(archive_path) as tar:
+        return [(m.name, m.size, int(m.mtime), m.isdir()) for m in tar]
+
+
+def list_zip(archive_path):
+    """Члены ZIP-архива по центральному каталогу: [(имя, размер, mtime, каталог ли)]"""
+    with zipfile.ZipFile(archive_path) as zf:
+        return [(info.filename, info.file_size, time.mktime(info.date_time + (0, 0, -1)), info.is_dir())
+                for info in zf.infolist()]
+
+
+def _safe_target(extract_path, name):
+    """Путь распаковки члена. Как фильтр tarfile 'data', отказывает членам
+    с абсолютным путём и выходящим за папку назначения (через .. или ссылки)"""
+    if os.path.isabs(name) or os.path.splitdrive(name)[0]:
+        raise PermissionError(f"Член архива с абсолютным путём: {name}")
+    target = os.path.realpath(os.path.join(extract_path, name))
+    if os.path.commonpath([target, extract_path]) != extract_path:
+        raise PermissionError(f"Член архива {name} указывает за пределы {extract_path}")
+    return target
+
+
+def _extract_zip_batch(archive_path, batch):
+    # Каждый поток открывает собственный ZipFile: общий дескриптор не потокобезопасен
+    with zipfile.ZipFile(archive_path) as zf:
+        for info, target in batch:
+            with zf.open(info) as src, open(target, 'wb') as dst:
+                shutil.copyfileobj(src, dst, ARCHIVE_CHUNK_SIZE)
+
+
+def extract_zip(archive_path, extract_path, names=None, jobs=DEFAULT_ARCHIVE_JOBS):
+    """Распаковка ZIP-архива (или только членов names) пулом потоков.
+
+    Все пути проверяются до записи первого файла, каталоги создаются заранее
+    одним проходом, затем файлы распределяются между jobs потоками по размеру
+    (сначала крупные — в наименее загруженный поток). Возвращает число файлов"""
+    extract_path = os.path.realpath(extract_path)
+    with zipfile.ZipFile(archive_path) as zf:
+        infos = zf.infolist()
+    if names is not None:
+        wanted = set(names)
+        infos = [info for info in infos if info.filename in wanted]
+
+    dirs = {extract_path}
+    files = []
+    for info in infos:
+        target = _safe_target(extract_path, info.filename)
+        if info.is_dir():
+            dirs.add(target)
+        else:
+            dirs.add(os.path.dirname(target))
+            files.append((info, target))
+    for directory in sorted(dirs):
+        os.makedirs(directory, exist_ok=True)
+
+    jobs = max(1, min(jobs, len(files)))
+    if jobs == 1:
+        _extract_zip_batch(archive_path, files)
+        return len(files)
+
+    batches = [[] for _ in range(jobs)]
+    loads = [(0, i) for i in range(jobs)]
+    for info, target in sorted(files, key=lambda item: item[0].compress_size, reverse=True):
+        load, i = heapq.heappop(loads)
+        batches[i].append((info, target))
+        heapq.heappush(loads, (load + info.compress_size + 1, i))
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        for _ in pool.map(lambda batch: _extract_zip_batch(archive_path, batch), batches):
+            pass
+    return len(files)
+
+
+def member_matches(name, patterns):
+    """Имя члена подходит под шаблон (glob) или лежит внутри указанного каталога"""
+    name = name.rstrip('/')
+    for pattern in patterns:
+        pattern = pattern.rstrip('/')
+        if fnmatch(name, pattern) or name.startswith(pattern + '/'):
+            return True
+    return False
+
+
+def _is_literal(pattern):
+    return not any(char in pattern for char in '*?[')
+
+
+def extract_tar_members(archive_path, patterns, extract_path):
+    """Выборочная распаковка членов tar, подходящих под patterns.
+
+    С индексом каждый член читается с ближайшей точки перезапуска перед ним,
+    без распаковки предыдущих данных. Без индекса — один проход по архиву,
+    который прекращается, как только найдены все члены, заданные точными
+    именами файлов. Возвращает имена распакованных членов"""
+    index = load_tar_index(archive_path)
+    if index is None:
+        return _extract_tar_sequential(archive_path, patterns, extract_path)
+
+    wanted = sorted((offset, name) for name, offset, _, _, _ in index['members']
+                    if member_matches(name, patterns))
+    points = index['restart_points']
+    starts = [u for _, u in points]
+    reader = TAR_READERS[index['codec']]
+    extracted = []
+    with open(archive_path, 'rb') as raw:
+        for offset, name in wanted:
+            compressed, start = points[bisect_right(starts, offset) - 1]
+            stream = reader(raw)
+            if stream is raw:
+                # Архив без сжатия: смещение в данных — это смещение в файле
+                raw.seek(offset)
+            else:
+                raw.seek(compressed)
+                _skip_bytes(stream, offset - start)
+            with tarfile.open(fileobj=stream, mode='r|') as tar:
+                member = next(iter(tar), None)
+                if member is None or member.name != name:
+                    raise tarfile.ReadError(f"индекс архива не соответствует содержимому: {name}")
+                tar.extract(member, extract_path, filter='data')
+            extracted.append(name)
+    return extracted
+
+
+def _skip_bytes(stream, count):
+    while count > 0:
+        chunk = stream.read(min(count, ARCHIVE_CHUNK_SIZE))
+        if not chunk:
+            raise EOFError("архив короче, чем указано в индексе")
+        count -= len(chunk)
+
+
+def _extract_tar_sequential(archive_path, patterns, extract_path):
+    remaining = {pattern.rstrip('/') for pattern in patterns if _is_literal(pattern)}
+    stop_when_found = len(remaining) == len(patterns)
+    extracted = []
+    with open_tar_stream(archive_path) as tar:
+        for member in tar:
+            if not member_matches(member.name, patterns):
+                continue
+            tar.extract(member, extract_path, filter='data')
+            extracted.append(member.name)
+            if not member.isdir():
+                remaining.discard(member.name)
+            if stop_when_found and not remaining:
+                break
+    return extracted
+
+
+def _member_filter(tar, folder, archive_path, selected=None):
+    """Фильтр tarfile: исключает сам создаваемый архив, если он лежит внутри
+    архивируемого каталога, и запоминает смещение заголовка члена для индекса.
+    При selected из файлов берутся только перечисленные (каталоги — все)"""
+    rel = os.path.relpath(os.path.abspath(archive_path), os.path.abspath(folder))
+    skipped = os.path.join(os.path.basename(folder), rel).replace(os.sep, '/')
+
+    def member_filter(tarinfo):
+        if tarinfo.name == skipped:
+            return None
+        if selected is not None and not tarinfo.isdir() and tarinfo.name not in selected:
+            return None
+        # В режиме записи tarfile не заполняет offset; заголовок ляжет в tar.offset
+        tarinfo.offset = tar.offset
+        return tarinfo
+    return member_filter
@@ -1,7 +1,13 @@
-import shutil
 import tarfile
+import time
 import zipfile
 from pathlib import Path
+from ..archiver import (
+    DEFAULT_ARCHIVE_JOBS, DEFAULT_ZIP_LEVEL, TAR_CODECS, extract_tar_chain, extract_tar_members,
+    extract_zip, list_tar, list_zip, member_matches, skip_incremental_header, tar_codec_for,
+    write_tar, write_zip
+)
+from ..validator import resolve_path
 from ..logger import setup_logger
 
 logger = setup_logger()
@@ -11,18 +17,92 @@ class ArchiveCommands:
     def __init__(self, history_manager=None, undo_manager=None):
         self.history_manager = history_manager
         self.undo_manager = undo_manager
+
+    def _begin(self, operation, source, destination):
+        """Запись операции в журнал отмены до создания архива"""
+        if not self.undo_manager:
+            return None
+        return self.undo_manager.begin_operation(
+            operation,
+            str(source),
+            str(destination),
+            cmd_index=self.history_manager.current_index() if self.history_manager else None,
+            details={'existed': Path(destination).exists()}
+        )
+
+    def _commit(self, record):
+        if record is not None:
+            self.undo_manager.commit_operation(record)
+
+    def _abort(self, record):
+        if record is not None:
+            self.undo_manager.abort_operation(record)
+
+    def _list(self, command, args, lister):
+        """Список членов архива (zip -t, tar -t)"""
+        if len(args) != 1:
+            print(f"Использование: {command} -t <архив>")
+            return False
+        try:
+            archive_path = resolve_path(args[0])
+            if not archive_path.is_file():
+                print(f"Ошибка: Архив {archive_path} не существует")
+                return False
+            members = lister(archive_path)
+            for name, size, mtime, is_dir in members:
+                modified = time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime))
+                suffix = '/' if is_dir and not name.endswith('/') else ''
+                print(f"{size:>12}  {modified}  {name}{suffix}")
+            print(f"Всего: {len(members)}")
+            logger.info(f"{command} -t {args[0]} OK")
+            return True
+        except Exception as e:
+            print(f"Ошибка: {e}")
+            logger.error(f"{command} -t {args[0]} ERROR: {e}")
+            return False
     
     def zip(self, args):
-        """Создание ZIP-архива из папки"""
-        if len(args) < 2:
-            print("Использование: zip <folder> <archive.zip>")
+        """Создание ZIP-архива из папки; -j N — потоков сжатия, --level 0-9 — степень сжатия"""
+        usage = "Использование: zip [-j N] [--level 0-9] <folder> <archive.zip> | zip -t <archive.zip>"
+        if args and args[0] == "-t":
+            return self._list("zip", args[1:], list_zip)
+        jobs = DEFAULT_ARCHIVE_JOBS
+        level = DEFAULT_ZIP_LEVEL
+        clean_args = []
+
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-j" or (arg.startswith("-j") and arg[2:].isdigit()):
+                value = arg[2:]
+                if not value:
+                    i += 1
+                    value = args[i] if i < len(args) else ""
+                if not value.isdigit() or int(value) < 1:
+                    print(f"Ошибка: Некорректное число потоков для -j: {value}")
+                    return False
+                jobs = int(value)
+            elif arg == "--level":
+                i += 1
+                value = args[i] if i < len(args) else ""
+                if not value.isdigit() or int(value) > 9:
+                    print(f"Ошибка: Степень сжатия должна быть от 0 до 9: {value}")
+                    return False
+                level = int(value)
+            else:
+                clean_args.append(arg)
+            i += 1
+
+        if len(clean_args) != 2:
+            print(usage)
             return False
-            
-        folder, archive = args
+
+        folder, archive = clean_args
+        record = None
         
         try:
-            folder_path = Path(folder).resolve()
-            archive_path = Path(archive).resolve()
+            folder_path = resolve_path(folder)
+            archive_path = resolve_path(archive)
             
             if not folder_path.exists():
                 print(f"Ошибка: Папка {folder_path} не существует")
@@ -32,37 +112,56 @@ class ArchiveCommands:
                 print(f"Ошибка: {folder_path} не является директорией")
                 return False
             
-            shutil.make_archive(str(archive_path).replace('.zip', ''), 'zip', folder_path)
-            
-            if self.undo_manager:
-                self.undo_manager.record_operation(
-                    'zip',
-                    str(folder_path),
-                    str(archive_path),
-                    cmd_index=len(self.history_manager.history) if self.history_manager else None
-                )
+            record = self._begin('zip', folder_path, archive_path)
+            stats = write_zip(folder_path, archive_path, jobs, level)
+            self._commit(record)
             
             print(f"ZIP архив создан: {archive_path}")
+            print(f"Итого {stats.summary()}")
             logger.info(f"zip {folder} {archive} OK")
             return True
             
         except Exception as e:
+            self._abort(record)
             print(f"Ошибка: {e}")
             logger.error(f"zip {folder} {archive} ERROR: {e}")
             return False
     
     def unzip(self, args):
-        """Распаковывка ZIP-архива"""
-        if len(args) < 1:
-            print("Использование: unzip <archive.zip> [extract_path]")
+        """Распаковка ZIP-архива целиком или только указанных членов (имена и glob),
+        -j N — число потоков. Старая форма unzip <архив> <папка> работает, если
+        папка не совпадает с членом архива"""
+        usage = "Использование: unzip [-j N] <archive.zip> [член...] [-d extract_path]"
+        positional = []
+        extract_path = None
+        jobs = DEFAULT_ARCHIVE_JOBS
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-d" and i + 1 < len(args):
+                extract_path = args[i + 1]
+                i += 1
+            elif arg == "-j" or (arg.startswith("-j") and arg[2:].isdigit()):
+                value = arg[2:]
+                if not value:
+                    i += 1
+                    value = args[i] if i < len(args) else ""
+                if not value.isdigit() or int(value) < 1:
+                    print(f"Ошибка: Некорректное число потоков для -j: {value}")
+                    return False
+                jobs = int(value)
+            else:
+                positional.append(arg)
+            i += 1
+
+        if not positional:
+            print(usage)
             return False
-            
-        archive = args[0]
-        extract_path = args[1] if len(args) > 1 else "."
+
+        archive, patterns = positional[0], positional[1:]
         
         try:
-            archive_path = Path(archive).resolve()
-            extract_path = Path(extract_path).resolve()
+            archive_path = resolve_path(archive)
             
             if not archive_path.exists():
                 print(f"Ошибка: Архив {archive_path} не существует")
@@ -73,28 +172,86 @@ class ArchiveCommands:
                 return False
             
             with zipfile.ZipFile(archive_path, 'r') as zf:
-                zf.extractall(extract_path)
+                names = zf.namelist()
+                if (extract_path is None and len(patterns) == 1
+                        and not any(member_matches(name, patterns) for name in names)):
+                    extract_path, patterns = patterns[0], []
+                extract_path = resolve_path(extract_path or ".")
+
+                selected = None
+                if patterns:
+                    missing = [p for p in patterns if not any(member_matches(n, [p]) for n in names)]
+                    if missing:
+                        print(f"Ошибка: В архиве нет: {', '.join(missing)}")
+                        return False
+                    selected = [name for name in names if member_matches(name, patterns)]
+
+            count = extract_zip(archive_path, extract_path, selected, jobs)
+            if selected is not None:
+                print(f"Распаковано членов: {count}")
             
             print(f"Архив распакован в: {extract_path}")
-            logger.info(f"unzip {archive} {extract_path if len(args) > 1 else ''} OK")
+            logger.info(f"unzip {' '.join(args)} OK")
             return True
             
         except Exception as e:
             print(f"Ошибка: {e}")
-            logger.error(f"unzip {archive} {extract_path if len(args) > 1 else ''} ERROR: {e}")
+            logger.error(f"unzip {' '.join(args)} ERROR: {e}")
             return False
     
     def tar(self, args):
-        """Создание TAR.GZ архива из папки"""
-        if len(args) < 2:
-            print("Использование: tar <folder> <archive.tar.gz>")
+        """Создание tar-архива из папки; кодек — по расширению или --codec gz|bz2|xz|none.
+        --incremental <снимок> — только новые и изменённые со времени прошлого архива файлы"""
+        usage = ("Использование: tar [-j N] [--codec gz|bz2|xz|none] [--index] [--incremental снимок]"
+                 " <folder> <archive.tar.gz> | tar -t <archive>")
+        if args and args[0] == "-t":
+            return self._list("tar", args[1:], list_tar)
+        jobs = DEFAULT_ARCHIVE_JOBS
+        codec = None
+        index = False
+        snapshot = None
+        clean_args = []
+
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-j" or (arg.startswith("-j") and arg[2:].isdigit()):
+                value = arg[2:]
+                if not value:
+                    i += 1
+                    value = args[i] if i < len(args) else ""
+                if not value.isdigit() or int(value) < 1:
+                    print(f"Ошибка: Некорректное число потоков для -j: {value}")
+                    return False
+                jobs = int(value)
+            elif arg == "--codec":
+                i += 1
+                codec = args[i] if i < len(args) else ""
+                if codec not in TAR_CODECS:
+                    print(f"Ошибка: Неизвестный кодек: {codec} (допустимы: {', '.join(TAR_CODECS)})")
+                    return False
+            elif arg == "--index":
+                index = True
+            elif arg == "--incremental":
+                i += 1
+                snapshot = args[i] if i < len(args) else ""
+                if not snapshot:
+                    print(usage)
+                    return False
+            else:
+                clean_args.append(arg)
+            i += 1
+
+        if len(clean_args) != 2:
+            print(usage)
             return False
-            
-        folder, archive = args
+
+        folder, archive = clean_args
+        record = None
         
         try:
-            folder_path = Path(folder).resolve()
-            archive_path = Path(archive).resolve()
+            folder_path = resolve_path(folder)
+            archive_path = resolve_path(archive)
             
             if not folder_path.exists():
                 print(f"Ошибка: Папка {folder_path} не существует")
@@ -104,38 +261,56 @@ class ArchiveCommands:
                 print(f"Ошибка: {folder_path} не является директорией")
                 return False
             
-            with tarfile.open(archive_path, "w:gz") as tar:
-                tar.add(folder_path, arcname=folder_path.name)
+            codec = codec or tar_codec_for(archive_path)
+            record = self._begin('tar', folder_path, archive_path)
+            # В журнал отмены попадает только сам архив: снимок сверяет уровни
+            # с их архивами, и удалённый undo уровень при следующем запуске отбрасывается
+            header = write_tar(folder_path, archive_path, codec, jobs, index,
+                               resolve_path(snapshot) if snapshot else None)
+            self._commit(record)
             
-            if self.undo_manager:
-                self.undo_manager.record_operation(
-                    'tar',
-                    str(folder_path),
-                    str(archive_path),
-                    cmd_index=len(self.history_manager.history) if self.history_manager else None
-                )
-            
-            print(f"TAR.GZ архив создан: {archive_path}")
-            logger.info(f"tar {folder} {archive} OK")
+            kind = "TAR" if codec == 'none' else f"TAR.{codec.upper()}"
+            print(f"{kind} архив создан: {archive_path}")
+            if header is not None:
+                print(f"Уровень {header['level']}: файлов {header['files']}, удалено {len(header['deleted'])}")
+            logger.info(f"tar {' '.join(args)} OK")
             return True
             
         except Exception as e:
+            self._abort(record)
             print(f"Ошибка: {e}")
-            logger.error(f"tar {folder} {archive} ERROR: {e}")
+            logger.error(f"tar {' '.join(args)} ERROR: {e}")
             return False
     
     def untar(self, args):
-        """Распаковка TAR.GZ архива"""
-        if len(args) < 1:
-            print("Использование: untar <archive.tar.gz> [extract_path]")
+        """Распаковка tar-архива (без сжатия, gz, bz2 или xz) целиком или только
+        членов, подходящих под --member ШАБЛОН. --incremental — восстановление
+        из цепочки инкрементальных архивов (уровень 0, затем остальные по порядку)"""
+        usage = ("Использование: untar <archive.tar.gz> [extract_path] [--member ШАБЛОН]..."
+                 " | untar --incremental <архив уровня 0> <архив>... [-d extract_path]")
+        if args and args[0] == "--incremental":
+            return self._untar_chain(args[1:], usage)
+        positional = []
+        patterns = []
+        i = 0
+        while i < len(args):
+            if args[i] == "--member" and i + 1 < len(args):
+                patterns.append(args[i + 1])
+                i += 2
+                continue
+            positional.append(args[i])
+            i += 1
+
+        if not positional or len(positional) > 2:
+            print(usage)
             return False
             
-        archive = args[0]
-        extract_path = args[1] if len(args) > 1 else "."
+        archive = positional[0]
+        extract_path = positional[1] if len(positional) > 1 else "."
         
         try:
-            archive_path = Path(archive).resolve()
-            extract_path = Path(extract_path).resolve()
+            archive_path = resolve_path(archive)
+            extract_path = resolve_path(extract_path)
             
             if not archive_path.exists():
                 print(f"Ошибка: Архив {archive_path} не существует")
@@ -145,14 +320,60 @@ class ArchiveCommands:
                 print(f"Ошибка: {archive_path} не является TAR-архивом")
                 return False
             
-            with tarfile.open(archive_path, "r:gz") as tar:
-                tar.extractall(path=extract_path, filter='data')
+            if patterns:
+                # Выборочно: по индексу (tar --index) — сразу с нужного места архива
+                extracted = extract_tar_members(archive_path, patterns, extract_path)
+                missing = [p for p in patterns if not any(member_matches(n, [p]) for n in extracted)]
+                if missing:
+                    print(f"Ошибка: В архиве нет: {', '.join(missing)}")
+                    return False
+                print(f"Распаковано членов: {len(extracted)}")
+            else:
+                # Кодек (gz, bz2, xz или без сжатия) определяется по содержимому
+                with tarfile.open(archive_path, "r:*") as tar:
+                    tar.extractall(path=extract_path, filter=skip_incremental_header)
             
             print(f"Архив распакован в: {extract_path}")
-            logger.info(f"untar {archive} {extract_path if len(args) > 1 else ''} OK")
+            logger.info(f"untar {' '.join(args)} OK")
             return True
             
         except Exception as e:
             print(f"Ошибка: {e}")
-            logger.error(f"untar {archive} {extract_path if len(args) > 1 else ''} ERROR: {e}")
-            return False
\ No newline at end of file
+            logger.error(f"untar {' '.join(args)} ERROR: {e}")
+            return False
+
+    def _untar_chain(self, args, usage):
+        """untar --incremental: архивы цепочки по порядку, затем -d папка"""
+        archives = []
+        extract_path = "."
+        i = 0
+        while i < len(args):
+            if args[i] == "-d" and i + 1 < len(args):
+                extract_path = args[i + 1]
+                i += 2
+                continue
+            archives.append(args[i])
+            i += 1
+
+        if not archives:
+            print(usage)
+            return False
+
+        try:
+            archive_paths = [resolve_path(archive) for archive in archives]
+            for archive_path in archive_paths:
+                if not archive_path.is_file():
+                    print(f"Ошибка: Архив {archive_path} не существует")
+                    return False
+            extract_path = resolve_path(extract_path)
+
+            headers = extract_tar_chain(archive_paths, extract_path)
+            print(f"Восстановлено из архивов: {len(headers)} (уровни 0-{headers[-1]['level']})")
+            print(f"Архив распакован в: {extract_path}")
+            logger.info(f"untar --incremental {' '.join(args)} OK")
+            return True
+
+        except Exception as e:
+            print(f"Ошибка: {e}")
+            logger.error(f"untar --incremental {' '.join(args)} ERROR: {e}")
+            return False
@@ -1,96 +1,275 @@
 import os
 import shutil
 import stat
+import sys
+import tempfile
 import time
+from collections import deque
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 from ..validator import (
-    ensure_exists, ensure_is_dir, ensure_is_file, ensure_not_root
+    change_working_dir, ensure_exists, ensure_is_dir, ensure_is_file, ensure_not_root,
+    resolve_path, working_dir
 )
+from ..copier import (
+    DEFAULT_COPY_JOBS, SYNC_MTIME_WINDOW_NS, apply_sync, copy_file, copy_tree, plan_sync
+)
+from ..trash import TrashStore
+from ..pipeline import BinaryOutput, drain, iter_lines
 from ..logger import setup_logger
 
+try:
+    import grp
+    import pwd
+except ImportError:  # Windows
+    grp = pwd = None
+
 logger = setup_logger()
 
+# Размер блока при потоковом выводе файлов
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Размер блока, которым tail читает файл с конца
+TAIL_BLOCK_SIZE = 64 * 1024
+
+# Интервалы опроса файла в tail -f: при простое пауза растёт от минимума до максимума
+FOLLOW_MIN_INTERVAL = 0.05
+FOLLOW_MAX_INTERVAL = 1.0
+
+
+def _sendfile_to_stdout(f):
+    """Копирование файла с текущей позиции до конца в stdout средствами ядра
+    (os.sendfile), если stdout — канал или обычный файл. False, если нельзя"""
+    if not hasattr(os, 'sendfile'):
+        return False
+    try:
+        out_fd = sys.stdout.fileno()
+        mode = os.fstat(out_fd).st_mode
+    except (AttributeError, OSError, ValueError):
+        return False
+    if not (stat.S_ISFIFO(mode) or stat.S_ISREG(mode)):
+        return False
+
+    sys.stdout.flush()
+    offset = f.tell()
+    size = os.fstat(f.fileno()).st_size
+    while offset < size:
+        try:
+            sent = os.sendfile(out_fd, f.fileno(), offset, size - offset)
+        except OSError:
+            if offset == f.tell():
+                return False
+            raise
+        if sent == 0:
+            break
+        offset += sent
+    f.seek(offset)
+    return True
+
+
+def _stream_to_stdout(f):
+    """Потоковый вывод двоичного файла с текущей позиции до конца"""
+    if _sendfile_to_stdout(f):
+        return
+    out = BinaryOutput()
+    for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b''):
+        out.write(chunk)
+    out.close()
+
+
+def _tail_offset(f, count):
+    """Смещение начала последних count строк: файл читается блоками с конца,
+    поэтому время не зависит от его размера"""
+    size = f.seek(0, os.SEEK_END)
+    if count == 0 or size == 0:
+        return size
+
+    # Перевод строки в самом конце файла не начинает новую строку
+    f.seek(size - 1)
+    pos = size - 1 if f.read(1) == b'\n' else size
+
+    found = 0
+    while pos > 0:
+        start = max(0, pos - TAIL_BLOCK_SIZE)
+        f.seek(start)
+        block = f.read(pos - start)
+        idx = len(block)
+        while True:
+            idx = block.rfind(b'\n', 0, idx)
+            if idx == -1:
+                break
+            found += 1
+            if found == count:
+                return start + idx + 1
+        pos = start
+    return 0
+
+
+def _parse_line_count(args, usage, default_file=None, known_flags=()):
+    """Разбор аргументов head/tail: ([-n N] <файл>) -> (N, файл, флаги из known_flags).
+    default_file подставляется, если файл не указан (в конвейере — "-", вход);
+    на незнакомый флаг выводится usage"""
+    count = 10
+    flags = []
+    positional = []
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == "-n" or (arg.startswith("-n") and len(arg) > 2):
+            value = arg[2:]
+            if not value:
+                i += 1
+                value = args[i] if i < len(args) else ""
+            if not value.isdigit():
+                print(f"Ошибка: Некорректное число строк: {value}")
+                return None
+            count = int(value)
+        elif arg.startswith("-") and len(arg) > 1:
+            if arg not in known_flags:
+                print(usage)
+                return None
+            flags.append(arg)
+        else:
+            positional.append(arg)
+        i += 1
+
+    if not positional:
+        if default_file is None:
+            print(usage)
+            return None
+        positional.append(default_file)
+    return count, positional[0], flags
+
+
+@lru_cache(maxsize=None)
+def _login_name():
+    try:
+        return os.getlogin()
+    except OSError:
+        return "user"
+
+
+@lru_cache(maxsize=None)
+def _user_name(uid):
+    """Имя владельца по uid (кэшируется: в каталоге обычно мало разных владельцев)"""
+    if pwd is None:
+        return _login_name()
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+@lru_cache(maxsize=None)
+def _group_name(gid):
+    if grp is None:
+        return _login_name()
+    try:
+        return grp.getgrgid(gid).gr_name
+    except KeyError:
+        return str(gid)
+
+
+def _ls_line(entry, long_format):
+    """Строка вывода ls для os.DirEntry; stat выполняется не больше одного раза"""
+    name = entry.name
+    if entry.is_dir():
+        name += '/'
+    elif entry.is_symlink():
+        name += '@'
+    elif entry.stat().st_mode & stat.S_IXUSR:
+        name += '*'
+
+    if not long_format:
+        return name
+
+    # Результат stat кэшируется в DirEntry, повторного системного вызова нет
+    stat_info = entry.stat()
+    permissions = stat.filemode(stat_info.st_mode)
+    owner = _user_name(stat_info.st_uid)
+    group = _group_name(stat_info.st_gid)
+    mtime = time.strftime('%b %d %H:%M', time.localtime(stat_info.st_mtime))
+    return (f"{permissions} {stat_info.st_nlink:2} {owner:8} {group:8} "
+            f"{stat_info.st_size:8} {mtime} {name}")
+
+
 class   BasicCommands:
     
     def __init__(self, history_manager=None, undo_manager=None):
         self.history_manager = history_manager
         self.undo_manager = undo_manager
+        self._default_trash_dir = (Path("data") / ".trash").resolve()
     
 
     def ls(self, args):
+        usage = "Использование: ls [-l] [-U] [--limit N] [--offset N] [путь]"
         long_format = False
+        unsorted = False
+        limit = None
+        offset = 0
         path = "."
-        
-        if args:
-            if args[0] == "-l":
+
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            value = None
+            if arg.startswith("--") and "=" in arg:
+                arg, value = arg.split("=", 1)
+            elif arg in ("--limit", "--offset"):
+                i += 1
+                value = args[i] if i < len(args) else ""
+
+            if arg == "-l":
                 long_format = True
-                if len(args) > 1:
-                    path = args[1]
+            elif arg == "-U":
+                unsorted = True
+            elif arg in ("--limit", "--offset"):
+                if not value.isdigit():
+                    print(usage)
+                    return False
+                if arg == "--limit":
+                    limit = int(value)
+                else:
+                    offset = int(value)
             else:
-                path = args[0]
-        
+                path = arg
+            i += 1
+
         try:
-            target_path = Path(path).resolve()
+            target_path = resolve_path(path)
             ensure_exists(target_path)
             ensure_is_dir(target_path)
-            
-            items = list(target_path.iterdir())
-            if not items:
-                print("Директория пуста")
-                return True
-            
-            if long_format:
-                for item in sorted(items):
+
+            with os.scandir(target_path) as it:
+                if unsorted:
+                    # Вывод начинается сразу, без чтения всего каталога
+                    entries = it
+                else:
+                    entries = sorted(it, key=lambda entry: entry.name)
+
+                stop = None if limit is None else offset + limit
+                empty = True
+                for entry in islice(entries, offset, stop):
+                    empty = False
                     try:
-                        stat_info = item.stat()
-
-                        if item.is_dir():
-                            file_type = 'd'
-                        else:
-                            file_type = '-'
-                        
-                        mode = stat_info.st_mode
-                        permissions = file_type + 'rw-r--r--'
-                        nlinks = 1
-                        try:
-                            owner = os.getlogin()
-                        except OSError:
-                            owner = "user"
-                        group = owner
-                        size = stat_info.st_size
-                        mtime = time.strftime('%b %d %H:%M', time.localtime(stat_info.st_mtime))
-                        
-                        name = item.name
-                        if item.is_dir():
-                            name += '/'
-                        elif item.is_symlink():
-                            name += '@'
-                        elif mode & stat.S_IXUSR:
-                            name += '*'
-                        
-                        print(f"{permissions} {nlinks:2} {owner:8} {group:8} {size:8} {mtime} {name}")
-                        
-                    except Exception as e:
-                        print(f"? ? ? ? ? ? ? {item.name}")
-            else:
-                for item in sorted(items):
-                    name = item.name
-                    if item.is_dir():
-                        name += '/'
-                    elif item.is_symlink():
-                        name += '@'
-                    elif item.stat().st_mode & stat.S_IXUSR:
-                        name += '*'
-                    print(name)
-            
+                        line = _ls_line(entry, long_format)
+                    except OSError:
+                        line = f"? ? ? ? ? ? ? {entry.name}" if long_format else entry.name
+                    sys.stdout.write(line + "\n")
+
+            if empty and offset == 0 and limit != 0:
+                print("Директория пуста")
+
             logger.info(f"ls {' '.join(args)} OK")
             return True
-            
+
         except Exception as e:
             print(f"Ошибка: {e}")
             logger.error(f"ls {' '.join(args)} ERROR: {e}")
             return False
-    
+
     def cd(self, args):
         if args:
             path = args[0]
@@ -98,17 +277,17 @@ class   BasicCommands:
             path = os.path.expanduser("~")
         
         try:
-            target_path = Path(path).resolve()
+            target_path = resolve_path(path)
             
             if path == "~":
                 target_path = Path.home()
             elif path == "..":
-                target_path = Path.cwd().parent
+                target_path = Path(working_dir()).parent
             
             ensure_exists(target_path)
             ensure_is_dir(target_path)
             
-            os.chdir(target_path)
+            change_working_dir(target_path)
             logger.info(f"cd {path} OK")
             return True
             
@@ -126,39 +305,248 @@ class   BasicCommands:
         filename = args[0]
         
         try:
-            file_path = Path(filename).resolve()
-            ensure_exists(file_path)
-            ensure_is_file(file_path)
-            
-            with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
-                print(f.read())
+            # Вне конвейера файл выводится через sendfile, без чтения в Python
+            with self._open_cat_file(filename) as f:
+                _stream_to_stdout(f)
             
             logger.info(f"cat {filename} OK")
             return True
         
+        except Exception as e:
+            return self._cat_failed(filename, e)
+
+    def _open_cat_file(self, filename):
+        """Файл для cat и cat в конвейере: проверки пути и открытие на чтение"""
+        file_path = resolve_path(filename)
+        ensure_exists(file_path)
+        ensure_is_file(file_path)
+        return open(file_path, 'rb')
+
+    def _cat_failed(self, filename, error):
+        print(f"Ошибка при работе с файлом '{filename}': {error}")
+        logger.error(f"cat '{filename}' ERROR: {error}")
+        return False
+    
+    def head(self, args):
+        """Вывод первых N строк файла"""
+        return drain(self.head_stream(args))
+
+    def cat_stream(self, args, stdin=None):
+        """cat в конвейере: блоки файла или, без аргументов, входной поток"""
+        if not args:
+            if stdin is None:
+                print("Не указан файл для просмотра")
+                return False
+            yield from stdin
+            return True
+
+        filename = args[0]
+        if stdin is not None:
+            stdin.close()
+        try:
+            with self._open_cat_file(filename) as f:
+                yield from iter(lambda: f.read(STREAM_CHUNK_SIZE), b'')
+            logger.info(f"cat {filename} OK")
+            return True
+        except Exception as e:
+            return self._cat_failed(filename, e)
+
+    def head_stream(self, args, stdin=None):
+        """Первые N строк файла или входного потока; после них чтение
+        прекращается, и вышестоящая стадия конвейера закрывается"""
+        usage = "Использование: head [-n N] <файл>"
+        parsed = _parse_line_count(args, usage, "-" if stdin is not None else None)
+        if parsed is None:
+            return False
+        count, filename, _ = parsed
+
+        try:
+            f = None
+            if stdin is not None and filename == "-":
+                chunks = stdin
+            else:
+                file_path = resolve_path(filename)
+                ensure_exists(file_path)
+                ensure_is_file(file_path)
+                f = open(file_path, 'rb')
+                chunks = iter(lambda: f.read(STREAM_CHUNK_SIZE), b'')
+
+            try:
+                remaining = count
+                for chunk in chunks:
+                    if not remaining:
+                        break
+                    pos = 0
+                    while remaining:
+                        idx = chunk.find(b'\n', pos)
+                        if idx == -1:
+                            break
+                        remaining -= 1
+                        pos = idx + 1
+                    yield chunk if remaining else chunk[:pos]
+            finally:
+                if f is not None:
+                    f.close()
+                if stdin is not None:
+                    stdin.close()
+
+            logger.info(f"head {' '.join(args)} OK")
+            return True
+
         except Exception as e:
             print(f"Ошибка при работе с файлом '{filename}': {e}")
-            logger.error(f"cat '{filename}' ERROR: {e}")
+            logger.error(f"head {' '.join(args)} ERROR: {e}")
             return False
-    
+
+    def tail_stream(self, args, stdin=None):
+        """Последние N строк файла или входного потока (в памяти — только N строк)"""
+        usage = "Использование: tail [-n N] <файл>"
+        parsed = _parse_line_count(args, usage, "-" if stdin is not None else None, known_flags=("-f",))
+        if parsed is None:
+            return False
+        count, filename, flags = parsed
+        if flags:
+            print(f"Ошибка: {' '.join(flags)} не поддерживается в конвейере")
+            return False
+
+        try:
+            if stdin is not None and filename == "-":
+                last = deque(maxlen=count) if count else None
+                for line in iter_lines(stdin):
+                    if last is not None:
+                        last.append(line)
+                yield from last or ()
+            else:
+                if stdin is not None:
+                    stdin.close()
+                file_path = resolve_path(filename)
+                ensure_exists(file_path)
+                ensure_is_file(file_path)
+                with open(file_path, 'rb') as f:
+                    f.seek(_tail_offset(f, count))
+                    yield from iter(lambda: f.read(STREAM_CHUNK_SIZE), b'')
+
+            logger.info(f"tail {' '.join(args)} OK")
+            return True
+
+        except Exception as e:
+            print(f"Ошибка при работе с файлом '{filename}': {e}")
+            logger.error(f"tail {' '.join(args)} ERROR: {e}")
+            return False
+
+    def tail(self, args):
+        """Вывод последних N строк файла"""
+        parsed = _parse_line_count(args, "Использование: tail [-n N] [-f] <файл>", known_flags=("-f",))
+        if parsed is None:
+            return False
+        count, filename, flags = parsed
+        follow = "-f" in flags
+
+        try:
+            file_path = resolve_path(filename)
+            ensure_exists(file_path)
+            ensure_is_file(file_path)
+
+            with open(file_path, 'rb') as f:
+                f.seek(_tail_offset(f, count))
+                if follow:
+                    self._follow(file_path, f)
+                else:
+                    _stream_to_stdout(f)
+
+            logger.info(f"tail {' '.join(args)} OK")
+            return True
+
+        except Exception as e:
+            print(f"Ошибка при работе с файлом '{filename}': {e}")
+            logger.error(f"tail {' '.join(args)} ERROR: {e}")
+            return False
+
+    def _follow(self, file_path, f):
+        """Вывод дописываемых в файл данных (tail -f) до нажатия Ctrl-C.
+
+        Дескриптор остаётся открытым и читаются только новые байты. Усечение
+        файла определяется по размеру, ротация — по смене inode"""
+        out = BinaryOutput()
+        interval = FOLLOW_MIN_INTERVAL
+        # Исходный дескриптор закрывает вызывающий, открытый при ротации — мы
+        reopened = None
+
+        try:
+            while True:
+                chunk = f.read(STREAM_CHUNK_SIZE)
+                if chunk:
+                    out.write(chunk)
+                    out.flush()
+                    interval = FOLLOW_MIN_INTERVAL
+                    continue
+
+                current = os.fstat(f.fileno())
+                try:
+                    latest = os.stat(file_path)
+                except FileNotFoundError:
+                    latest = None
+
+                if latest is not None and (latest.st_ino, latest.st_dev) != (current.st_ino, current.st_dev):
+                    logger.info(f"tail -f {file_path}: файл заменён, открыт заново")
+                    if reopened is not None:
+                        reopened.close()
+                    f = reopened = open(file_path, 'rb')
+                    interval = FOLLOW_MIN_INTERVAL
+                    continue
+
+                if current.st_size < f.tell():
+                    logger.info(f"tail -f {file_path}: файл усечён")
+                    f.seek(0)
+                    interval = FOLLOW_MIN_INTERVAL
+                    continue
+
+                time.sleep(interval)
+                interval = min(interval * 2, FOLLOW_MAX_INTERVAL)
+
+        except KeyboardInterrupt:
+            out.close()
+        finally:
+            if reopened is not None:
+                reopened.close()
+
     def cp(self, args):
+        usage = "Использование: cp [-r] [--update] [-j N] <источник> <назначение>"
         if len(args) < 2:
-            print("Использование: cp [-r] <источник> <назначение>")
+            print(usage)
             return False
-            
+
         recursive = "-r" in args
-        if recursive:
-            clean_args = [arg for arg in args if arg != "-r"]
-            if len(clean_args) < 2:
-                print("Использование: cp [-r] <источник> <назначение>")
-                return False
-            src, dst = clean_args[0], clean_args[1]
-        else:
-            src, dst = args[0], args[1]
-        
+        update = "--update" in args
+        jobs = DEFAULT_COPY_JOBS
+        clean_args = []
+
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg == "-j" or (arg.startswith("-j") and arg[2:].isdigit()):
+                value = arg[2:]
+                if not value:
+                    i += 1
+                    value = args[i] if i < len(args) else ""
+                if not value.isdigit() or int(value) < 1:
+                    print(f"Ошибка: Некорректное число потоков для -j: {value}")
+                    return False
+                jobs = int(value)
+            elif arg not in ("-r", "--update"):
+                clean_args.append(arg)
+            i += 1
+
+        if len(clean_args) < 2:
+            print(usage)
+            return False
+        src, dst = clean_args[0], clean_args[1]
+        stats = None
+        record = None
+
         try:
-            src_path = Path(src).resolve()
-            dst_path = Path(dst).resolve()
+            src_path = resolve_path(src)
+            dst_path = resolve_path(dst)
             
             ensure_exists(src_path)
             
@@ -169,39 +557,153 @@ class   BasicCommands:
             if src_path.is_dir():
                 if dst_path.exists() and dst_path.is_dir():
                     dst_path = dst_path / src_path.name
-                shutil.copytree(src_path, dst_path, dirs_exist_ok=True)
+                if update:
+                    return self._sync(src_path, dst_path, jobs=jobs, command=f"cp {' '.join(args)}")
+                record = self._begin('cp', src_path, dst_path)
+                stats = copy_tree(src_path, dst_path, jobs)
             else:
                 if dst_path.is_dir():
                     dst_path = dst_path / src_path.name
-                shutil.copy2(src_path, dst_path)
-            
-            if self.undo_manager:
-                self.undo_manager.record_operation(
-                    'cp', 
-                    str(src_path), 
-                    str(dst_path),
-                    cmd_index=len(self.history_manager.history) if self.history_manager else None
-                )
+                if update and dst_path.is_file():
+                    src_stat, dst_stat = src_path.stat(), dst_path.stat()
+                    if (src_stat.st_size == dst_stat.st_size and
+                            abs(src_stat.st_mtime_ns - dst_stat.st_mtime_ns) <= SYNC_MTIME_WINDOW_NS):
+                        print(f"Без изменений: {dst_path}")
+                        logger.info(f"cp {' '.join(args)} OK (без изменений)")
+                        return True
+                record = self._begin('cp', src_path, dst_path)
+                copy_file(src_path, dst_path)
+            
+            self._commit(record)
             
             print(f"Скопировано: {src_path} -> {dst_path}")
+            if stats is not None:
+                print(f"Итого {stats.summary()}")
             logger.info(f"cp {src} {dst} {'-r' if recursive else ''} OK")
             return True
             
         except Exception as e:
+            self._abort(record)
             print(f"Ошибка: {e}")
             logger.error(f"cp {src} {dst} {'-r' if recursive else ''} ERROR: {e}")
             return False
     
+    def sync(self, args):
+        """Синхронизация каталога: копируются только новые и изменённые файлы"""
+        usage = ("Использование: sync [-n|--dry-run] [--delete] [--checksum] [-j N] "
+                 "<источник> <назначение>")
+        dry_run = False
+        delete = False
+        checksum = False
+        jobs = DEFAULT_COPY_JOBS
+        clean_args = []
+
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in ("-n", "--dry-run"):
+                dry_run = True
+            elif arg == "--delete":
+                delete = True
+            elif arg == "--checksum":
+                checksum = True
+            elif arg == "-j" or (arg.startswith("-j") and arg[2:].isdigit()):
+                value = arg[2:]
+                if not value:
+                    i += 1
+                    value = args[i] if i < len(args) else ""
+                if not value.isdigit() or int(value) < 1:
+                    print(f"Ошибка: Некорректное число потоков для -j: {value}")
+                    return False
+                jobs = int(value)
+            else:
+                clean_args.append(arg)
+            i += 1
+
+        if len(clean_args) < 2:
+            print(usage)
+            return False
+        src, dst = clean_args[0], clean_args[1]
+
+        try:
+            src_path = resolve_path(src)
+            dst_path = resolve_path(dst)
+
+            ensure_exists(src_path)
+            ensure_is_dir(src_path)
+            ensure_not_root(dst_path)
+
+            return self._sync(src_path, dst_path, jobs, checksum, delete, dry_run,
+                              command=f"sync {' '.join(args)}")
+
+        except Exception as e:
+            print(f"Ошибка: {e}")
+            logger.error(f"sync {' '.join(args)} ERROR: {e}")
+            return False
+
+    def _sync(self, src_path, dst_path, jobs=DEFAULT_COPY_JOBS, checksum=False,
+              delete=False, dry_run=False, command="sync"):
+        """Общая часть sync и cp -r --update. Заменённые и удалённые файлы
+        сохраняются в корзине, а вся синхронизация записывается одной операцией undo"""
+        plan = plan_sync(src_path, dst_path, checksum, delete)
+        counts = f"новых: {len(plan.new)}, изменённых: {len(plan.changed)}, удаляемых: {len(plan.delete)}"
+
+        if dry_run:
+            for line in plan.describe():
+                print(line)
+            print(f"План синхронизации {src_path} -> {dst_path} ({counts})")
+            logger.info(f"{command} OK (пробный запуск)")
+            return True
+
+        if plan.is_empty() and dst_path.is_dir():
+            print(f"Без изменений: {dst_path}")
+            logger.info(f"{command} OK (без изменений)")
+            return True
+
+        trash_dir = self._trash_dir()
+        trash_dir.mkdir(parents=True, exist_ok=True)
+        backup_dir = tempfile.mkdtemp(prefix="sync_", dir=trash_dir)
+        record = self._begin('sync', src_path, dst_path, {
+            'backup_dir': backup_dir, 'checksum': checksum, 'delete': delete
+        })
+
+        try:
+            stats, created, backups, errors = apply_sync(plan, src_path, dst_path, backup_dir, jobs)
+        except BaseException:
+            self._abort(record)
+            raise
+
+        if not backups:
+            os.rmdir(backup_dir)
+            backup_dir = None
+
+        # Даже частично выполненную синхронизацию можно отменить
+        if record is not None:
+            if created or backups:
+                record['details'].update(created=created, backups=backups, backup_dir=backup_dir)
+                self._commit(record)
+            else:
+                self._abort(record)
+
+        if errors:
+            raise shutil.Error(errors)
+
+        print(f"Синхронизировано: {src_path} -> {dst_path} ({counts})")
+        print(f"Итого {stats.summary()}")
+        logger.info(f"{command} OK")
+        return True
+
     def mv(self, args):
         if len(args) < 2:
             print("Использование: mv <источник> <назначение>")
             return False
             
         src, dst = args[0], args[1]
+        record = None
         
         try:
-            src_path = Path(src).resolve()
-            dst_path = Path(dst).resolve()
+            src_path = resolve_path(src)
+            dst_path = resolve_path(dst)
             
             ensure_exists(src_path)
             
@@ -214,44 +716,67 @@ class   BasicCommands:
             
             ensure_not_root(src_path)
             
+            record = self._begin('mv', src_path, dst_path)
             shutil.move(str(src_path), str(dst_path))
-            
-            if self.undo_manager:
-                self.undo_manager.record_operation(
-                    'mv', 
-                    str(src_path), 
-                    str(dst_path),
-                    cmd_index=len(self.history_manager.history) if self.history_manager else None
-                )
+            self._commit(record)
             
             print(f"Перемещено: {src_path} -> {dst_path}")
             logger.info(f"mv {src} {dst} OK")
             return True
             
         except Exception as e:
+            self._abort(record)
             print(f"Ошибка: {e}")
             logger.error(f"mv {src} {dst} ERROR: {e}")
             return False
     
+    def _trash_dir(self):
+        return self.undo_manager.trash_dir if self.undo_manager else self._default_trash_dir
+
+    def _begin(self, operation, source, destination, details=None):
+        """Запись операции в журнал отмены до изменения файловой системы.
+        Для восстановления после сбоя запоминается, существовало ли назначение"""
+        if not self.undo_manager:
+            return None
+        details = dict(details or {}, existed=Path(destination).exists())
+        return self.undo_manager.begin_operation(
+            operation,
+            str(source) if source is not None else None,
+            str(destination),
+            cmd_index=self.history_manager.current_index() if self.history_manager else None,
+            details=details
+        )
+
+    def _commit(self, record):
+        if record is not None:
+            self.undo_manager.commit_operation(record)
+
+    def _abort(self, record):
+        if record is not None:
+            self.undo_manager.abort_operation(record)
+
     def rm(self, args):
         if not args:
-            print("Использование: rm [-r] <файл/каталог>")
+            print("Использование: rm [-r] [-y] <файл/каталог>")
             logger.error("rm ERROR: нет аргументов")
             return False
             
         recursive = "-r" in args
+        # -y: удаление каталога без подтверждения (для сценариев)
+        assume_yes = "-y" in args
         
-        # Удаление флага из аргументов
-        clean_args = [arg for arg in args if arg != "-r"]
+        # Удаление флагов из аргументов
+        clean_args = [arg for arg in args if arg not in ("-r", "-y")]
         if not clean_args:
-            print("Использование: rm [-r] <файл/каталог>")
+            print("Использование: rm [-r] [-y] <файл/каталог>")
             logger.error("rm ERROR: нет целевого пути")
             return False
             
         target = clean_args[0]
+        record = None
         
         try:
-            target_path = Path(target).resolve()
+            target_path = resolve_path(target)
             
             # Проверки
             if not target_path.exists():
@@ -263,28 +788,16 @@ class   BasicCommands:
             
             # Удаление файла (без подтверждения)
             if target_path.is_file():
-                # Копируем в корзину для возможности отмены
-                trash_dir = Path("data") / ".trash"
-                trash_dir.mkdir(parents=True, exist_ok=True)
-                backup_path = trash_dir / target_path.name
-                
-                counter = 1
-                while backup_path.exists():
-                    backup_path = trash_dir / f"{target_path.name}_{counter}"
-                    counter += 1
-                
-                shutil.copy2(target_path, backup_path)
+                # Переносим в корзину на той же ФС для возможности отмены
+                trash_id = TrashStore.new_id()
+                record = self._begin('rm', None, target_path, {'trash_id': trash_id})
+                _, backup_path = TrashStore(self._trash_dir()).put(target_path, trash_id)
                 
                 # Записываем операцию
-                if self.undo_manager:
-                    self.undo_manager.record_operation(
-                        'rm', 
-                        str(backup_path), 
-                        str(target_path),
-                        cmd_index=len(self.history_manager.history) if self.history_manager else None
-                    )
+                if record is not None:
+                    record['source'] = str(backup_path)
+                    self._commit(record)
                 
-                target_path.unlink()
                 print(f"Файл удалён: {target_path}")
                 logger.info(f"rm {target} OK")
                 return True
@@ -297,42 +810,34 @@ class   BasicCommands:
                     return False
                 
                 # Подтверждение при удалении каталога
-                confirm = input(f"Удалить директорию {target_path} и всё её содержимое? (y/n): ")
+                try:
+                    confirm = 'y' if assume_yes else input(
+                        f"Удалить директорию {target_path} и всё её содержимое? (y/n): ")
+                except EOFError:
+                    # Нет ввода (фоновая задача, сценарий): удаление не подтверждено
+                    print()
+                    confirm = ""
                 if confirm.lower() != 'y':
                     print("Удаление отменено")
                     logger.info(f"rm -r {target} CANCELLED by user")
                     return False
                 
-                # Перемещение в корзину для возможности отмены
-                trash_dir = Path("data") / ".trash"
-                trash_dir.mkdir(parents=True, exist_ok=True)
-                backup_path = trash_dir / target_path.name
-                
-                counter = 1
-                while backup_path.exists():
-                    backup_path = trash_dir / f"{target_path.name}_{counter}"
-                    counter += 1
-                
-                # 🔴 СНАЧАЛА копируем в корзину
-                shutil.copytree(target_path, backup_path)
+                # Перемещение в корзину одним переименованием, без копирования содержимого
+                trash_id = TrashStore.new_id()
+                record = self._begin('rm', None, target_path, {'trash_id': trash_id})
+                _, backup_path = TrashStore(self._trash_dir()).put(target_path, trash_id)
                 
-                # ✅ ПОТОМ записываем операцию
-                if self.undo_manager:
-                    self.undo_manager.record_operation(
-                        'rm', 
-                        str(backup_path), 
-                        str(target_path),
-                        cmd_index=len(self.history_manager.history) if self.history_manager else None
-                    )
-                
-                # И только потом удаляем оригинал
-                shutil.rmtree(target_path)
+                # Записываем операцию
+                if record is not None:
+                    record['source'] = str(backup_path)
+                    self._commit(record)
                 
                 print(f"Директория удалена: {target_path}")
                 logger.info(f"rm -r {target} OK")
                 return True
                 
         except Exception as e:
+            self._abort(record)
             print(f"Ошибка: {e}")
             logger.error(f"rm {'-r' if recursive else ''} {target} ERROR: {e}")
             return False
\ No newline at end of file
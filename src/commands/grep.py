@@ -1,39 +1,552 @@
+import codecs
+import mmap
+import multiprocessing
+import os
 import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import chain
 from pathlib import Path
+from .index import TrigramIndex, default_index_dir, extract_literals
+from ..archiver import open_tar_stream
+from ..pipeline import drain
+from ..validator import resolve_path
+from ..walker import BINARY_CHECK_SIZE, IGNORE_FILES, is_binary, walk
 from ..logger import setup_logger
 
 logger = setup_logger()
 
+# Для небольшого числа файлов запуск пула процессов дороже самого поиска
+PARALLEL_MIN_FILES = 64
+
+# Процессы поиска не наследуют память оболочки через fork: потоки фоновых
+# задач могут держать в этот момент блокировки (логгер, журнал, вывод задач),
+# и в дочернем процессе они остались бы захваченными навсегда
+POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+# Размер блока при потоковом чтении файла
+CHUNK_SIZE = 1024 * 1024
+
+# Строка длиннее этого предела при потоковом чтении обрабатывается частями
+MAX_LINE_LENGTH = 16 * CHUNK_SIZE
+
+REGEX_METACHARS = set('.^$*+?{}[]\\|()')
+
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Сколько потоков читают члены одного ZIP-архива
+ARCHIVE_THREADS = min(8, os.cpu_count() or 1)
+
+
+class _LiteralMatch:
+
+    def __init__(self, start, end):
+        self._start = start
+        self._end = end
+
+    def start(self):
+        return self._start
+
+    def end(self):
+        return self._end
+
+
+class _LiteralMatcher:
+    """Поиск фиксированной строки через bytes.find/mmap.find с интерфейсом
+    Pattern.search, чтобы сканеры работали с ним так же, как с регуляркой"""
+
+    def __init__(self, literal):
+        self.pattern = literal
+
+    def search(self, buf, pos=0, endpos=None):
+        if endpos is None:
+            endpos = len(buf)
+        start = buf.find(self.pattern, pos, endpos)
+        if start == -1:
+            return None
+        return _LiteralMatch(start, start + len(self.pattern))
+
+
+def _is_literal(pattern):
+    return not any(c in REGEX_METACHARS for c in pattern)
+
+
+def _trie_regex(words):
+    """Регулярное выражение из префиксного дерева слов.
+
+    Общие префиксы не повторяются, поэтому движок re проходит текст один раз
+    и на каждой позиции спускается по дереву, как автомат Ахо-Корасик, а не
+    перебирает тысячи альтернатив по очереди"""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[None] = True
+
+    def build(node):
+        parts = []
+        # Цепочки без ветвлений собираются без рекурсии
+        while len(node) == 1 and None not in node:
+            (ch, node), = node.items()
+            parts.append(re.escape(ch))
+
+        alternatives = [re.escape(ch) + build(child) for ch, child in sorted(
+            (item for item in node.items() if item[0] is not None)
+        )]
+        if len(alternatives) == 1 and None not in node:
+            parts.append(alternatives[0])
+        elif alternatives:
+            parts.append('(?:' + '|'.join(alternatives) + ')' + ('?' if None in node else ''))
+        return ''.join(parts)
+
+    return build(trie)
+
+
+def _compile_matcher(patterns, ignore_case=False, fixed=False):
+    """Компиляция шаблонов в один объект поиска.
+
+    Фиксированные строки (-F или шаблоны без метасимволов) ищутся через
+    bytes.find либо одним регулярным выражением-деревом; регулярки
+    объединяются в одну альтернативу. Для поиска прямо по mmap используется
+    bytes-регулярка, если шаблон не зависит от ширины символа в UTF-8"""
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    flags = re.MULTILINE | (re.IGNORECASE if ignore_case else 0)
+
+    if fixed or all(_is_literal(p) for p in patterns):
+        literals = sorted(set(patterns))
+        if len(literals) == 1 and not ignore_case:
+            return _LiteralMatcher(literals[0].encode('utf-8'))
+        if ignore_case and not all(literal.isascii() for literal in literals):
+            return re.compile(_trie_regex(literals), flags)
+        # Дерево строится по байтам UTF-8: latin-1 переводит каждый байт в один символ
+        encoded = [literal.encode('utf-8').decode('latin-1') for literal in literals]
+        return re.compile(_trie_regex(encoded).encode('latin-1'), flags)
+
+    pattern = patterns[0] if len(patterns) == 1 else '|'.join(f'(?:{p})' for p in patterns)
+
+    # bytes-регулярка только для шаблонов, не зависящих от ширины символа:
+    # '.', [^...] и {n} на bytes считают байты UTF-8, а не символы (кириллица),
+    # \w, \d, \s, \b для bytes работают только с ASCII, а не-ASCII символы
+    # в классах вроде [аб] распались бы на отдельные байты UTF-8. Шаблоны с '$'
+    # тоже ищутся по тексту: при чтении в текстовом режиме \r\n становится \n,
+    # а в байтах '$' не совпал бы перед \r в файлах с переводами строк CRLF
+    if pattern.isascii() and not re.search(r'\\[wWbBdDsS]|[.{$]|\[\^', pattern):
+        return re.compile(pattern.encode('ascii'), flags)
+    return re.compile(pattern, flags)
+
+
+def _count_newlines(buf, start, end, nl):
+    """Подсчёт переводов строк в buf[start:end] без копирования всего диапазона"""
+    count = 0
+    while start < end:
+        stop = min(end, start + CHUNK_SIZE)
+        count += buf[start:stop].count(nl)
+        start = stop
+    return count
+
+
+def _scan_buffer(buf, matcher, first_line=1, max_count=None):
+    """Поиск совпадений в буфере (bytes, str или mmap).
+
+    Регулярка запускается по всему буферу, а строки выделяются только вокруг
+    найденных совпадений, поэтому файл не разбивается на список строк.
+    Поиск прекращается после max_count совпавших строк."""
+    nl = '\n' if isinstance(buf, str) else b'\n'
+    end = len(buf)
+    matches = []
+    pos = 0
+    counted = 0
+    line_no = first_line
+
+    while pos < end and (max_count is None or len(matches) < max_count):
+        m = matcher.search(buf, pos, end)
+        if m is None:
+            break
+
+        line_start = buf.rfind(nl, pos, m.start()) + 1 or pos
+        line_end = buf.find(nl, m.start(), end)
+        if line_end == -1:
+            line_end = end
+
+        # Совпадение захватило перевод строки: проверяем, есть ли оно внутри самой строки
+        if m.end() > line_end and matcher.search(buf, line_start, line_end) is None:
+            pos = line_end + 1
+            continue
+
+        line_no += _count_newlines(buf, counted, line_start, nl)
+        counted = line_start
+
+        text = buf[line_start:line_end]
+        if not isinstance(text, str):
+            text = text.decode('utf-8', errors='ignore')
+        matches.append((line_no, text.strip()))
+
+        pos = line_end + 1
+
+    return matches
+
+
+def _scan_chunks(chunks, matcher, max_count=None):
+    """Потоковый поиск по блокам фиксированного размера с переносом
+    незавершённой строки в следующий блок"""
+    return list(_iter_chunk_matches(chunks, matcher, max_count))
+
+
+def _iter_chunk_matches(chunks, matcher, max_count=None):
+    """Генератор совпадений _scan_chunks: блоки читаются по мере выдачи,
+    поэтому поиск во входном потоке конвейера не копит его в памяти"""
+    found = 0
+    last_line = None
+    line_no = 1
+    carry = None
+
+    def scan(block):
+        limit = None if max_count is None else max_count - found
+        for match in _scan_buffer(block, matcher, line_no, limit):
+            if match[0] != last_line:
+                yield match
+
+    for chunk in chunks:
+        if max_count is not None and found >= max_count:
+            return
+
+        data = chunk if carry is None else carry + chunk
+        nl = '\n' if isinstance(data, str) else b'\n'
+
+        cut = data.rfind(nl) + 1
+        if cut == 0:
+            if len(data) < MAX_LINE_LENGTH:
+                carry = data
+                continue
+            # Очень длинная строка обрабатывается частями, чтобы не копить её в памяти
+            cut = len(data)
+
+        block, carry = data[:cut], data[cut:]
+        for match in scan(block):
+            found += 1
+            last_line = match[0]
+            yield match
+        line_no += block.count(nl)
+
+    if carry and (max_count is None or found < max_count):
+        yield from scan(carry)
+
+
+def _scan_file(file_path, matcher, max_count=None):
+    """Поиск совпадений в одном файле (выполняется в том числе в дочерних процессах)"""
+    try:
+        if isinstance(matcher.pattern, str):
+            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+                return _scan_chunks(iter(lambda: f.read(CHUNK_SIZE), ''), matcher, max_count), None
+
+        with open(file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Пустые и специальные файлы (например, из /proc) нельзя отобразить в память
+                return _scan_chunks(iter(lambda: f.read(CHUNK_SIZE), b''), matcher, max_count), None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _scan_buffer(mm, matcher, max_count=max_count), None
+    except Exception as e:
+        return [], str(e)
+
+
+def _scan_stream(f, matcher, max_count=None, skip_binary=False):
+    """Потоковый поиск в двоичном файловом объекте (например, члене архива).
+    Возвращает None, если содержимое двоичное и skip_binary"""
+    chunks = iter(lambda: f.read(CHUNK_SIZE), b'')
+    first = next(chunks, b'')
+    if skip_binary and b'\0' in first[:BINARY_CHECK_SIZE]:
+        return None
+
+    chunks = chain([first], chunks)
+    if isinstance(matcher.pattern, str):
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        chunks = (decoder.decode(chunk) for chunk in chunks)
+    return _scan_chunks(chunks, matcher, max_count)
+
+
+def archive_kind(file_path):
+    """'zip' или 'tar' по расширению файла, иначе None"""
+    name = str(file_path).lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith(TAR_SUFFIXES):
+        return 'tar'
+    return None
+
+
+def _scan_zip_members(archive_path, names, matcher, max_count, skip_binary):
+    # Каждый поток открывает собственный ZipFile: общий дескриптор не потокобезопасен
+    results = []
+    with zipfile.ZipFile(archive_path) as zf:
+        for name in names:
+            try:
+                with zf.open(name) as member:
+                    matches = _scan_stream(member, matcher, max_count, skip_binary)
+                if matches is not None:
+                    results.append((f"{archive_path}!{name}", matches, None))
+            except Exception as e:
+                results.append((f"{archive_path}!{name}", [], str(e)))
+    return results
+
+
+def _scan_archive(archive_path, matcher, max_count=None, skip_binary=True, threads=1):
+    """Поиск по членам архива без распаковки на диск: [(метка, совпадения, ошибка)]"""
+    if archive_kind(archive_path) == 'zip':
+        with zipfile.ZipFile(archive_path) as zf:
+            names = [info.filename for info in zf.infolist() if not info.is_dir()]
+
+        threads = max(1, min(threads, len(names)))
+        if threads == 1:
+            return _scan_zip_members(archive_path, names, matcher, max_count, skip_binary)
+
+        size = -(-len(names) // threads)
+        batches = [names[i:i + size] for i in range(0, len(names), size)]
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            parts = pool.map(
+                lambda batch: _scan_zip_members(archive_path, batch, matcher, max_count, skip_binary),
+                batches
+            )
+            return [result for part in parts for result in part]
+
+    # Сжатый tar читается последовательно в потоковом режиме, без перемотки
+    results = []
+    with open_tar_stream(archive_path) as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            label = f"{archive_path}!{member.name}"
+            try:
+                matches = _scan_stream(tar.extractfile(member), matcher, max_count, skip_binary)
+                if matches is not None:
+                    results.append((label, matches, None))
+            except Exception as e:
+                results.append((label, [], str(e)))
+    return results
+
+
+def _scan_target(file_path, matcher, max_count=None, archives=False, skip_binary=True, threads=1):
+    """Поиск в файле или, при archives, в членах архива: [(метка, совпадения, ошибка)]"""
+    if archives and archive_kind(file_path):
+        try:
+            return _scan_archive(file_path, matcher, max_count, skip_binary, threads)
+        except Exception as e:
+            return [(file_path, [], str(e))]
+    return [(file_path, *_scan_file(file_path, matcher, max_count))]
+
+
+def _scan_batch(files, matcher, max_count=None, archives=False, skip_binary=True):
+    """Поиск в пачке файлов — единица работы для пула процессов"""
+    return [_scan_target(file_path, matcher, max_count, archives, skip_binary) for file_path in files]
+
+
 class GrepCommand:
-    
-    def __init__(self):
-        pass
-    
+
+    def __init__(self, index_dir=None):
+        self.index_dir = Path(index_dir) if index_dir else default_index_dir()
+
     def grep(self, args):
-        if len(args) < 2:
-            print("Использование: grep <pattern> <path> [-r] [-i]")
+        return drain(self.grep_stream(args))
+
+    def _parse_args(self, args, stdin=False):
+        """Разбор аргументов grep; None, если аргументы некорректны.
+        При stdin путь необязателен: без него поиск идёт по входному потоку"""
+        usage = ("Использование: grep [-r] [-i] [-F] [-a] [-z] [-l | -c | -q] [-m N] [-j N] [--index] "
+                 "[--include GLOB] [--exclude GLOB] [--max-depth N] [--no-ignore] "
+                 "(<pattern> | -e <pattern>... | -f <file>) <path>")
+
+        options = {
+            'recursive': False,
+            'ignore_case': False,
+            'fixed': False,
+            'use_index': False,
+            'jobs': os.cpu_count() or 1,
+            'mode': 'lines',
+            'max_count': None,
+            'include': [],
+            'exclude': [],
+            'max_depth': None,
+            'binary': False,
+            'use_ignore_files': True,
+            'archives': False,
+        }
+        patterns = []
+        pattern_given = False
+        positional = []
+
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg.startswith("--") and "=" in arg:
+                arg, value = arg.split("=", 1)
+            elif arg in ("-j", "-e", "-f", "-m", "--include", "--exclude", "--max-depth"):
+                if i + 1 >= len(args):
+                    print(usage)
+                    return None
+                i += 1
+                value = args[i]
+            elif arg[:2] in ("-j", "-m") and arg[2:].isdigit():
+                arg, value = arg[:2], arg[2:]
+
+            if arg == "-r":
+                options['recursive'] = True
+            elif arg == "-i":
+                options['ignore_case'] = True
+            elif arg == "-F":
+                options['fixed'] = True
+            elif arg == "-z":
+                options['archives'] = True
+            elif arg == "-a":
+                options['binary'] = True
+            elif arg == "--no-ignore":
+                options['use_ignore_files'] = False
+            elif arg == "--include":
+                options['include'].append(value)
+            elif arg == "--exclude":
+                options['exclude'].append(value)
+            elif arg == "--max-depth":
+                if not value.isdigit() or int(value) < 1:
+                    print(f"Ошибка: Некорректная глубина для --max-depth: {value}")
+                    return None
+                options['max_depth'] = int(value)
+            elif arg == "-l":
+                options['mode'] = 'files'
+            elif arg == "-c":
+                options['mode'] = 'count'
+            elif arg == "-q":
+                options['mode'] = 'quiet'
+            elif arg == "-m":
+                if not value.isdigit():
+                    print(f"Ошибка: Некорректное число совпадений для -m: {value}")
+                    return None
+                options['max_count'] = int(value)
+            elif arg == "--index":
+                options['use_index'] = True
+            elif arg == "-j":
+                if not value.isdigit() or int(value) < 1:
+                    print(f"Ошибка: Некорректное число процессов для -j: {value}")
+                    return None
+                options['jobs'] = int(value)
+            elif arg == "-e":
+                patterns.append(value)
+                pattern_given = True
+            elif arg == "-f":
+                try:
+                    with open(resolve_path(value), 'r', encoding='utf-8') as f:
+                        patterns.extend(line.rstrip('\r\n') for line in f if line.strip())
+                except OSError as e:
+                    print(f"Ошибка: Не удалось прочитать файл шаблонов {value}: {e}")
+                    return None
+                pattern_given = True
+            else:
+                positional.append(arg)
+            i += 1
+
+        if not pattern_given and positional:
+            patterns.append(positional.pop(0))
+
+        if not (positional or stdin) or not patterns:
+            print(usage)
+            return None
+
+        options['patterns'] = patterns
+        options['path'] = positional[0] if positional else None
+        return options
+
+    def _index_literals(self, patterns, ignore_case, fixed):
+        """Литералы для выборки по индексу; несколько шаблонов индекс не сужает"""
+        if len(patterns) != 1:
+            return []
+        pattern = re.escape(patterns[0]) if fixed else patterns[0]
+        return extract_literals(pattern, ignore_case)
+
+    def _scan_limit(self, options):
+        """Сколько совпадений достаточно найти в одном файле"""
+        if options['mode'] in ('files', 'quiet'):
+            return 1
+        return options['max_count']
+
+    def _search_in_file(self, file_path, regex, options, single=False, threads=1):
+        results = _scan_target(
+            file_path, regex, self._scan_limit(options),
+            options['archives'], not options['binary'], threads
+        )
+        # Нулевые счётчики членов архива не выводятся даже для одного файла
+        single = single and not (options['archives'] and archive_kind(file_path))
+        return (yield from self._emit_matches(results, options, single))
+
+    def _emit_matches(self, results, options, single=False):
+        lines, found = self._format_matches(results, options, single)
+        for line in lines:
+            yield f"{line}\n".encode('utf-8')
+        return found
+
+    def _format_matches(self, results, options, single=False):
+        """Строки вывода для результатов поиска и признак найденного.
+        Ошибки чтения выводятся сразу, а не в поток результатов"""
+        found = False
+        mode = options['mode']
+        lines = []
+
+        for label, matches, error in results:
+            if error is not None:
+                print(f"Не удалось прочитать файл {label}: {error}")
+                continue
+
+            if mode == 'files':
+                if matches:
+                    lines.append(str(label))
+            elif mode == 'count':
+                # Для отдельного файла счётчик выводится и при нуле совпадений
+                if matches or single:
+                    lines.append(f"{label}:{len(matches)}")
+            elif mode == 'lines':
+                lines.extend(f"{label}:{i}:{line}" for i, line in matches)
+
+            found = found or bool(matches)
+
+        return lines, found
+
+    def grep_stream(self, args, stdin=None):
+        """grep как поток байтов; команда grep выводит его через drain.
+        Без пути (в конвейере) ищет во входном потоке и выдаёт сами совпавшие
+        строки; с путём — строки файл:номер:текст по файлам по очереди"""
+        options = self._parse_args(args, stdin=stdin is not None)
+        if options is None:
             return False
-        
-        pattern = args[0]
-        path = args[1]
-        recursive = "-r" in args
-        ignore_case = "-i" in args
-        
+
+        patterns = options['patterns']
+        path = options['path']
+        pattern = ' '.join(patterns)
+        recursive = options['recursive']
+        ignore_case = options['ignore_case']
+
         try:
-            flags = re.IGNORECASE if ignore_case else 0
-            regex = re.compile(pattern, flags)
-            
-            target_path = Path(path).resolve()
-            
+            regex = _compile_matcher(patterns, ignore_case, options['fixed'])
+
+            if path is None:
+                return (yield from self._grep_input(stdin, regex, options))
+
+            if stdin is not None:
+                stdin.close()
+            target_path = resolve_path(path)
+
             if target_path.is_file():
-                return self._search_in_file(target_path, regex)
-            
+                threads = min(options['jobs'], ARCHIVE_THREADS)
+                return (yield from self._search_in_file(target_path, regex, options, single=True, threads=threads))
+
             if target_path.is_dir():
-                return self._search_in_directory(target_path, regex, recursive)
-            
+                literals = None
+                if options['use_index']:
+                    literals = self._index_literals(patterns, ignore_case, options['fixed'])
+                return (yield from self._search_in_directory(target_path, regex, options, literals))
+
             print(f"Ошибка: {target_path} не является файлом или директорией")
             return False
-            
+
         except re.error as e:
             print(f"Ошибка в регулярном выражении: {e}")
             logger.error(f"grep {pattern} {path} ERROR: ошибка в регулярном выражении - {e}")
@@ -42,38 +555,123 @@ class GrepCommand:
             print(f"Ошибка: {e}")
             logger.error(f"grep {pattern} {path} {'-r' if recursive else ''} {'-i' if ignore_case else ''} ERROR: {e}")
             return False
-    
-    def _search_in_file(self, file_path, regex):
+
+    def _grep_input(self, stdin, regex, options):
+        """Поиск во входном потоке конвейера; совпавшие строки выдаются сразу"""
+        mode = options['mode']
+        count = 0
+
+        chunks = stdin
+        if isinstance(regex.pattern, str):
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+            chunks = (decoder.decode(chunk) for chunk in stdin)
+
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                lines = f.readlines()
-            
-            found = False
-            for i, line in enumerate(lines, 1):
-                if regex.search(line):
-                    found = True
-                    print(f"{file_path}:{i}:{line.strip()}")
-            
-            return found
-                
+            for _, line in _iter_chunk_matches(chunks, regex, self._scan_limit(options)):
+                count += 1
+                if mode == 'lines':
+                    yield f"{line}\n".encode('utf-8')
+        finally:
+            stdin.close()
+
+        if mode == 'count':
+            yield f"{count}\n".encode('utf-8')
+        elif mode == 'files' and count:
+            yield "(стандартный ввод)\n".encode('utf-8')
+        return count > 0
+
+    def _search_in_directory(self, dir_path, regex, options, literals=None):
+        try:
+            files = sorted(self._collect_files(dir_path, options))
+            if literals is not None:
+                files = self._filter_by_index(dir_path, files, literals)
         except Exception as e:
-            print(f"Не удалось прочитать файл {file_path}: {e}")
+            print(f"Ошибка при поиске в директории {dir_path}: {e}")
             return False
-    
-    def _search_in_directory(self, dir_path, regex, recursive):
+
+        jobs = options['jobs']
+        quiet = options['mode'] == 'quiet'
+        max_count = self._scan_limit(options)
         found_any = False
-        
-        try:
-            for item in dir_path.iterdir():
-                if item.is_file():
-                    if self._search_in_file(item, regex):
-                        found_any = True
-                elif item.is_dir() and recursive:
-                    if self._search_in_directory(item, regex, recursive):
-                        found_any = True
-            
+
+        if options['max_count'] == 0:
+            return False
+
+        if jobs <= 1 or len(files) < PARALLEL_MIN_FILES:
+            for file_path in files:
+                if (yield from self._search_in_file(file_path, regex, options, threads=min(jobs, ARCHIVE_THREADS))):
+                    found_any = True
+                    if quiet:
+                        break
             return found_any
-            
-        except Exception as e:
-            print(f"Ошибка при поиске в директории {dir_path}: {e}")
-            return False
\ No newline at end of file
+
+        # Файлы раздаются процессам пачками; результаты читаются в порядке
+        # отправки, поэтому вывод сгруппирован по файлам и не зависит от числа процессов
+        size = max(1, len(files) // (jobs * 8))
+        batches = [files[i:i + size] for i in range(0, len(files), size)]
+
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=POOL_CONTEXT) as pool:
+            futures = [
+                pool.submit(_scan_batch, batch, regex, max_count, options['archives'], not options['binary'])
+                for batch in batches
+            ]
+
+            if quiet:
+                # Достаточно первого совпадения в любом файле: остальные пачки отменяются
+                for future in as_completed(futures):
+                    if any(matches for results in future.result() for _, matches, _ in results):
+                        for pending in futures:
+                            pending.cancel()
+                        return True
+                return False
+
+            try:
+                for future in futures:
+                    for results in future.result():
+                        if (yield from self._emit_matches(results, options)):
+                            found_any = True
+            finally:
+                # Следующая стадия конвейера могла прекратить чтение: пачки, которые
+                # ещё не начали выполняться, не нужны
+                for pending in futures:
+                    pending.cancel()
+
+        return found_any
+
+    def _collect_files(self, dir_path, options):
+        """Список файлов директории с учётом фильтров (с поддиректориями при -r)"""
+        def report(error):
+            print(f"Ошибка при поиске в директории {error.filename}: {error}")
+
+        entries = walk(
+            dir_path,
+            recursive=options['recursive'],
+            max_depth=options['max_depth'],
+            include=options['include'],
+            exclude=options['exclude'],
+            ignore_files=IGNORE_FILES if options['use_ignore_files'] else (),
+            skip_binary=not options['binary'] and not options['archives'],
+            onerror=report,
+        )
+        files = [Path(entry.path) for entry in entries]
+
+        if options['archives'] and not options['binary']:
+            # Архивы двоичные, но их содержимое просматривается по членам
+            files = [f for f in files if archive_kind(f) or not is_binary(f)]
+        return files
+
+    def _filter_by_index(self, dir_path, files, literals):
+        """Сужение списка файлов по триграммному индексу (если он есть)"""
+        index = TrigramIndex.find(dir_path, self.index_dir)
+        if index is None:
+            print(f"Индекс для {dir_path} не найден, выполняется полный поиск (создать: index build <dir>)")
+            return files
+
+        if not literals:
+            logger.info(f"grep --index: шаблон без литералов, полный поиск в {dir_path}")
+            return files
+
+        index.update()
+        candidates = index.candidates(files, literals)
+        logger.info(f"grep --index: {len(candidates)} из {len(files)} файлов в {dir_path}")
+        return candidates
@@ -1,92 +1,532 @@
+import codecs
+import json
+import mmap
+import os
 import shutil
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from ..copier import apply_sync, plan_sync
+from ..history_index import HistoryIndex
+from ..trash import TrashStore
 from ..logger import setup_logger
 
+try:
+    import termios
+    import tty
+except ImportError:  # Windows
+    termios = tty = None
+
 logger = setup_logger()
 
+# Сколько результатов выводит поиск по истории
+SEARCH_LIMIT = 20
+
+# Номер строки истории фоновой задачи (см. HistoryManager.command_index)
+_job_command = threading.local()
+
+# Префикс метки удаления в журнале истории (в командах, введённых с клавиатуры,
+# нулевого символа не бывает)
+TOMBSTONE = "\0"
+
+# Журнал истории сжимается, когда меток удаления больше этого числа
+# и больше четверти числа команд
+HISTORY_COMPACT_MIN = 64
+
+# Сколько строк истории копится в пакетном режиме до записи в файл
+HISTORY_BATCH_SIZE = 256
+
+# Размер блока при подсчёте строк журнала истории
+HISTORY_SCAN_CHUNK = 1024 * 1024
+
+# Сколько операций хранится в каждом из стеков отмены и повтора после сжатия журнала
+UNDO_LIMIT = 100
+
+# Журнал сжимается при запуске, если в нём больше записей, чем это число
+# и чем учетверённое число живых операций
+JOURNAL_COMPACT_MIN = 1000
+
+
+def _remove_path(path):
+    path = Path(path)
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+
 class HistoryManager:
+    """История команд в журнале, куда только дописывают.
+
+    Каждая команда — одна строка, добавляемая одной записью в открытый файл.
+    Удаление команды дописывает метку удаления (строка вида "\\0<номер>"),
+    а файл целиком переписывается только при сжатии, когда таких меток
+    накопилось много. При запуске файл не читается: число команд считается при
+    первом обращении, а список команд загружается, только когда он нужен"""
+
     def __init__(self, history_file=None):
+        # История читается лениво, поэтому путь фиксируется сразу: после cd
+        # обращения к файлу не должны зависеть от новой текущей директории
         if history_file is None:
-            self.history_file = Path("data") / ".history"
+            self.history_file = (Path("data") / ".history").resolve()
         else:
-            self.history_file = Path(history_file)
-        self.history = []
-        self.load_history()
-    
-    def load_history(self):
+            self.history_file = Path(history_file).resolve()
+        self._history = None
+        self._count = None
+        self._tombstones = None
+        self._log = None
+        self._log_path = None
+        self._index = None
+        self._batch = None
 
+    @property
+    def history(self):
+        """Список команд (загружается при первом обращении)"""
+        if self._history is None:
+            self.load_history()
+        return self._history
+
+    def load_history(self):
+        """Чтение журнала с применением меток удаления"""
+        self._flush_batch()
+        self._history = []
+        self._tombstones = 0
         try:
-            self.history_file.parent.mkdir(parents=True, exist_ok=True)
-            
-            if self.history_file.exists():
-                with open(self.history_file, 'r', encoding='utf-8') as f:
-                    self.history = [line.strip() for line in f.readlines() if line.strip()]
+            with open(self.history_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    if line.startswith(TOMBSTONE):
+                        self._tombstones += 1
+                        idx = int(line[1:]) - 1
+                        if 0 <= idx < len(self._history):
+                            self._history.pop(idx)
+                    elif line.strip():
+                        self._history.append(line.strip())
+        except FileNotFoundError:
+            pass
         except Exception as e:
             logger.error(f"Ошибка при загрузке истории: {e}")
-            self.history = []
-    
+            self._history = []
+        self._count = len(self._history)
+
+    @property
+    def index(self):
+        """Индекс для поиска по истории (строится при первом поиске)"""
+        if self._index is None:
+            self._index = HistoryIndex(self.history)
+        return self._index
+
+    def search(self, text, limit=SEARCH_LIMIT):
+        """Команды, содержащие слова запроса: [(номер, команда, частота)]"""
+        return self.index.search(text, limit)
+
+    def prefix_search(self, text, limit=SEARCH_LIMIT):
+        """Команды, начинающиеся с text: [(номер, команда, частота)]"""
+        return self.index.prefix(text, limit)
+
+    def _scan_counts(self):
+        """Число команд и меток удаления без разбора строк: подсчёт байтов блоками"""
+        self._flush_batch()
+        lines = tombstones = 0
+        previous = b'\n'
+        try:
+            with open(self.history_file, 'rb') as f:
+                for chunk in iter(lambda: f.read(HISTORY_SCAN_CHUNK), b''):
+                    lines += chunk.count(b'\n')
+                    tombstones += (previous + chunk).count(b'\n' + TOMBSTONE.encode())
+                    previous = chunk[-1:]
+        except FileNotFoundError:
+            pass
+        self._tombstones = tombstones
+        # Каждая метка удаления убирает одну команду и сама занимает строку
+        self._count = lines - 2 * tombstones
+
+    def count(self):
+        """Число команд в истории"""
+        if self._count is None:
+            self._scan_counts()
+        return self._count
+
+    def current_index(self):
+        """Номер выполняемой команды в истории (для отмены). У фоновой задачи —
+        номер её строки с &, а не последней введённой к моменту запуска команды"""
+        index = getattr(_job_command, 'index', None)
+        return self.count() if index is None else index
+
+    @contextmanager
+    def command_index(self, index):
+        """Номер команды для операций, выполняемых в этом потоке"""
+        _job_command.index = index
+        try:
+            yield
+        finally:
+            _job_command.index = None
+
+    def _write(self, line):
+        """Дозапись строки в журнал одной операцией записи (в пакетном режиме —
+        одной записью на HISTORY_BATCH_SIZE строк)"""
+        if self._batch is not None:
+            self._batch.append(line)
+            if len(self._batch) >= HISTORY_BATCH_SIZE:
+                self._flush_batch()
+            return
+        self._write_lines([line])
+
+    def _write_lines(self, lines):
+        try:
+            if self._log is None or self._log_path != self.history_file:
+                self.close()
+                self.history_file.parent.mkdir(parents=True, exist_ok=True)
+                self._log = open(self.history_file, 'a', encoding='utf-8')
+                self._log_path = self.history_file
+            self._log.write(''.join(f"{line}\n" for line in lines))
+            self._log.flush()
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении истории: {e}")
+
+    def _flush_batch(self):
+        if self._batch:
+            lines, self._batch = self._batch, []
+            self._write_lines(lines)
+
+    @contextmanager
+    def batch(self):
+        """Пакетная запись истории: строки копятся в памяти и дописываются
+        блоками, а не по одной на команду"""
+        self._batch = []
+        try:
+            yield self
+        finally:
+            self._flush_batch()
+            self._batch = None
+
+    def close(self):
+        self._flush_batch()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
     def save_history(self):
-        """Сохранение истории команд в файл"""
+        """Сжатие журнала: перезапись только живыми командами, без меток удаления"""
         try:
+            commands = self.history
+            self.close()
             self.history_file.parent.mkdir(parents=True, exist_ok=True)
-            
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                for cmd in self.history:
+            tmp_path = self.history_file.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for cmd in commands:
                     f.write(f"{cmd}\n")
+            os.replace(tmp_path, self.history_file)
+            self._tombstones = 0
         except Exception as e:
             logger.error(f"Ошибка при сохранении истории: {e}")
     
     def add_command(self, command):
         """Добавление команды в историю"""
-        self.history.append(command)
-        self.save_history()
+        # Строка журнала — одна команда
+        command = command.replace('\n', ' ').strip()
+        if not command or command.startswith(TOMBSTONE):
+            return
+        count = self.count()
+        self._write(command)
+        if self._history is not None:
+            self._history.append(command)
+        self._count = count + 1
+        if self._index is not None:
+            self._index.add(command, self._count)
     
     def get_history(self, limit=None):
         """Возвращает историю команд"""
         if limit is None or limit <= 0:
             return [(i+1, cmd) for i, cmd in enumerate(self.history)]
-        
-        # Возвращаем последние N команд с правильной нумерацией
-        start_idx = max(0, len(self.history) - limit)
+
+        total = self.count()
+        if self._history is None and self._tombstones == 0:
+            # Последние N команд читаются с конца файла, без загрузки всей истории
+            commands = self._read_tail(limit)
+        else:
+            commands = self.history[-limit:]
         # Сохраняем правильную нумерацию (1-based индекс)
-        return [(start_idx + i + 1, cmd) for i, cmd in enumerate(self.history[start_idx:])]
+        start_idx = total - len(commands)
+        return [(start_idx + i + 1, cmd) for i, cmd in enumerate(commands)]
+
+    def _read_tail(self, limit):
+        self._flush_batch()
+        try:
+            with open(self.history_file, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return []
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    end = len(mm)
+                    if mm[end - 1:end] == b'\n':
+                        end -= 1
+                    pos = end
+                    for _ in range(limit):
+                        pos = mm.rfind(b'\n', 0, pos)
+                        if pos == -1:
+                            break
+                    data = mm[pos + 1:end]
+        except FileNotFoundError:
+            return []
+        return [line.strip() for line in data.decode('utf-8').split('\n') if line.strip()]
     
     def clear_history(self):
         """Очистка истории"""
-        self.history = []
-        self.save_history()
+        self.close()
+        self._history = []
+        self._count = 0
+        self._tombstones = 0
+        self._index = None
+        self.history_file.parent.mkdir(parents=True, exist_ok=True)
+        open(self.history_file, 'w').close()
     
     def remove_command(self, cmd_index):
         """Удаление команды из истории по индексу (1-based)"""
         try:
-            idx = cmd_index - 1
-            if 0 <= idx < len(self.history):
-                self.history.pop(idx)
+            if not 1 <= cmd_index <= self.count():
+                return False
+            self._write(f"{TOMBSTONE}{cmd_index}")
+            self._tombstones = (self._tombstones or 0) + 1
+            if self._history is not None:
+                self._history.pop(cmd_index - 1)
+            self._count -= 1
+            # Номера команд сдвинулись — индекс будет построен заново
+            self._index = None
+            if self._tombstones > max(HISTORY_COMPACT_MIN, self._count // 4):
                 self.save_history()
-                return True
-            return False
+            return True
         except Exception as e:
             logger.error(f"Ошибка при удалении команды из истории: {e}")
             return False
 
 class UndoManager:
-    def __init__(self):
-        self.trash_dir = Path("data") / ".trash"
+    """Стек отмены и повтора, сохраняемый в журнале data/.undo_journal.
+
+    Журнал дописывается строками JSON: begin — до изменения файловой системы,
+    commit/abort — после, undo/redo — при отмене и повторе. При запуске журнал
+    проигрывается заново, а операции, прерванные сбоем (begin без commit),
+    откатываются или завершаются по тому, что успело произойти на диске"""
+
+    def __init__(self, journal_file=None):
+        # Как и журнал, корзина одна на сеанс: путь не зависит от последующих cd
+        self.trash_dir = (Path("data") / ".trash").resolve()
         self.trash_dir.mkdir(parents=True, exist_ok=True)
+        if journal_file is None:
+            self.journal_file = (Path("data") / ".undo_journal").resolve()
+        else:
+            self.journal_file = Path(journal_file).resolve()
         self.undo_history = []
-    
-    def record_operation(self, operation, source, destination=None, cmd_index=None):
-        """Записывание операции для возможности отмены"""
-        record = {
-            'operation': operation,
-            'source': source,
-            'destination': destination,
-            'cmd_index': cmd_index
-        }
-        self.undo_history.append(record)
-    
+        self.redo_history = []
+        self._next_id = 1
+        # Запись в журнал и изменение стеков и _pending выполняются под одной
+        # блокировкой: сжатие (compact) видит их только вместе
+        self._journal_lock = threading.RLock()
+        self._journal_records = 0
+        self._pending = {}
+        self._owners = {}
+
+        pending = self._replay()
+        # Операции с меньшими номерами — из прежних сеансов: их cmd_index
+        # указывает на историю того сеанса, а не на текущую
+        self._session_start_id = self._next_id
+        for record in pending:
+            self._recover(record)
+        if self._journal_records > max(JOURNAL_COMPACT_MIN, 4 * self._live_count()):
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def _append(self, *entries, sync=False):
+        """Дозапись в журнал; begin синхронизируется с диском до начала операции"""
+        with self._journal_lock:
+            self.journal_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+            self._journal_records += len(entries)
+
+    def _replay(self):
+        """Восстановление стеков из журнала. Возвращает незавершённые операции"""
+        operations = {}
+        pending = {}
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Недописанная при сбое последняя строка
+                continue
+            self._journal_records += 1
+            kind, op_id = entry['type'], entry['id']
+            self._next_id = max(self._next_id, op_id + 1)
+
+            if kind == 'begin':
+                pending[op_id] = entry['record']
+            elif kind == 'commit' and op_id in pending:
+                record = pending.pop(op_id)
+                record.update(entry.get('update', {}))
+                operations[op_id] = record
+                self.undo_history.append(record)
+                self.redo_history.clear()
+            elif kind == 'abort':
+                pending.pop(op_id, None)
+            elif kind in ('undo', 'redo') and op_id in operations:
+                record = operations[op_id]
+                record.update(entry.get('update', {}))
+                src, dst = ((self.undo_history, self.redo_history) if kind == 'undo'
+                            else (self.redo_history, self.undo_history))
+                if record in src:
+                    src.remove(record)
+                    dst.append(record)
+
+        return list(pending.values())
+
+    def _live_count(self):
+        return len(self.undo_history) + len(self.redo_history)
+
+    def compact(self):
+        """Перезапись журнала только живыми записями (не более UNDO_LIMIT на стек).
+        Для вытесненных операций sync удаляются их резервные копии"""
+        with self._journal_lock:
+            dropped = self.undo_history[:-UNDO_LIMIT] + self.redo_history[:-UNDO_LIMIT]
+            del self.undo_history[:-UNDO_LIMIT]
+            del self.redo_history[:-UNDO_LIMIT]
+
+            entries = []
+            for record in sorted(self.undo_history + self.redo_history, key=lambda r: r['id']):
+                entries.append({'type': 'begin', 'id': record['id'], 'record': record})
+                entries.append({'type': 'commit', 'id': record['id']})
+            entries += [{'type': 'undo', 'id': record['id']} for record in self.redo_history]
+            # Операции, выполняющиеся во время сжатия, допишут commit позже
+            entries += [{'type': 'begin', 'id': op_id, 'record': record}
+                        for op_id, record in self._pending.items()]
+
+            tmp_path = self.journal_file.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.journal_file)
+            self._journal_records = len(entries)
+
+        for record in dropped:
+            backup_dir = (record.get('details') or {}).get('backup_dir')
+            if record['operation'] == 'sync' and backup_dir:
+                shutil.rmtree(backup_dir, ignore_errors=True)
+
+    def begin_operation(self, operation, source, destination=None, cmd_index=None, details=None):
+        """Запись намерения до изменения файловой системы. details должны
+        позволять откатить операцию, если она будет прервана"""
+        with self._journal_lock:
+            op_id = self._next_id
+            self._next_id += 1
+            record = {
+                'id': op_id,
+                'operation': operation,
+                'source': source,
+                'destination': destination,
+                'cmd_index': cmd_index,
+                'details': details
+            }
+            self._pending[op_id] = record
+            self._owners[op_id] = threading.get_ident()
+            self._append({'type': 'begin', 'id': op_id, 'record': record}, sync=True)
+        return record
+
+    def commit_operation(self, record):
+        """Операция выполнена: она попадает в стек отмены, стек повтора очищается"""
+        update = {'source': record['source'], 'details': record['details']}
+        with self._journal_lock:
+            self._append({'type': 'commit', 'id': record['id'], 'update': update})
+            self._pending.pop(record['id'], None)
+            self._owners.pop(record['id'], None)
+            self.undo_history.append(record)
+            self.redo_history.clear()
+
+    def abort_operation(self, record):
+        with self._journal_lock:
+            self._append({'type': 'abort', 'id': record['id']})
+            self._pending.pop(record['id'], None)
+            self._owners.pop(record['id'], None)
+
+    def record_operation(self, operation, source, destination=None, cmd_index=None, details=None):
+        """Записывание уже выполненной операции для возможности отмены"""
+        record = self.begin_operation(operation, source, destination, cmd_index, details)
+        self.commit_operation(record)
+
+    def recover_interrupted(self, thread_id=None):
+        """Откат операций, начатых потоком thread_id (по умолчанию — текущим)
+        и прерванных без commit, например фоновой задачи, снятой через kill"""
+        thread_id = thread_id or threading.get_ident()
+        for op_id, record in list(self._pending.items()):
+            if self._owners.get(op_id) == thread_id:
+                self._recover(record)
+
+    def _recover(self, record):
+        """Доведение до согласованного состояния операции, прерванной сбоем"""
+        operation = record['operation']
+        details = record.get('details') or {}
+        source = Path(record['source']) if record['source'] else None
+        destination = Path(record['destination'])
+        committed = False
+
+        if operation in ('cp', 'zip', 'tar'):
+            # Частично записанный результат удаляется, если его не было до операции
+            if not details.get('existed') and destination.exists():
+                _remove_path(destination)
+            print(f"Восстановление после сбоя: отменена операция {operation} -> {destination}")
+        elif operation == 'mv':
+            if source.exists() and destination.exists() and not details.get('existed'):
+                # Перенос между ФС прервался на копировании: источник цел
+                _remove_path(destination)
+                print(f"Восстановление после сбоя: отменено перемещение {source}")
+            elif not source.exists() and destination.exists():
+                committed = True
+        elif operation == 'rm':
+            trash_id = details.get('trash_id')
+            if not destination.exists() and any(i == trash_id for i, _ in TrashStore(self.trash_dir).items()):
+                committed = True
+            elif not destination.exists():
+                print(f"Восстановление после сбоя: {destination} мог остаться в корзине {self.trash_dir}")
+        elif operation == 'sync':
+            # Сохранённые файлы возвращаются на место; уже скопированные новые остаются
+            backup_dir = details.get('backup_dir')
+            if backup_dir and Path(backup_dir).exists():
+                for entry in sorted(Path(backup_dir).rglob('*'), reverse=True):
+                    if entry.is_dir() and not entry.is_symlink():
+                        continue
+                    original = destination / entry.relative_to(backup_dir)
+                    if original.exists() or original.is_symlink():
+                        _remove_path(original)
+                    original.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.move(str(entry), str(original))
+                shutil.rmtree(backup_dir, ignore_errors=True)
+            print(f"Восстановление после сбоя: синхронизация {destination} прервана, "
+                  f"заменённые файлы возвращены")
+
+        if committed:
+            self.commit_operation(record)
+        else:
+            self.abort_operation(record)
+        logger.info(f"undo journal: восстановлена операция {operation} {destination} "
+                    f"({'commit' if committed else 'abort'})")
+
     def undo_last_operation(self, history_manager):
         """Отмена последней операции"""
+        # Снятая со стека операция не должна пропасть из журнала при сжатии
+        with self._journal_lock:
+            return self._undo_last_operation(history_manager)
+
+    def _undo_last_operation(self, history_manager):
+        last_op = None
         try:
             if not self.undo_history:
                 print("Нет операций для отмены")
@@ -102,30 +542,83 @@ class UndoManager:
                 self._undo_move(last_op)
             elif operation == 'rm':
                 self._undo_remove(last_op)
+            elif operation == 'sync':
+                self._undo_sync(last_op)
             elif operation in ['zip', 'tar']:
                 self._undo_archive(last_op)
             else:
                 print(f"Неизвестная операция для отмены: {operation}")
                 return False
+
+            self._append({'type': 'undo', 'id': last_op['id'],
+                          'update': {'details': last_op['details']}})
+            self.redo_history.append(last_op)
             
-            if cmd_index and history_manager:
+            if cmd_index and history_manager and last_op['id'] >= self._session_start_id:
                 history_manager.remove_command(cmd_index)
             
             return True
             
         except Exception as e:
+            # Как и в журнале, операция остаётся в стеке отмены
+            if last_op is not None and last_op not in self.redo_history:
+                self.undo_history.append(last_op)
             print(f"Ошибка при отмене операции: {e}")
             return False
-    
+
+    def redo_last_operation(self):
+        """Повтор последней отменённой операции"""
+        with self._journal_lock:
+            return self._redo_last_operation()
+
+    def _redo_last_operation(self):
+        try:
+            if not self.redo_history:
+                print("Нет операций для повтора")
+                return False
+
+            last_op = self.redo_history.pop()
+            operation = last_op['operation']
+
+            if operation == 'mv':
+                Path(last_op['destination']).parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(last_op['source'], last_op['destination'])
+            elif operation == 'rm':
+                trash_id, backup_path = TrashStore(self.trash_dir).put(Path(last_op['destination']))
+                last_op['source'] = str(backup_path)
+                last_op['details'] = {'trash_id': trash_id}
+            elif operation == 'sync':
+                self._redo_sync(last_op)
+            else:
+                # Результаты cp, zip и tar при отмене ушли в корзину — возвращаем их
+                trash_id = (last_op['details'] or {}).pop('undo_trash_id', None)
+                if trash_id is None:
+                    raise FileNotFoundError(f"Результат {last_op['destination']} не сохранён в корзине")
+                TrashStore(self.trash_dir).restore(trash_id, last_op['destination'])
+
+            print(f"Повтор операции {operation}: {last_op['destination']}")
+            self._append({'type': 'redo', 'id': last_op['id'],
+                          'update': {'source': last_op['source'], 'details': last_op['details']}})
+            self.undo_history.append(last_op)
+            return True
+
+        except Exception as e:
+            # Журнал об этом повторе ничего не знает — операция остаётся в стеке
+            self.redo_history.append(last_op)
+            print(f"Ошибка при повторе операции: {e}")
+            return False
+
+    def _trash_result(self, operation):
+        """Перенос результата операции в корзину (чтобы её можно было повторить)"""
+        trash_id, _ = TrashStore(self.trash_dir).put(Path(operation['destination']))
+        operation['details'] = dict(operation.get('details') or {}, undo_trash_id=trash_id)
+
     def _undo_copy(self, operation):
         """Отмена операции копирования"""
         destination = operation['destination']
         
         if Path(destination).exists():
-            if Path(destination).is_dir():
-                shutil.rmtree(destination)
-            else:
-                Path(destination).unlink()
+            self._trash_result(operation)
             print(f"Отмена копирования: удален файл/директория {destination}")
     
     def _undo_move(self, operation):
@@ -151,25 +644,81 @@ class UndoManager:
         """Отмена операции удаления"""
         trash_path = operation['source']
         original_path = operation['destination']
-        
+        details = operation.get('details') or {}
+
+        if 'trash_id' in details:
+            try:
+                TrashStore(self.trash_dir).restore(details['trash_id'], original_path)
+            except FileNotFoundError as e:
+                # Операция остаётся в стеке отмены: объект мог быть вытеснен
+                # или очищен, но мог и лежать в другой корзине
+                raise FileNotFoundError(
+                    f"{original_path} не найден в корзине {self.trash_dir} ({e})"
+                ) from e
+            print(f"Отмена удаления: восстановлен файл/директория {original_path}")
+            return
+
         if Path(trash_path).exists():
             original_dir = Path(original_path).parent
             if not original_dir.exists():
                 original_dir.mkdir(parents=True, exist_ok=True)
             
-            if Path(trash_path).is_dir():
-                shutil.copytree(trash_path, original_path)
-            else:
-                shutil.copy2(trash_path, original_path)
+            # Корзина на той же ФС, поэтому восстановление — переименование;
+            # shutil.move копирует, только если переименовать нельзя
+            shutil.move(trash_path, original_path)
             
             print(f"Отмена удаления: восстановлен файл/директория {original_path}")
     
+    def _undo_sync(self, operation):
+        """Отмена синхронизации: удаление созданного и возврат сохранённых файлов"""
+        details = operation['details']
+
+        for path in reversed(details['created']):
+            path = Path(path)
+            if path.is_dir() and not path.is_symlink():
+                try:
+                    path.rmdir()
+                except OSError:
+                    pass
+            elif path.exists() or path.is_symlink():
+                path.unlink()
+
+        for backup_path, original_path in reversed(details['backups']):
+            original = Path(original_path)
+            if original.is_dir() and not original.is_symlink():
+                shutil.rmtree(original)
+            elif original.exists() or original.is_symlink():
+                original.unlink()
+            original.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(backup_path, original_path)
+
+        if details.get('backup_dir') and Path(details['backup_dir']).exists():
+            shutil.rmtree(details['backup_dir'])
+
+        print(f"Отмена синхронизации: восстановлено содержимое {operation['destination']}")
+
+    def _redo_sync(self, operation):
+        """Повтор синхронизации с теми же параметрами (заново сравниваются деревья)"""
+        details = operation['details']
+        plan = plan_sync(operation['source'], operation['destination'],
+                         details.get('checksum', False), details.get('delete', False))
+        self.trash_dir.mkdir(parents=True, exist_ok=True)
+        backup_dir = tempfile.mkdtemp(prefix="sync_", dir=self.trash_dir)
+        _, created, backups, errors = apply_sync(plan, operation['source'],
+                                                 operation['destination'], backup_dir)
+        if not backups:
+            os.rmdir(backup_dir)
+            backup_dir = None
+        details.update(created=created, backups=backups, backup_dir=backup_dir)
+        if errors:
+            raise shutil.Error(errors)
+
     def _undo_archive(self, operation):
         """Отмена операции создания архива"""
         archive_path = operation['destination']
         
         if Path(archive_path).exists():
-            Path(archive_path).unlink()
+            self._trash_result(operation)
             print(f"Отмена создания архива: удален файл {archive_path}")
 
 class HistoryCommands:
@@ -177,9 +726,31 @@ class HistoryCommands:
     def __init__(self, history_manager, undo_manager):
         self.history_manager = history_manager
         self.undo_manager = undo_manager
+        # Команда, выбранная поиском history -r, для подстановки в строку ввода
+        self.pending_input = None
     
     def history(self, args):
-        """Вывод истории команд"""
+        """Вывод истории команд и поиск по ней:
+        history [N] | history search <текст> | history --prefix <начало> | history -r [текст]"""
+        if args and args[0] in ('search', '--prefix'):
+            text = ' '.join(args[1:])
+            if not text:
+                print("Использование: history search <текст> | history --prefix <начало>")
+                return False
+            if args[0] == 'search':
+                results = self.history_manager.search(text)
+            else:
+                results = self.history_manager.prefix_search(text)
+            if not results:
+                print("Ничего не найдено")
+                return True
+            for idx, cmd, count in results:
+                print(f"{idx}: {cmd}" + (f"  (×{count})" if count > 1 else ""))
+            return True
+
+        if args and args[0] == '-r':
+            return self._reverse_search(' '.join(args[1:]))
+
         limit = None
         if args:
             try:
@@ -200,11 +771,88 @@ class HistoryCommands:
         
         return True
     
+    def _reverse_search(self, query):
+        """Поиск по мере ввода в стиле Ctrl-R: каждая клавиша уточняет запрос,
+        Ctrl-R — следующий результат, Enter — выбрать, Esc/Ctrl-G — отмена.
+        Без терминала выводится лучший результат для query"""
+        if termios is None or not sys.stdin.isatty():
+            results = self.history_manager.search(query, 1) if query else []
+            if not results:
+                print("Ничего не найдено")
+                return True
+            self.pending_input = results[0][1]
+            print(f"{results[0][0]}: {results[0][1]}")
+            return True
+
+        fd = sys.stdin.fileno()
+        saved = termios.tcgetattr(fd)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+        skip = 0
+        selected = None
+        try:
+            tty.setcbreak(fd)
+            while True:
+                matches = self.history_manager.search(query, skip + 1) if query else []
+                skip = min(skip, max(len(matches) - 1, 0))
+                match = matches[skip][1] if matches else ''
+                sys.stdout.write(f"\r\x1b[K(reverse-i-search)`{query}': {match}")
+                sys.stdout.flush()
+
+                char = decoder.decode(os.read(fd, 1))
+                if not char:
+                    continue
+                if char in '\r\n':
+                    selected = match or None
+                    break
+                if char in '\x1b\x07':
+                    break
+                if char == '\x12':
+                    skip += 1
+                elif char in '\x7f\x08':
+                    query = query[:-1]
+                    skip = 0
+                elif char.isprintable():
+                    query += char
+                    skip = 0
+        finally:
+            termios.tcflush(fd, termios.TCIFLUSH)
+            termios.tcsetattr(fd, termios.TCSADRAIN, saved)
+            sys.stdout.write("\r\x1b[K")
+            sys.stdout.flush()
+
+        self.pending_input = selected
+        return True
+
     def clear_history(self, args):
         self.history_manager.clear_history()
         print("История команд очищена")
         return True
     
     def undo(self, args):
-        success = self.undo_manager.undo_last_operation(self.history_manager)
-        return success
\ No newline at end of file
+        """Отмена последней операции или последних N: undo [N]"""
+        count = _parse_count(args, "undo")
+        if count is None:
+            return False
+        for _ in range(count):
+            if not self.undo_manager.undo_last_operation(self.history_manager):
+                return False
+        return True
+
+    def redo(self, args):
+        """Повтор отменённых операций: redo [N]"""
+        count = _parse_count(args, "redo")
+        if count is None:
+            return False
+        for _ in range(count):
+            if not self.undo_manager.redo_last_operation():
+                return False
+        return True
+
+
+def _parse_count(args, command):
+    if not args:
+        return 1
+    if not args[0].isdigit() or int(args[0]) < 1:
+        print(f"Ошибка: Некорректный аргумент для {command}: {args[0]}")
+        return None
+    return int(args[0])
@@ -0,0 +1,329 @@
+import hashlib
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from ..validator import ensure_exists, ensure_is_dir, resolve_path
+from ..walker import walk
+from ..logger import setup_logger
+
+logger = setup_logger()
+
+# Размер блока при чтении файла для построения индекса
+INDEX_CHUNK_SIZE = 1024 * 1024
+
+# Файлы больше этого размера не индексируются и всегда считаются кандидатами
+MAX_INDEXED_FILE_SIZE = 64 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    indexed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS trigrams (
+    tri INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    PRIMARY KEY (tri, file_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS trigrams_by_file ON trigrams (file_id);
+"""
+
+
+def default_index_dir():
+    return (Path("data") / ".index").resolve()
+
+
+# Длина хвоста экранированных последовательностей \xhh, \uhhhh, \Uhhhhhhhh
+_ESCAPE_DIGITS = {'x': 2, 'u': 4, 'U': 8}
+
+
+def _escape_end(pattern, i):
+    """Позиция за экранированной последовательностью, начинающейся с '\\' в i.
+    Последовательность пропускается целиком: её хвост (41 в \\x41) — не литерал"""
+    nxt = pattern[i + 1:i + 2]
+    if nxt in _ESCAPE_DIGITS:
+        return i + 2 + _ESCAPE_DIGITS[nxt]
+    if nxt == 'N' and pattern[i + 2:i + 3] == '{':
+        end = pattern.find('}', i)
+        return end + 1 if end != -1 else len(pattern)
+    if nxt.isdigit():
+        # Восьмеричный код (\101) или ссылка на группу (\1)
+        j = i + 1
+        while j < len(pattern) and j < i + 4 and pattern[j].isdigit():
+            j += 1
+        return j
+    return i + 2
+
+
+def extract_literals(pattern, ignore_case=False):
+    """Обязательные литеральные подстроки регулярного выражения в виде bytes
+    (в нижнем регистре ASCII, как и в индексе). Пустой список означает, что
+    шаблон нельзя использовать для выборки по индексу"""
+    # Альтернативы и флаги внутри шаблона разбирать не пытаемся
+    if '|' in pattern or '(?' in pattern:
+        return []
+
+    runs = []
+    run = []
+
+    def flush():
+        if run:
+            runs.append(''.join(run))
+            run.clear()
+
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            nxt = pattern[i + 1:i + 2]
+            if nxt and not nxt.isalnum():
+                run.append(nxt)
+                i += 2
+            else:
+                flush()
+                i = _escape_end(pattern, i)
+            continue
+        if c in '[(':
+            # Классы и группы пропускаются целиком
+            flush()
+            close = ']' if c == '[' else ')'
+            depth = 0
+            j = i + 1
+            if c == '[' and pattern[j:j + 1] == '^':
+                j += 1
+            if c == '[' and pattern[j:j + 1] == ']':
+                j += 1
+            while j < len(pattern):
+                if pattern[j] == '\\':
+                    j += 2
+                    continue
+                if c == '(' and pattern[j] == '(':
+                    depth += 1
+                elif pattern[j] == close:
+                    if depth == 0:
+                        break
+                    depth -= 1
+                j += 1
+            i = j + 1
+            continue
+        if c in '*?{':
+            # Предыдущий символ может отсутствовать
+            if run:
+                run.pop()
+            flush()
+            if c == '{':
+                end = pattern.find('}', i)
+                i = end if end != -1 else len(pattern)
+        elif c in '+.^$)':
+            flush()
+        else:
+            run.append(c)
+        i += 1
+    flush()
+
+    literals = []
+    for literal in runs:
+        if ignore_case and not literal.isascii():
+            continue
+        encoded = literal.encode('utf-8').lower()
+        if len(encoded) >= 3:
+            literals.append(encoded)
+    return literals
+
+
+def _trigrams(data):
+    return {(a << 16) | (b << 8) | c for a, b, c in zip(data, data[1:], data[2:])}
+
+
+def _file_trigrams(file_path):
+    """Множество триграмм файла (без учёта регистра ASCII), читается блоками"""
+    tris = set()
+    tail = b''
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(INDEX_CHUNK_SIZE), b''):
+            data = tail + chunk.lower()
+            tris.update(zip(data, data[1:], data[2:]))
+            tail = data[-2:]
+    return {(a << 16) | (b << 8) | c for a, b, c in tris}
+
+
+class TrigramIndex:
+    """Триграммный индекс файлов директории, хранится в SQLite под data/.index"""
+
+    def __init__(self, root, index_dir=None):
+        self.root = resolve_path(root)
+        self.index_dir = Path(index_dir) if index_dir else default_index_dir()
+        name = hashlib.sha1(str(self.root).encode('utf-8')).hexdigest()[:16]
+        self.db_path = self.index_dir / f"{name}.db"
+
+    @classmethod
+    def find(cls, path, index_dir=None):
+        """Индекс для директории path или ближайшей родительской"""
+        path = resolve_path(path)
+        for candidate in [path, *path.parents]:
+            index = cls(candidate, index_dir)
+            if index.exists():
+                return index
+        return None
+
+    def exists(self):
+        return self.db_path.exists()
+
+    def drop(self):
+        for suffix in ('', '-wal', '-shm'):
+            path = self.db_path.with_name(self.db_path.name + suffix)
+            if path.exists():
+                path.unlink()
+
+    def _connect(self):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def _scan_tree(self):
+        """Текущее состояние файлов: {относительный путь: (mtime_ns, size)}"""
+        state = {}
+        # Сам индекс может лежать внутри индексируемого дерева
+        index_prefix = str(self.index_dir) + os.sep
+        for entry in walk(self.root):
+            if entry.path.startswith(index_prefix):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            state[os.path.relpath(entry.path, self.root)] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def update(self):
+        """Инкрементальное обновление: перечитываются только файлы с изменившимися
+        mtime или размером. Возвращает (новых, изменённых, удалённых)"""
+        state = self._scan_tree()
+        added = changed = 0
+
+        with closing(self._connect()) as conn, conn:
+            known = {
+                path: (file_id, mtime_ns, size)
+                for file_id, path, mtime_ns, size in conn.execute(
+                    "SELECT id, path, mtime_ns, size FROM files"
+                )
+            }
+
+            removed = [known[path][0] for path in known.keys() - state.keys()]
+            for file_id in removed:
+                conn.execute("DELETE FROM trigrams WHERE file_id = ?", (file_id,))
+                conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+            for path, (mtime_ns, size) in state.items():
+                entry = known.get(path)
+                if entry is not None and entry[1:] == (mtime_ns, size):
+                    continue
+
+                tris = None
+                if size <= MAX_INDEXED_FILE_SIZE:
+                    try:
+                        tris = _file_trigrams(self.root / path)
+                    except OSError as e:
+                        logger.warning(f"index: не удалось прочитать {path}: {e}")
+
+                if entry is None:
+                    cursor = conn.execute(
+                        "INSERT INTO files (path, mtime_ns, size, indexed) VALUES (?, ?, ?, ?)",
+                        (path, mtime_ns, size, int(tris is not None))
+                    )
+                    file_id = cursor.lastrowid
+                    added += 1
+                else:
+                    file_id = entry[0]
+                    conn.execute("DELETE FROM trigrams WHERE file_id = ?", (file_id,))
+                    conn.execute(
+                        "UPDATE files SET mtime_ns = ?, size = ?, indexed = ? WHERE id = ?",
+                        (mtime_ns, size, int(tris is not None), file_id)
+                    )
+                    changed += 1
+
+                if tris:
+                    conn.executemany(
+                        "INSERT INTO trigrams (tri, file_id) VALUES (?, ?)",
+                        ((tri, file_id) for tri in tris)
+                    )
+
+        return added, changed, len(removed)
+
+    def candidates(self, files, literals):
+        """Отбор из files только тех, что могут содержать все литералы.
+        Файлы вне индекса и неиндексированные большие файлы остаются всегда"""
+        with closing(self._connect()) as conn:
+            known = {
+                path: (file_id, indexed)
+                for file_id, path, indexed in conn.execute("SELECT id, path, indexed FROM files")
+            }
+
+            matching = None
+            for literal in literals:
+                for tri in _trigrams(literal):
+                    ids = {
+                        row[0] for row in
+                        conn.execute("SELECT file_id FROM trigrams WHERE tri = ?", (tri,))
+                    }
+                    matching = ids if matching is None else matching & ids
+                    if not matching:
+                        break
+                if matching is not None and not matching:
+                    break
+
+        result = []
+        for file_path in files:
+            entry = known.get(os.path.relpath(file_path, self.root))
+            if entry is None or not entry[1] or matching is None or entry[0] in matching:
+                result.append(file_path)
+        return result
+
+
+class IndexCommands:
+
+    def __init__(self, index_dir=None):
+        self.index_dir = Path(index_dir) if index_dir else default_index_dir()
+
+    def index(self, args):
+        """Управление триграммным индексом для grep --index"""
+        if len(args) < 2 or args[0] not in ('build', 'update', 'drop'):
+            print("Использование: index build|update|drop <dir>")
+            return False
+
+        action, directory = args[0], args[1]
+
+        try:
+            dir_path = resolve_path(directory)
+            index = TrigramIndex(dir_path, self.index_dir)
+
+            if action == 'drop':
+                if not index.exists():
+                    print(f"Ошибка: Индекс для {dir_path} не найден")
+                    return False
+                index.drop()
+                print(f"Индекс удалён: {dir_path}")
+                logger.info(f"index drop {directory} OK")
+                return True
+
+            ensure_exists(dir_path)
+            ensure_is_dir(dir_path)
+
+            if action == 'build':
+                index.drop()
+            added, changed, removed = index.update()
+
+            print(f"Индекс обновлён: {dir_path} (новых: {added}, изменённых: {changed}, удалённых: {removed})")
+            logger.info(f"index {action} {directory} OK")
+            return True
+
+        except Exception as e:
+            print(f"Ошибка: {e}")
+            logger.error(f"index {action} {directory} ERROR: {e}")
+            return False
@@ -0,0 +1,82 @@
+import time
+from ..jobs import STATUS_NAMES
+from ..logger import setup_logger
+
+logger = setup_logger()
+
+
+def _parse_job_id(arg):
+    """'3' или '%3' -> 3; None, если это не номер задачи"""
+    arg = arg[1:] if arg.startswith('%') else arg
+    return int(arg) if arg.isdigit() else None
+
+
+class JobCommands:
+
+    def __init__(self, job_manager):
+        self.job_manager = job_manager
+
+    def jobs(self, args):
+        """Список фоновых задач; jobs --max N — лимит одновременно выполняемых"""
+        if args:
+            if args[0] == '--max' and len(args) == 2 and args[1].isdigit() and int(args[1]) > 0:
+                self.job_manager.set_limit(int(args[1]))
+                print(f"Одновременно выполняется не больше {args[1]} задач")
+                logger.info(f"jobs --max {args[1]} OK")
+                return True
+            print("Использование: jobs [--max N]")
+            return False
+
+        jobs = self.job_manager.jobs()
+        if not jobs:
+            print("Фоновых задач нет")
+        now = time.time()
+        for job in jobs:
+            elapsed = ""
+            if job.started_at is not None:
+                elapsed = f" {(job.finished_at or now) - job.started_at:.1f} с"
+            print(f"[{job.id}] {STATUS_NAMES[job.status]:<12}{elapsed:>10}  {job.command_line}")
+        logger.info("jobs OK")
+        return True
+
+    def _job_ids(self, args):
+        """Номера задач из аргументов; None, если какой-то номер неверен"""
+        ids = []
+        for arg in args:
+            job_id = _parse_job_id(arg)
+            if job_id is None or self.job_manager.get(job_id) is None:
+                print(f"Ошибка: Нет задачи {arg}")
+                return None
+            ids.append(job_id)
+        return ids
+
+    def wait(self, args):
+        """Ожидание завершения задач (всех или указанных) и вывод их результата"""
+        job_ids = self._job_ids(args)
+        if job_ids is None:
+            return False
+        try:
+            ok = self.job_manager.wait(job_ids or None)
+        except KeyboardInterrupt:
+            # Задачи продолжают работать, прерывается только ожидание
+            print("\nОжидание прервано, задачи продолжают работу")
+            return False
+        self.job_manager.report(job_ids=job_ids or None)
+        logger.info(f"wait {' '.join(args)} OK")
+        return ok
+
+    def kill(self, args):
+        """Прерывание фоновых задач"""
+        if not args:
+            print("Использование: kill <номер задачи>...")
+            return False
+        job_ids = self._job_ids(args)
+        if job_ids is None:
+            return False
+        for job_id in job_ids:
+            if self.job_manager.kill(job_id):
+                print(f"[{job_id}] Прерывается")
+            else:
+                print(f"[{job_id}] Задача уже завершена")
+        logger.info(f"kill {' '.join(args)} OK")
+        return True
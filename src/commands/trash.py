@@ -0,0 +1,93 @@
+import time
+from pathlib import Path
+from ..copier import format_size
+from ..trash import TrashStore, parse_size
+from ..logger import setup_logger
+
+logger = setup_logger()
+
+
+class TrashCommands:
+
+    def __init__(self, undo_manager=None):
+        self.undo_manager = undo_manager
+        self._default_trash_dir = (Path("data") / ".trash").resolve()
+
+    def _store(self):
+        trash_dir = self.undo_manager.trash_dir if self.undo_manager else self._default_trash_dir
+        return TrashStore(trash_dir)
+
+    def trash(self, args):
+        """Просмотр и очистка корзины: trash list|stats|purge|quota"""
+        usage = ("Использование: trash list | trash stats | "
+                 "trash purge [--all | --older ДНЕЙ | id...] | "
+                 "trash quota [--size РАЗМЕР] [--age ДНЕЙ]")
+        if not args or args[0] not in ('list', 'stats', 'purge', 'quota'):
+            print(usage)
+            return False
+
+        action = args[0]
+        store = self._store()
+
+        try:
+            if action == 'list':
+                items = store.items(measure=True)
+                if not items:
+                    print("Корзина пуста")
+                for item_id, item in items:
+                    deleted = time.strftime('%Y-%m-%d %H:%M', time.localtime(item['deleted_at']))
+                    print(f"{item_id}  {deleted}  {format_size(item['size']):>10}  {item['original']}")
+
+            elif action == 'stats':
+                stats = store.stats()
+                saved = stats['logical_bytes'] - stats['stored_bytes']
+                print(f"Объектов: {stats['items']}")
+                print(f"Занято: {format_size(stats['stored_bytes'])} "
+                      f"(сэкономлено дедупликацией: {format_size(max(saved, 0))})")
+                print(f"Лимит: {format_size(stats['max_bytes'])}, "
+                      f"не старше {stats['max_age_days']} дн.")
+
+            elif action == 'purge':
+                options = args[1:]
+                if not options:
+                    print(usage)
+                    return False
+                if options == ['--all']:
+                    count, freed = store.purge()
+                elif options[0] == '--older' and len(options) == 2:
+                    count, freed = store.purge(older_than_days=float(options[1]))
+                else:
+                    try:
+                        count, freed = store.purge(item_ids=options)
+                    except KeyError as e:
+                        print(f"Ошибка: Объект {e.args[0]} отсутствует в корзине")
+                        return False
+                print(f"Удалено из корзины: {count} ({format_size(freed)})")
+
+            else:
+                max_bytes = max_age_days = None
+                options = args[1:]
+                i = 0
+                while i < len(options):
+                    if options[i] == '--size' and i + 1 < len(options):
+                        max_bytes = parse_size(options[i + 1])
+                    elif options[i] == '--age' and i + 1 < len(options):
+                        max_age_days = float(options[i + 1])
+                    else:
+                        print(usage)
+                        return False
+                    i += 2
+                evicted = store.set_quota(max_bytes, max_age_days)
+                stats = store.stats()
+                print(f"Лимит корзины: {format_size(stats['max_bytes'])}, "
+                      f"не старше {stats['max_age_days']} дн.")
+                if evicted:
+                    print(f"Вытеснено из корзины: {len(evicted)}")
+
+            logger.info(f"trash {' '.join(args)} OK")
+            return True
+
+        except Exception as e:
+            print(f"Ошибка: {e}")
+            logger.error(f"trash {' '.join(args)} ERROR: {e}")
+            return False
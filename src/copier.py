@@ -0,0 +1,294 @@
+import hashlib
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .walker import walk
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl FICLONE: мгновенная копия файла (reflink) на Btrfs, XFS и подобных ФС
+FICLONE = 0x40049409
+
+# Копирование мелких файлов упирается в задержки системных вызовов, а не в CPU,
+# поэтому потоков больше, чем ядер
+DEFAULT_COPY_JOBS = min(32, (os.cpu_count() or 1) * 4)
+
+
+class CopyStats:
+    """Итоги копирования: число файлов, байт и затраченное время"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def add(self, size):
+        self.files += 1
+        self.bytes += size
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+        return self
+
+    def summary(self):
+        speed = self.bytes / self.elapsed if self.elapsed > 0 else 0
+        return (f"файлов: {self.files}, {format_size(self.bytes)} за {self.elapsed:.2f} с "
+                f"({format_size(speed)}/с)")
+
+
+def format_size(size):
+    for unit in ("Б", "КБ", "МБ", "ГБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "Б" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ТБ"
+
+
+def _copy_data(src_fd, dst_fd, size):
+    """Копирование содержимого средствами ядра: reflink, затем copy_file_range.
+    False, если ни то, ни другое не поддерживается"""
+    if fcntl is not None:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return True
+        except OSError:
+            pass
+
+    if hasattr(os, 'copy_file_range'):
+        copied = 0
+        try:
+            while copied < size:
+                sent = os.copy_file_range(src_fd, dst_fd, size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+            return True
+        except OSError:
+            # Например, копирование между разными ФС на старых ядрах
+            if copied:
+                raise
+
+    return False
+
+
+def copy_file(src, dst):
+    """Копирование файла с метаданными (как shutil.copy2), с разгрузкой на ядро
+    там, где ФС это поддерживает. Возвращает размер файла"""
+    with open(src, 'rb') as fsrc:
+        size = os.fstat(fsrc.fileno()).st_size
+        with open(dst, 'wb') as fdst:
+            if not _copy_data(fsrc.fileno(), fdst.fileno(), size):
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+    shutil.copystat(src, dst)
+    return size
+
+
+def copy_tree(src, dst, jobs=DEFAULT_COPY_JOBS, copy_function=copy_file):
+    """Параллельное копирование дерева каталогов.
+
+    Сначала обходом создаются все каталоги и символические ссылки, затем файлы
+    копируются пулом потоков; метаданные каталогов переносятся в конце, чтобы
+    запись файлов не сбила их mtime. Ошибки собираются и выбрасываются одним
+    shutil.Error, как в shutil.copytree. Возвращает CopyStats"""
+    src = os.fspath(src)
+    dst = os.fspath(dst)
+    stats = CopyStats()
+    errors = []
+
+    os.makedirs(dst, exist_ok=True)
+    dirs = [(src, dst)]
+    files = []
+
+    def report(error):
+        errors.append((error.filename, dst, str(error)))
+
+    for entry in walk(src, ignore_files=(), with_dirs=True, with_symlinks=True,
+                      skip_vcs=False, onerror=report):
+        target = os.path.join(dst, os.path.relpath(entry.path, src))
+        try:
+            if entry.is_symlink():
+                if os.path.lexists(target):
+                    os.unlink(target)
+                os.symlink(os.readlink(entry.path), target)
+            elif entry.is_dir(follow_symlinks=False):
+                os.makedirs(target, exist_ok=True)
+                dirs.append((entry.path, target))
+            else:
+                files.append((entry.path, target))
+        except OSError as e:
+            errors.append((entry.path, target, str(e)))
+
+    def copy_one(pair):
+        try:
+            return copy_function(*pair), None
+        except OSError as e:
+            return 0, (pair[0], pair[1], str(e))
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for size, error in pool.map(copy_one, files):
+            if error is None:
+                stats.add(size)
+            else:
+                errors.append(error)
+
+    for src_dir, dst_dir in reversed(dirs):
+        try:
+            shutil.copystat(src_dir, dst_dir)
+        except OSError as e:
+            errors.append((src_dir, dst_dir, str(e)))
+
+    if errors:
+        raise shutil.Error(errors)
+    return stats.finish()
+
+
+# Допуск при сравнении mtime: часть ФС хранит время с точностью до микро- или миллисекунд
+SYNC_MTIME_WINDOW_NS = 1_000_000
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _tree_state(root):
+    """Содержимое дерева: ({отн. путь файла: stat}, {отн. пути каталогов})"""
+    files = {}
+    dirs = set()
+    if not os.path.isdir(root):
+        return files, dirs
+    for entry in walk(root, ignore_files=(), with_dirs=True, skip_vcs=False):
+        rel = os.path.relpath(entry.path, root)
+        if entry.is_dir():
+            dirs.add(rel)
+        else:
+            files[rel] = entry.stat()
+    return files, dirs
+
+
+class SyncPlan:
+    """План синхронизации: что скопировать, какие каталоги создать и что удалить"""
+
+    def __init__(self):
+        self.new = []
+        self.changed = []
+        self.mkdirs = []
+        self.delete = []
+
+    def is_empty(self):
+        return not (self.new or self.changed or self.mkdirs or self.delete)
+
+    def describe(self):
+        """Строки для пробного запуска: + новый, ~ изменённый, - удаляемый"""
+        lines = [f"+ {rel}{os.sep}" for rel in self.mkdirs]
+        lines += [f"+ {rel}" for rel in self.new]
+        lines += [f"~ {rel}" for rel in self.changed]
+        lines += [f"- {rel}" for rel in self.delete]
+        return lines
+
+
+def plan_sync(src, dst, checksum=False, delete=False):
+    """Сравнение деревьев src и dst по размеру и mtime (и при checksum — по
+    содержимому файлов одного размера)"""
+    src_files, src_dirs = _tree_state(src)
+    dst_files, dst_dirs = _tree_state(dst)
+    plan = SyncPlan()
+
+    # Каталоги, лишние или мешающие файлам источника, удаляются целиком
+    extra_dirs = dst_dirs - src_dirs if delete else dst_dirs & src_files.keys()
+    extra_files = dst_files.keys() - src_files.keys() if delete else dst_files.keys() & src_dirs
+    removed = set()
+    for rel in sorted(extra_dirs | extra_files):
+        if any(parent in removed for parent in _parents(rel)):
+            continue
+        plan.delete.append(rel)
+        removed.add(rel)
+
+    plan.mkdirs = sorted(rel for rel in src_dirs if rel not in dst_dirs or rel in removed)
+
+    for rel, src_stat in sorted(src_files.items()):
+        dst_stat = dst_files.get(rel)
+        if dst_stat is None or rel in removed:
+            plan.new.append(rel)
+        elif src_stat.st_size != dst_stat.st_size:
+            plan.changed.append(rel)
+        elif checksum:
+            if file_digest(os.path.join(src, rel)) != file_digest(os.path.join(dst, rel)):
+                plan.changed.append(rel)
+        elif abs(src_stat.st_mtime_ns - dst_stat.st_mtime_ns) > SYNC_MTIME_WINDOW_NS:
+            plan.changed.append(rel)
+
+    return plan
+
+
+def _parents(rel):
+    parent = os.path.dirname(rel)
+    while parent:
+        yield parent
+        parent = os.path.dirname(parent)
+
+
+def apply_sync(plan, src, dst, backup_dir, jobs=DEFAULT_COPY_JOBS):
+    """Выполнение плана. Заменяемые и удаляемые объекты переносятся в
+    backup_dir, чтобы всю синхронизацию можно было отменить одной операцией.
+
+    Возвращает (CopyStats, созданные пути, [(резервная копия, исходный путь)],
+    ошибки)"""
+    src = os.fspath(src)
+    dst = os.fspath(dst)
+    stats = CopyStats()
+    created = []
+    backups = []
+    errors = []
+
+    def backup(rel):
+        original = os.path.join(dst, rel)
+        saved = os.path.join(backup_dir, rel)
+        os.makedirs(os.path.dirname(saved), exist_ok=True)
+        shutil.move(original, saved)
+        backups.append((saved, original))
+
+    if not os.path.isdir(dst):
+        os.makedirs(dst)
+        created.append(dst)
+
+    for rel in plan.delete + plan.changed:
+        try:
+            backup(rel)
+        except OSError as e:
+            errors.append((os.path.join(dst, rel), backup_dir, str(e)))
+
+    for rel in plan.mkdirs:
+        target = os.path.join(dst, rel)
+        try:
+            os.makedirs(target, exist_ok=True)
+            created.append(target)
+        except OSError as e:
+            errors.append((os.path.join(src, rel), target, str(e)))
+
+    def copy_one(rel):
+        pair = (os.path.join(src, rel), os.path.join(dst, rel))
+        try:
+            return rel, copy_file(*pair), None
+        except OSError as e:
+            return rel, 0, (pair[0], pair[1], str(e))
+
+    new = set(plan.new)
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        for rel, size, error in pool.map(copy_one, plan.new + plan.changed):
+            if error is not None:
+                errors.append(error)
+                continue
+            stats.add(size)
+            if rel in new:
+                created.append(os.path.join(dst, rel))
+
+    return stats.finish(), created, backups, errors
@@ -0,0 +1,223 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+from itertools import islice
+
+# Сколько лучших команд хранится в каждом узле префиксных деревьев
+TOP_K = 20
+
+# Глубина дерева префиксов команд; для более длинных префиксов диапазон
+# ищется двоичным поиском по отсортированному списку команд
+PREFIX_TRIE_DEPTH = 8
+
+# Если самый редкий из слов запроса встречается чаще, чем в этом числе команд,
+# вместо пересечения множеств команды перебираются в порядке оценки до первых N
+RANKED_SCAN_MIN = 1000
+
+_TOKEN_RE = re.compile(r"[^\s/\\\"']+")
+
+
+def tokenize(text):
+    """Слова команды (без учёта регистра): аргументы режутся по пробелам и
+    разделителям путей"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class _Node:
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.top = []
+
+
+class HistoryIndex:
+    """Индекс истории для поиска: дерево префиксов команд и обратный индекс
+    слов (с деревом префиксов слов для ещё не дописанного слова).
+
+    Одинаковые команды хранятся один раз со счётчиком и номером последнего
+    вхождения; выдача упорядочена по частоте, при равенстве — по новизне.
+    В узлах деревьев кэшируются TOP_K лучших команд, поэтому поиск по
+    короткому префиксу не перебирает все подходящие команды. Оценка команды
+    при добавлении только растёт, так что кэши обновляются по пути вставки"""
+
+    def __init__(self, commands=()):
+        self._ids = {}
+        self._texts = []
+        self._token_sets = []
+        self._counts = []
+        self._last = []
+        self._sorted = []
+        self._tokens = []
+        self._ranked = []
+        self._prefix_root = _Node()
+        self._token_root = _Node()
+        self._postings = {}
+
+        counts = {}
+        last = {}
+        for position, command in enumerate(commands, 1):
+            counts[command] = counts.get(command, 0) + 1
+            last[command] = position
+        # Команды вставляются от лучших к худшим, поэтому кэши узлов заполняются
+        # дописыванием в конец, без пересортировки
+        for command in sorted(counts, key=lambda c: (counts[c], last[c]), reverse=True):
+            self._insert(command, counts[command], last[command])
+        self._sorted.sort()
+        self._tokens.sort()
+
+    def _score(self, cmd_id):
+        return self._counts[cmd_id], self._last[cmd_id]
+
+    def _rank_key(self, cmd_id):
+        return -self._counts[cmd_id], -self._last[cmd_id]
+
+    def _promote(self, node, cmd_id):
+        top = node.top
+        score = self._score(cmd_id)
+        if cmd_id in top:
+            top.remove(cmd_id)
+        elif len(top) >= TOP_K and self._score(top[-1]) >= score:
+            return
+        pos = len(top)
+        while pos > 0 and self._score(top[pos - 1]) < score:
+            pos -= 1
+        top.insert(pos, cmd_id)
+        del top[TOP_K:]
+
+    def _walk(self, root, text, depth, cmd_id, ordered):
+        node = root
+        for char in text[:depth]:
+            child = node.children.get(char)
+            if child is None:
+                child = node.children[char] = _Node()
+            node = child
+            if ordered:
+                self._promote(node, cmd_id)
+            elif len(node.top) < TOP_K:
+                # Начальное построение: команды приходят в порядке убывания оценки
+                node.top.append(cmd_id)
+
+    def _insert(self, command, count, position, ordered=False):
+        cmd_id = self._ids.get(command)
+        tokens = set(tokenize(command))
+        if cmd_id is not None and ordered:
+            # Оценки уникальны (номера вхождений не повторяются), позиция ищется двоичным поиском
+            del self._ranked[bisect_left(self._ranked, self._rank_key(cmd_id), key=self._rank_key)]
+        if cmd_id is None:
+            cmd_id = len(self._texts)
+            self._ids[command] = cmd_id
+            self._texts.append(command)
+            self._token_sets.append(tokens)
+            self._counts.append(0)
+            self._last.append(0)
+            if ordered:
+                insort(self._sorted, command)
+            else:
+                self._sorted.append(command)
+            for token in tokens:
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = set()
+                    if ordered:
+                        insort(self._tokens, token)
+                    else:
+                        self._tokens.append(token)
+                postings.add(cmd_id)
+
+        self._counts[cmd_id] += count
+        self._last[cmd_id] = position
+        if ordered:
+            insort(self._ranked, cmd_id, key=self._rank_key)
+        else:
+            self._ranked.append(cmd_id)
+
+        self._walk(self._prefix_root, command, PREFIX_TRIE_DEPTH, cmd_id, ordered)
+        for token in tokens:
+            self._walk(self._token_root, token, len(token), cmd_id, ordered)
+
+    def add(self, command, position):
+        """Учёт команды, оказавшейся в истории под номером position"""
+        self._insert(command, 1, position, ordered=True)
+
+    def _result(self, ids, limit):
+        best = heapq.nlargest(limit, ids, key=self._score)
+        return [(self._last[i], self._texts[i], self._counts[i]) for i in best]
+
+    def _trie_top(self, root, text):
+        node = root
+        for char in text:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.top
+
+    def prefix(self, text, limit=TOP_K):
+        """Команды, начинающиеся с text: [(номер последнего вхождения, команда, частота)]"""
+        if len(text) <= PREFIX_TRIE_DEPTH and limit <= TOP_K:
+            return self._result(self._trie_top(self._prefix_root, text), limit)
+
+        start = bisect_left(self._sorted, text)
+        end = start
+        while end < len(self._sorted) and self._sorted[end].startswith(text):
+            end += 1
+        return self._result((self._ids[c] for c in self._sorted[start:end]), limit)
+
+    def search(self, text, limit=TOP_K):
+        """Команды, содержащие все слова запроса; последнее слово может быть
+        недописанным (поиск по мере ввода)"""
+        tokens = tokenize(text)
+        if not tokens:
+            return []
+        *complete, partial = tokens
+
+        if not complete and limit <= TOP_K and not text[-1:].isspace():
+            # Одно недописанное слово — ответ уже лежит в узле дерева слов
+            return self._result(self._trie_top(self._token_root, partial), limit)
+
+        if text[-1:].isspace():
+            complete.append(partial)
+            partial = None
+
+        sets = sorted((self._postings.get(t, set()) for t in complete), key=len)
+        if sets and not sets[0]:
+            return []
+
+        if sets and len(sets[0]) <= RANKED_SCAN_MIN:
+            candidates = set(sets[0]).intersection(*sets[1:])
+            if partial is not None:
+                candidates = {i for i in candidates if self._has_prefix(i, partial)}
+            return self._result(candidates, limit)
+
+        if partial is not None:
+            candidates = self._token_prefix_ids(partial, RANKED_SCAN_MIN)
+            if candidates is not None:
+                return self._result(candidates.intersection(*sets), limit)
+
+        # Частые слова: перебор команд от лучших к худшим до набора limit результатов
+        found = []
+        for i in self._ranked:
+            if all(i in ids for ids in sets) and (partial is None or self._has_prefix(i, partial)):
+                found.append(i)
+                if len(found) == limit:
+                    break
+        return self._result(found, limit)
+
+    def _has_prefix(self, cmd_id, partial):
+        return any(t.startswith(partial) for t in self._token_sets[cmd_id])
+
+    def _token_prefix_ids(self, partial, max_size=None):
+        """Команды со словом, начинающимся с partial (диапазон в отсортированных
+        словах). None, если объединение выходит больше max_size"""
+        ids = set()
+        total = 0
+        start = bisect_left(self._tokens, partial)
+        for token in islice(self._tokens, start, None):
+            if not token.startswith(partial):
+                break
+            postings = self._postings[token]
+            total += len(postings)
+            if max_size is not None and total > max_size:
+                return None
+            ids |= postings
+        return ids
@@ -0,0 +1,250 @@
+import ctypes
+import io
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from .validator import set_working_dir
+from .logger import setup_logger
+
+logger = setup_logger()
+
+# Сколько фоновых задач выполняется одновременно; остальные ждут в очереди
+DEFAULT_MAX_JOBS = 4
+
+# Вывод задачи до этого размера хранится в памяти, дальше — во временном файле
+JOB_OUTPUT_SPOOL = 1024 * 1024
+
+STATUS_NAMES = {
+    'queued': "В очереди",
+    'running': "Выполняется",
+    'killing': "Прерывается",
+    'finishing': "Выполняется",
+    'done': "Завершено",
+    'failed': "Ошибка",
+    'killed': "Прервано",
+}
+
+_job_streams = threading.local()
+
+
+class JobCancelled(BaseException):
+    """Прерывание фоновой задачи командой kill. Наследуется от BaseException,
+    чтобы обработчики except Exception в командах его не перехватывали"""
+
+
+def _async_raise(thread_id, exc_type):
+    """Возбуждение исключения в другом потоке (None — отмена ещё не сработавшего)"""
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id), ctypes.py_object(exc_type) if exc_type else None
+    )
+
+
+class _ThreadStream:
+    """Подмена sys.stdout/sys.stdin: в потоке фоновой задачи обращения идут
+    к потокам задачи, в остальных — к исходному объекту"""
+
+    def __init__(self, name, original):
+        self._name = name
+        self.original = original
+
+    def __getattr__(self, attr):
+        target = getattr(_job_streams, self._name, None)
+        return getattr(self.original if target is None else target, attr)
+
+
+class JobOutput:
+    """Буфер вывода фоновой задачи. Нет fileno и buffer, поэтому команды
+    пишут в него текстом, а не напрямую в дескриптор терминала"""
+
+    def __init__(self):
+        self._file = tempfile.SpooledTemporaryFile(
+            max_size=JOB_OUTPUT_SPOOL, mode='w+', encoding='utf-8', errors='replace'
+        )
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            return self._file.write(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def dump(self, out):
+        """Вывод накопленного текста в out по блокам"""
+        with self._lock:
+            self._file.seek(0)
+            shutil.copyfileobj(self._file, out)
+            self._file.seek(0, io.SEEK_END)
+
+    def close(self):
+        self._file.close()
+
+
+class Job:
+
+    def __init__(self, job_id, command_line, cwd):
+        self.id = job_id
+        self.command_line = command_line
+        self.cwd = cwd
+        self.status = 'queued'
+        self.output = JobOutput()
+        self.thread = None
+        self.started_at = None
+        self.finished_at = None
+        self.reported = False
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'killed')
+
+
+class JobManager:
+    """Фоновые задачи: каждая выполняется в своём потоке со своим выводом
+    и рабочей директорией, захваченной при запуске. Одновременно работает
+    не больше max_jobs задач, остальные ждут в порядке запуска"""
+
+    def __init__(self, max_jobs=DEFAULT_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs = {}
+        self._queue = []
+        self._active = 0
+        self._next_id = 1
+        self._cond = threading.Condition()
+
+    def start(self, command_line, target, cwd):
+        """Запуск target() в фоне; результат задачи — его возвращаемое значение"""
+        with self._cond:
+            job = Job(self._next_id, command_line, str(cwd))
+            self._next_id += 1
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            if not isinstance(sys.stdout, _ThreadStream):
+                sys.stdout = _ThreadStream('stdout', sys.stdout)
+            if not isinstance(sys.stdin, _ThreadStream):
+                sys.stdin = _ThreadStream('stdin', sys.stdin)
+
+        job.thread = threading.Thread(target=self._worker, args=(job, target),
+                                      name=f"job-{job.id}", daemon=True)
+        job.thread.start()
+        logger.info(f"job [{job.id}] {command_line} запущена")
+        return job
+
+    def set_limit(self, max_jobs):
+        with self._cond:
+            self.max_jobs = max_jobs
+            self._cond.notify_all()
+
+    def _worker(self, job, target):
+        with self._cond:
+            self._cond.wait_for(lambda: job.status != 'queued' or
+                                (self._active < self.max_jobs and self._queue[0] is job))
+            self._queue.remove(job)
+            if job.status != 'queued':
+                # Прервана командой kill, не дождавшись очереди
+                self._finish(job, 'killed')
+                return
+            self._active += 1
+            job.status = 'running'
+            job.started_at = time.time()
+
+        _job_streams.stdout = job.output
+        # Ввода у фоновой задачи нет: input() получает конец файла
+        _job_streams.stdin = io.StringIO()
+        set_working_dir(job.cwd)
+        killed = False
+        ok = False
+        try:
+            try:
+                ok = bool(target())
+            except Exception as e:
+                print(f"Ошибка при выполнении команды: {e}")
+                logger.exception(f"job [{job.id}] {job.command_line} ERROR: {e}")
+            finally:
+                with self._cond:
+                    if job.status == 'killing':
+                        # Исключение могло ещё не сработать: отменяем его
+                        _async_raise(threading.get_ident(), None)
+                        killed = True
+                    else:
+                        job.status = 'finishing'
+        except JobCancelled:
+            killed = True
+        finally:
+            _job_streams.stdout = None
+            _job_streams.stdin = None
+            set_working_dir(None)
+
+        with self._cond:
+            self._active -= 1
+            self._finish(job, 'killed' if killed else 'done' if ok else 'failed')
+
+    def _finish(self, job, status):
+        """Завершение задачи (под self._cond)"""
+        job.status = status
+        job.finished_at = time.time()
+        if not self._queue and not self._active:
+            # Фоновых задач не осталось: возвращаем исходные stdout и stdin
+            if isinstance(sys.stdout, _ThreadStream):
+                sys.stdout = sys.stdout.original
+            if isinstance(sys.stdin, _ThreadStream):
+                sys.stdin = sys.stdin.original
+        self._cond.notify_all()
+        logger.info(f"job [{job.id}] {job.command_line}: {STATUS_NAMES[status]}")
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._cond:
+            return list(self._jobs.values())
+
+    def kill(self, job_id):
+        """Прерывание задачи. Выполняющаяся задача прерывается при ближайшем
+        исполнении Python-кода в её потоке. False, если задача уже завершена"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise KeyError(job_id)
+            if job.status == 'queued':
+                job.status = 'killing'
+                self._cond.notify_all()
+                return True
+            if job.status != 'running':
+                return job.status == 'killing'
+            job.status = 'killing'
+            _async_raise(job.thread.ident, JobCancelled)
+            return True
+
+    def wait(self, job_ids=None, timeout=None):
+        """Ожидание завершения задач (по умолчанию — всех). True, если все
+        ожидаемые задачи завершились успешно"""
+        with self._cond:
+            jobs = [self._jobs[i] for i in job_ids] if job_ids else list(self._jobs.values())
+            self._cond.wait_for(lambda: all(job.finished for job in jobs), timeout)
+            return all(job.status == 'done' for job in jobs)
+
+    def active_count(self):
+        with self._cond:
+            return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def report(self, out=None, job_ids=None):
+        """Вывод завершившихся задач, о которых ещё не сообщалось, вместе с их
+        выводом; сведения о них после этого удаляются"""
+        out = out or sys.stdout
+        with self._cond:
+            ready = [job for job in self._jobs.values()
+                     if job.finished and not job.reported and (job_ids is None or job.id in job_ids)]
+            for job in ready:
+                job.reported = True
+                del self._jobs[job.id]
+
+        for job in ready:
+            out.write(f"[{job.id}] {STATUS_NAMES[job.status]}  {job.command_line}\n")
+            job.output.dump(out)
+            job.output.close()
+        return ready
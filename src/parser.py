@@ -15,4 +15,67 @@ def parse_command(command_line):
         error_msg = str(e)
         if "No closing quotation" in error_msg:
             error_msg = "Ошибка: Незакрытые кавычки в команде"
-        return None, [error_msg]
\ No newline at end of file
+        return None, [error_msg]
+
+def split_background(command_line):
+    """Отделение завершающего & (запуск в фоне): 'cp a b &' -> ('cp a b', True).
+    & в кавычках или экранированный остаётся частью аргумента"""
+    line = command_line.rstrip()
+    if not line.endswith('&'):
+        return command_line, False
+    quote = None
+    escaped = False
+    for char in line[:-1]:
+        if escaped:
+            escaped = False
+        elif char == '\\' and quote != "'":
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+    if quote or escaped:
+        return command_line, False
+    return line[:-1].rstrip(), True
+
+
+def split_pipeline(command_line):
+    """Разбиение строки по символам | вне кавычек: 'cat "a|b" | grep x' ->
+    ['cat "a|b" ', ' grep x']"""
+    parts = []
+    current = []
+    quote = None
+    escaped = False
+    for char in command_line:
+        if escaped:
+            escaped = False
+        elif char == '\\' and quote != "'":
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '|':
+            parts.append(''.join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append(''.join(current))
+    return parts
+
+
+def parse_pipeline(command_line):
+    """Разбор конвейера: список (команда, аргументы) для каждой стадии.
+    Ошибка разбора любой стадии возвращается как [(None, [сообщение])]"""
+    parts = split_pipeline(command_line)
+    stages = []
+    for part in parts:
+        cmd, args = parse_command(part)
+        if cmd is None:
+            if len(parts) > 1 and not args:
+                args = ["Ошибка: Пустая команда в конвейере"]
+            return [(None, args)]
+        stages.append((cmd, args))
+    return stages
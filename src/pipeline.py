@@ -0,0 +1,97 @@
+import codecs
+import sys
+
+# Строка длиннее этого предела при разбиении потока на строки отдаётся частями
+MAX_LINE_LENGTH = 16 * 1024 * 1024
+
+
+class BinaryOutput:
+    """Вывод байтов в stdout: напрямую в двоичный буфер, а если его нет —
+    через инкрементальный декодер"""
+
+    def __init__(self):
+        sys.stdout.flush()
+        self.buffer = getattr(sys.stdout, 'buffer', None)
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.last = b'\n'
+
+    def write(self, data):
+        if not data:
+            return
+        self.last = data[-1:]
+        if self.buffer is not None:
+            self.buffer.write(data)
+        else:
+            sys.stdout.write(self.decoder.decode(data))
+
+    def flush(self):
+        if self.buffer is not None:
+            self.buffer.flush()
+        sys.stdout.flush()
+
+    def close(self):
+        # Как и print, завершаем вывод переводом строки, если его не было
+        if self.last != b'\n':
+            self.write(b'\n')
+        if self.buffer is not None:
+            self.buffer.flush()
+        else:
+            sys.stdout.write(self.decoder.decode(b'', final=True))
+        sys.stdout.flush()
+
+
+def iter_lines(chunks):
+    """Разбиение потока блоков байтов на строки (с переводом строки в конце).
+    В памяти держится не больше одной строки"""
+    carry = b''
+    for chunk in chunks:
+        data = carry + chunk if carry else chunk
+        start = 0
+        while True:
+            idx = data.find(b'\n', start)
+            if idx == -1:
+                break
+            yield data[start:idx + 1]
+            start = idx + 1
+        carry = data[start:]
+        if len(carry) >= MAX_LINE_LENGTH:
+            yield carry
+            carry = b''
+    if carry:
+        yield carry
+
+
+def drain(stream):
+    """Вывод потока в stdout. Возвращает результат последней стадии:
+    False, если генератор завершился через return False"""
+    out = BinaryOutput()
+    try:
+        while True:
+            try:
+                chunk = next(stream)
+            except StopIteration as stop:
+                return stop.value is not False
+            out.write(chunk)
+    finally:
+        stream.close()
+        out.close()
+
+
+def run_pipeline(stages, stream_commands):
+    """Выполнение конвейера cmd1 | cmd2 | ...
+
+    Каждая стадия — генератор блоков байтов, получающий на вход генератор
+    предыдущей стадии (у первой — None). Данные идут по блокам, поэтому
+    память не зависит от объёма; когда стадия заканчивает чтение раньше
+    (head), вышестоящие генераторы закрываются и прекращают работу.
+    Код результата — как у последней стадии"""
+    stream = None
+    for cmd, args in stages:
+        factory = stream_commands.get(cmd)
+        if factory is None:
+            if stream is not None:
+                stream.close()
+            print(f"Команда {cmd} не поддерживает конвейер")
+            return False
+        stream = factory(args, stream)
+    return drain(stream)
@@ -0,0 +1,439 @@
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+import uuid
+from pathlib import Path
+from .copier import file_digest
+from .walker import walk
+
+# Имя корзины в корне других файловых систем (по аналогии с .Trash-uid)
+DEVICE_TRASH_NAME = ".minishell_trash"
+
+# Файлы до этого размера с одинаковым содержимым хранятся один раз
+DEDUP_MAX_SIZE = 16 * 1024 * 1024
+
+# Ограничения корзины по умолчанию: при превышении удаляются самые старые объекты
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+DEFAULT_MAX_AGE_DAYS = 30
+
+# Журнал изменений корзины переписывается в снимок, если в нём больше записей,
+# чем это число и чем удвоенное число объектов
+TRASH_LOG_COMPACT_MIN = 1000
+
+_manifest_lock = threading.Lock()
+
+# Последнее прочитанное состояние корзин процесса: {корень: состояние}
+_states = {}
+
+
+def _mount_point(path):
+    """Корень файловой системы, на которой лежит path"""
+    path = Path(path).resolve()
+    dev = os.lstat(path).st_dev
+    while path.parent != path and os.lstat(path.parent).st_dev == dev:
+        path = path.parent
+    return path
+
+
+def trash_root_for(path, default_root):
+    """Корзина на той же файловой системе, что и path: перенос в неё — это
+    rename, а не копирование. Если такую корзину создать нельзя, возвращается
+    default_root"""
+    default_root = Path(default_root).resolve()
+    default_root.mkdir(parents=True, exist_ok=True)
+
+    dev = os.lstat(path).st_dev
+    if os.stat(default_root).st_dev == dev:
+        return default_root
+
+    candidate = _mount_point(path) / DEVICE_TRASH_NAME
+    try:
+        candidate.mkdir(exist_ok=True)
+        if os.stat(candidate).st_dev == dev:
+            return candidate
+    except OSError:
+        pass
+    return default_root
+
+
+def _tree_size(path):
+    """Размер файла или каталога (только stat, содержимое не читается)"""
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_size
+    total = 0
+    for entry in walk(path, ignore_files=(), with_symlinks=True, skip_vcs=False):
+        try:
+            total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            pass
+    return total
+
+
+def _signature(path):
+    """Признак изменения файла другим процессом (None, если файла нет)"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _apply(data, entry):
+    """Применение записи журнала корзины к состоянию"""
+    op = entry['op']
+    if op == 'put':
+        item = entry['item']
+        key = item.get('blob')
+        if key is not None:
+            if 'blob' in entry:
+                data['blobs'][key] = dict(entry['blob'])
+            else:
+                data['blobs'][key]['refs'] += 1
+        data['items'][entry['id']] = dict(item)
+    elif op == 'drop':
+        item = data['items'].pop(entry['id'], None)
+        blob = data['blobs'].get(item.get('blob')) if item else None
+        if blob is not None:
+            blob['refs'] -= 1
+            if blob['refs'] <= 0:
+                del data['blobs'][item['blob']]
+    elif op == 'size':
+        if entry['id'] in data['items']:
+            data['items'][entry['id']]['size'] = entry['size']
+    elif op == 'digest':
+        if entry['key'] in data['blobs']:
+            data['blobs'][entry['key']]['digest'] = entry['digest']
+    elif op == 'settings':
+        data['settings'].update(entry['settings'])
+
+
+def _remove(path):
+    path = Path(path)
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+
+def parse_size(text):
+    """'500M', '10G', '2048' -> байты"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    text = text.strip().upper().rstrip('B')
+    multiplier = 1
+    if text and text[-1] in units:
+        multiplier = units[text[-1]]
+        text = text[:-1]
+    return int(float(text) * multiplier)
+
+
+class TrashStore:
+    """Корзина с манифестом на диске.
+
+    Каждый объект получает уникальный id, поэтому перебор имён name_1, name_2...
+    не нужен. Небольшие файлы с одинаковым содержимым хранятся один раз; хэш
+    считается, только если в корзине уже есть файл того же размера. Манифест
+    лежит в основной корзине и описывает объекты во всех корзинах устройств:
+    снимок manifest.json и журнал изменений manifest.log, в который каждая
+    операция дописывает строку. Снимок переписывается только при сжатии"""
+
+    def __init__(self, root):
+        self.root = Path(root).resolve()
+        self.manifest_path = self.root / "manifest.json"
+        self.log_path = self.root / "manifest.log"
+
+    def _load(self):
+        """Текущее состояние (под _manifest_lock). Состояние процесса
+        переиспользуется: из журнала читается только дописанный хвост"""
+        state = _states.get(self.root)
+        snapshot = _signature(self.manifest_path)
+        log = _signature(self.log_path)
+        if (state is None or state['snapshot'] != snapshot or log is None
+                or log[0] != state['log_ino'] or log[2] < state['offset']):
+            state = {'data': self._read_snapshot(), 'snapshot': snapshot,
+                     'log_ino': log and log[0], 'offset': 0, 'entries': 0}
+            _states[self.root] = state
+        if log is not None and log[2] > state['offset']:
+            with open(self.log_path, 'rb') as f:
+                f.seek(state['offset'])
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # Недописанная при сбое последняя строка
+                        break
+                    _apply(state['data'], json.loads(line))
+                    state['offset'] += len(line)
+                    state['entries'] += 1
+        return state['data']
+
+    def _read_snapshot(self):
+        data = {'settings': {}, 'items': {}, 'blobs': {}}
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        data['settings'].setdefault('max_bytes', DEFAULT_MAX_BYTES)
+        data['settings'].setdefault('max_age_days', DEFAULT_MAX_AGE_DAYS)
+        for key, blob in data['blobs'].items():
+            # Прежний формат: ключ — хэш содержимого и корзина устройства
+            if 'digest' not in blob and '@' in key:
+                blob['digest'], blob['root'] = key.split('@', 1)
+        return data
+
+    def _log(self, data, *entries):
+        """Применение изменений и дозапись их в журнал (под _manifest_lock)"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        state = _states[self.root]
+        payload = b''.join(json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n'
+                           for entry in entries)
+        with open(self.log_path, 'ab') as f:
+            f.write(payload)
+            state['log_ino'] = os.fstat(f.fileno()).st_ino
+        for entry in entries:
+            _apply(data, entry)
+        state['offset'] += len(payload)
+        state['entries'] += len(entries)
+        if state['entries'] > max(TRASH_LOG_COMPACT_MIN, 2 * len(data['items'])):
+            self._compact(data)
+
+    def _compact(self, data):
+        """Перезапись снимка текущим состоянием и очистка журнала"""
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+        with open(self.log_path, 'wb') as f:
+            log_ino = os.fstat(f.fileno()).st_ino
+        _states[self.root] = {'data': data, 'snapshot': _signature(self.manifest_path),
+                              'log_ino': log_ino, 'offset': 0, 'entries': 0}
+
+    @staticmethod
+    def new_id():
+        return uuid.uuid4().hex[:12]
+
+    def put(self, path, item_id=None):
+        """Перемещение файла или каталога в корзину. id можно выбрать заранее
+        (чтобы записать его в журнал до операции). Возвращает (id, путь в корзине).
+        Размер каталога здесь не считается (см. _measure): удаление — одно
+        переименование и одна строка в журнале"""
+        path = Path(path)
+        st = os.lstat(path)
+        device_root = trash_root_for(path, self.root)
+        item_id = item_id or self.new_id()
+        item = {
+            'name': path.name,
+            'original': str(path),
+            'deleted_at': time.time(),
+            'mode': st.st_mode,
+            'mtime': st.st_mtime,
+        }
+        entry = {'op': 'put', 'id': item_id, 'item': item}
+
+        with _manifest_lock:
+            data = self._load()
+            entries = []
+
+            if stat.S_ISREG(st.st_mode) and st.st_size <= DEDUP_MAX_SIZE:
+                key, digest_entries = self._find_blob(data, path, st.st_size, str(device_root))
+                entries += digest_entries
+                if key is not None:
+                    # Такое содержимое уже в корзине: второй экземпляр не хранится
+                    path.unlink()
+                    blob_path = data['blobs'][key]['path']
+                else:
+                    key = item_id
+                    blob_path = device_root / "blobs" / item_id
+                    blob_path.parent.mkdir(parents=True, exist_ok=True)
+                    self._move(path, blob_path)
+                    entry['blob'] = {'path': str(blob_path), 'size': st.st_size, 'refs': 1,
+                                     'root': str(device_root), 'digest': None}
+                    # Хэш нового файла, если он уже посчитан при поиске совпадения
+                    for digest_entry in digest_entries:
+                        if digest_entry['key'] is None:
+                            entry['blob']['digest'] = digest_entry['digest']
+                    entries = [e for e in entries if e['key'] is not None]
+                item.update(blob=key, path=str(blob_path), size=st.st_size)
+            else:
+                stored_path = device_root / "items" / f"{item_id}-{path.name}"
+                stored_path.parent.mkdir(parents=True, exist_ok=True)
+                self._move(path, stored_path)
+                item.update(path=str(stored_path), size=None if stat.S_ISDIR(st.st_mode) else st.st_size)
+
+            self._log(data, *entries, entry)
+            self._enforce_quota(data, keep=item_id)
+
+        return item_id, Path(item['path'])
+
+    def _find_blob(self, data, path, size, device_root):
+        """Хранимое содержимое, совпадающее с файлом path: (ключ или None,
+        записи журнала с вычисленными хэшами). Файлы хэшируются только при
+        совпадении размера, хэш хранимого файла считается один раз"""
+        candidates = [(key, blob) for key, blob in data['blobs'].items()
+                      if blob['size'] == size and blob.get('root') == device_root
+                      and os.path.exists(blob['path'])]
+        if not candidates:
+            return None, []
+        digest = file_digest(path).hex()
+        entries = []
+        for key, blob in candidates:
+            if blob.get('digest') is None:
+                entries.append({'op': 'digest', 'key': key, 'digest': file_digest(blob['path']).hex()})
+                blob_digest = entries[-1]['digest']
+            else:
+                blob_digest = blob['digest']
+            if blob_digest == digest:
+                return key, entries
+        return None, entries + [{'op': 'digest', 'key': None, 'digest': digest}]
+
+    def _move(self, src, dst):
+        try:
+            os.rename(src, dst)
+        except OSError:
+            # Переименование невозможно (например, другая ФС): копирование и удаление
+            shutil.move(str(src), str(dst))
+
+    def restore(self, item_id, original=None):
+        """Возврат объекта из корзины на исходное (или указанное) место"""
+        with _manifest_lock:
+            data = self._load()
+            item = data['items'].get(item_id)
+            if item is None:
+                raise FileNotFoundError(f"Объект {item_id} отсутствует в корзине")
+
+            target = Path(original or item['original'])
+            target.parent.mkdir(parents=True, exist_ok=True)
+
+            key = item.get('blob')
+            if key is not None:
+                blob = data['blobs'][key]
+                if blob['refs'] > 1:
+                    shutil.copyfile(blob['path'], target)
+                else:
+                    self._move(blob['path'], target)
+                # Содержимое общее, а права и время изменения — свои у каждого объекта
+                os.chmod(target, stat.S_IMODE(item['mode']))
+                os.utime(target, (item['mtime'], item['mtime']))
+            else:
+                self._move(item['path'], target)
+
+            self._log(data, {'op': 'drop', 'id': item_id})
+        return target
+
+    def _drop(self, data, item_id):
+        """Окончательное удаление объекта; возвращает освобождённый объём"""
+        item = data['items'][item_id]
+        key = item.get('blob')
+        blob = data['blobs'].get(key) if key is not None else None
+        freed = 0
+        if key is None:
+            freed = self._measure(data, item_id)
+            _remove(item['path'])
+        elif blob is not None and blob['refs'] <= 1:
+            _remove(blob['path'])
+            freed = blob['size']
+        self._log(data, {'op': 'drop', 'id': item_id})
+        return freed
+
+    def _measure(self, data, item_id):
+        """Размер объекта; размер каталога считается при первом запросе
+        (обходом уже перенесённого в корзину дерева) и сохраняется в манифесте"""
+        item = data['items'][item_id]
+        if item['size'] is None:
+            try:
+                size = _tree_size(item['path'])
+            except OSError:
+                size = 0
+            self._log(data, {'op': 'size', 'id': item_id, 'size': size})
+        return item['size']
+
+    def _stored_bytes(self, data, skip=None):
+        own = sum(self._measure(data, item_id) for item_id, item in list(data['items'].items())
+                  if 'blob' not in item and item_id != skip)
+        return own + sum(blob['size'] for blob in data['blobs'].values())
+
+    def _enforce_quota(self, data, keep=None):
+        """Вытеснение самых давно удалённых объектов сверх лимитов возраста и
+        размера. Объект keep (только что удалённый) не вытесняется, и размер
+        его каталога здесь не считается — он войдёт в сумму при следующей проверке"""
+        settings = data['settings']
+        evicted = []
+        oldest_first = sorted(data['items'], key=lambda i: data['items'][i]['deleted_at'])
+
+        max_age_days = settings.get('max_age_days')
+        if max_age_days is not None:
+            limit = time.time() - max_age_days * 86400
+            for item_id in list(oldest_first):
+                if item_id != keep and data['items'][item_id]['deleted_at'] < limit:
+                    self._drop(data, item_id)
+                    oldest_first.remove(item_id)
+                    evicted.append(item_id)
+
+        max_bytes = settings.get('max_bytes')
+        if max_bytes is not None:
+            total = self._stored_bytes(data, skip=keep)
+            for item_id in oldest_first:
+                if total <= max_bytes:
+                    break
+                if item_id == keep:
+                    continue
+                total -= self._drop(data, item_id)
+                evicted.append(item_id)
+
+        return evicted
+
+    def items(self, measure=False):
+        """Объекты корзины от старых к новым: [(id, описание)]. При measure
+        считаются ещё не известные размеры каталогов"""
+        with _manifest_lock:
+            data = self._load()
+            if measure:
+                for item_id in list(data['items']):
+                    self._measure(data, item_id)
+            return sorted(data['items'].items(), key=lambda pair: pair[1]['deleted_at'])
+
+    def purge(self, item_ids=None, older_than_days=None):
+        """Окончательное удаление: выбранных объектов, старше N дней или всех.
+        Возвращает (число объектов, освобождённый объём)"""
+        with _manifest_lock:
+            data = self._load()
+            if item_ids is None:
+                item_ids = list(data['items'])
+            if older_than_days is not None:
+                limit = time.time() - older_than_days * 86400
+                item_ids = [i for i in item_ids if data['items'][i]['deleted_at'] < limit]
+
+            count = freed = 0
+            for item_id in item_ids:
+                if item_id not in data['items']:
+                    raise KeyError(item_id)
+                freed += self._drop(data, item_id)
+                count += 1
+        return count, freed
+
+    def set_quota(self, max_bytes=None, max_age_days=None):
+        with _manifest_lock:
+            data = self._load()
+            settings = {}
+            if max_bytes is not None:
+                settings['max_bytes'] = max_bytes
+            if max_age_days is not None:
+                settings['max_age_days'] = max_age_days
+            if settings:
+                self._log(data, {'op': 'settings', 'settings': settings})
+            return self._enforce_quota(data)
+
+    def stats(self):
+        with _manifest_lock:
+            data = self._load()
+            stored = self._stored_bytes(data)
+            logical = sum(item['size'] for item in data['items'].values())
+            return {
+                'items': len(data['items']),
+                'logical_bytes': logical,
+                'stored_bytes': stored,
+                'blobs': len(data['blobs']),
+                'max_bytes': data['settings']['max_bytes'],
+                'max_age_days': data['settings']['max_age_days'],
+            }
@@ -1,5 +1,35 @@
+import os
+import threading
 from pathlib import Path
 
+# Рабочая директория потока фоновой задачи (захватывается при её запуске);
+# остальные потоки работают в текущей директории процесса
+_thread_cwd = threading.local()
+
+
+def working_dir():
+    """Текущая директория: у фоновой задачи своя, иначе os.getcwd()"""
+    return getattr(_thread_cwd, 'path', None) or os.getcwd()
+
+
+def set_working_dir(path):
+    """Закрепление рабочей директории за текущим потоком (None — сброс)"""
+    _thread_cwd.path = str(path) if path is not None else None
+
+
+def change_working_dir(path):
+    """cd: у фоновой задачи меняется только её директория, иначе — директория процесса"""
+    if getattr(_thread_cwd, 'path', None):
+        set_working_dir(path)
+    else:
+        os.chdir(path)
+
+
+def resolve_path(path):
+    """Абсолютный путь аргумента относительно рабочей директории"""
+    return Path(working_dir(), path).resolve()
+
+
 def ensure_not_root(path):
     clean_path = str(path).strip('"').strip("'")
     resolved_path = Path(path).resolve()
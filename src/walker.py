@@ -0,0 +1,138 @@
+import os
+from fnmatch import fnmatch
+from pathlib import Path
+
+# Служебные каталоги систем контроля версий (по умолчанию пропускаются)
+DEFAULT_EXCLUDE_DIRS = {'.git', '.hg', '.svn'}
+
+# Файлы с шаблонами игнорирования в стиле .gitignore
+IGNORE_FILES = ('.gitignore', '.ignore')
+
+# Сколько байт читать из начала файла для определения двоичного содержимого
+BINARY_CHECK_SIZE = 8192
+
+
+def is_binary(path):
+    """Двоичный ли файл: по наличию нулевого байта в начале файла"""
+    try:
+        with open(path, 'rb') as f:
+            return b'\0' in f.read(BINARY_CHECK_SIZE)
+    except OSError:
+        return False
+
+
+def load_ignore_rules(dir_path, ignore_files=IGNORE_FILES):
+    """Правила из файлов игнорирования в каталоге: (каталог, шаблон, отрицание,
+    только каталоги, привязка к каталогу)"""
+    rules = []
+    for name in ignore_files:
+        try:
+            with open(os.path.join(dir_path, name), 'r', encoding='utf-8', errors='ignore') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            line = line.lstrip('/')
+            if line:
+                rules.append((dir_path, line, negate, dir_only, anchored))
+    return rules
+
+
+def is_ignored(path, name, is_dir, rules):
+    """Применение правил игнорирования: побеждает последнее совпавшее"""
+    ignored = False
+    for base, pattern, negate, dir_only, anchored in rules:
+        if dir_only and not is_dir:
+            continue
+        if anchored:
+            target = Path(os.path.relpath(path, base)).as_posix()
+        else:
+            target = name
+        if fnmatch(target, pattern):
+            ignored = not negate
+    return ignored
+
+
+def walk(root, recursive=True, max_depth=None, include=None, exclude=None,
+         ignore_files=IGNORE_FILES, skip_binary=False, with_dirs=False, with_symlinks=False,
+         skip_vcs=True, onerror=None):
+    """Итеративный обход дерева через os.scandir.
+
+    Отдаёт os.DirEntry файлов (и каталогов при with_dirs — раньше их
+    содержимого). Тип записи берётся из кэша DirEntry, поэтому отдельный stat
+    на каждый элемент не нужен. include — шаблоны имён файлов, exclude —
+    шаблоны имён файлов и каталогов, max_depth — глубина, на которой лежат
+    содержимое root (1) и вложенные каталоги (2, 3, ...). При with_symlinks
+    символические ссылки отдаются как есть, без перехода по ним; skip_vcs=False
+    отключает пропуск каталогов .git/.hg/.svn (нужно для копирования)"""
+    root = os.fspath(root)
+    if not recursive:
+        max_depth = 1
+
+    rules = load_ignore_rules(root, ignore_files) if ignore_files else []
+    stack = [(root, 1, rules)]
+
+    while stack:
+        dir_path, depth, rules = stack.pop()
+        try:
+            with os.scandir(dir_path) as it:
+                entries = list(it)
+        except OSError as e:
+            if onerror is not None:
+                onerror(e)
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+
+            if exclude and any(fnmatch(entry.name, pattern) for pattern in exclude):
+                continue
+            if rules and is_ignored(entry.path, entry.name, is_dir, rules):
+                continue
+
+            if with_symlinks and entry.is_symlink():
+                yield entry
+                continue
+
+            if is_dir:
+                if skip_vcs and entry.name in DEFAULT_EXCLUDE_DIRS:
+                    continue
+                if with_dirs:
+                    yield entry
+                if max_depth is None or depth < max_depth:
+                    subdirs.append(entry.path)
+                continue
+
+            try:
+                if not entry.is_file():
+                    continue
+            except OSError:
+                continue
+
+            if include and not any(fnmatch(entry.name, pattern) for pattern in include):
+                continue
+            if skip_binary and is_binary(entry.path):
+                continue
+
+            yield entry
+
+        # Обратный порядок в стеке сохраняет порядок обхода каталогов
+        for subdir in reversed(subdirs):
+            sub_rules = rules
+            if ignore_files:
+                sub_rules = rules + load_ignore_rules(subdir, ignore_files)
+            stack.append((subdir, depth + 1, sub_rules))
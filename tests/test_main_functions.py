@@ -10,7 +10,10 @@ sys.path.append(str(Path(__file__).parent.parent))
 from src.commands.basic import BasicCommands
 from src.commands.archive import ArchiveCommands
 from src.commands.grep import GrepCommand
-from src.commands.history import HistoryManager, UndoManager, HistoryCommands
+from src.commands.index import IndexCommands, extract_literals
+from src.commands.history import HistoryManager, UndoManager, HistoryCommands, HISTORY_COMPACT_MIN
+from src.commands.trash import TrashCommands
+from src.trash import TrashStore
 from src.parser import parse_command
 
 
@@ -56,7 +59,7 @@ def history_manager():
 def undo_manager():
     temp_dir = tempfile.mkdtemp()
     trash_dir = Path(temp_dir) / ".trash"
-    um = UndoManager()
+    um = UndoManager(journal_file=Path(temp_dir) / ".undo_journal")
     um.trash_dir = trash_dir
     trash_dir.mkdir(parents=True, exist_ok=True)
 
@@ -165,4 +168,834 @@ def test_history_commands(temp_dir, history_manager, undo_manager, capsys):
     history_manager.add_command("rm to_delete.txt")
     assert basic_cmds.rm(["to_delete.txt"]) is True
     assert commands.undo([]) is True
-    assert (temp_dir / "to_delete.txt").exists()
\ No newline at end of file
+    assert (temp_dir / "to_delete.txt").exists()
+
+def test_grep_parallel(temp_dir, capsys):
+    commands = GrepCommand()
+    tree = temp_dir / "tree"
+    for d in range(4):
+        (tree / f"d{d}").mkdir(parents=True)
+        for f in range(20):
+            (tree / f"d{d}" / f"f{f:02}.txt").write_text(f"line\nmatch {d}-{f}\n", encoding='utf-8')
+
+    assert commands.grep(["match", "tree", "-r", "-j", "2"]) is True
+    parallel_out = capsys.readouterr().out
+    assert commands.grep(["match", "tree", "-r", "-j", "1"]) is True
+    serial_out = capsys.readouterr().out
+
+    assert parallel_out == serial_out
+    assert parallel_out.count(":2:match") == 80
+
+    assert commands.grep(["match", "tree", "-j", "0"]) is False
+
+
+def test_grep_streaming(temp_dir, capsys):
+    commands = GrepCommand()
+    (temp_dir / "long.txt").write_text("x" * 3_000_000 + "needle\nвторая Строка\n", encoding='utf-8')
+
+    assert commands.grep(["needle", "long.txt"]) is True
+    assert f"long.txt:1:{'x' * 3_000_000}needle" in capsys.readouterr().out
+
+    assert commands.grep(["строка", "long.txt", "-i"]) is True
+    assert "long.txt:2:вторая Строка" in capsys.readouterr().out
+
+    (temp_dir / "empty.txt").write_text("", encoding='utf-8')
+    assert commands.grep(["needle", "empty.txt"]) is False
+
+    # '.' и {n} считают символы, а не байты UTF-8
+    (temp_dir / "cyr.txt").write_text("aжb\n", encoding='utf-8')
+    assert commands.grep(["a.b", "cyr.txt"]) is True
+    assert commands.grep(["^.{3}$", "cyr.txt"]) is True
+    assert commands.grep(["a[^x]b", "cyr.txt"]) is True
+
+    # '$' совпадает и в конце строк с переводом CRLF
+    (temp_dir / "crlf.txt").write_bytes(b"foo\r\nbar\r\n")
+    assert commands.grep(["foo$", "crlf.txt"]) is True
+
+
+def test_grep_index(temp_dir, capsys):
+    index_dir = temp_dir / "index_data"
+    index_cmds = IndexCommands(index_dir)
+    commands = GrepCommand(index_dir)
+
+    tree = temp_dir / "indexed"
+    tree.mkdir()
+    (tree / "a.txt").write_text("alpha needle\n", encoding='utf-8')
+    (tree / "b.txt").write_text("beta\n", encoding='utf-8')
+
+    assert extract_literals("need(le)?s+x", False) == [b"need"]
+    assert extract_literals("a|b", False) == []
+    # Хвост экранированной последовательности не считается литералом
+    assert extract_literals(r"foo\x41bar", False) == [b"foo", b"bar"]
+    assert extract_literals(r"foo\u0410bar\N{DIGIT ONE}baz\101qux", False) == [b"foo", b"bar", b"baz", b"qux"]
+
+    assert index_cmds.index(["build", "indexed"]) is True
+    capsys.readouterr()
+
+    assert commands.grep(["Needle", "indexed", "-i", "--index"]) is True
+    assert "a.txt:1:alpha needle" in capsys.readouterr().out
+
+    # Изменённый файл переиндексируется при следующем поиске
+    (tree / "b.txt").write_text("beta with needle and more\n", encoding='utf-8')
+    assert commands.grep(["needle", "indexed", "--index"]) is True
+    assert "b.txt:1:beta with needle" in capsys.readouterr().out
+
+    assert commands.grep(["missing", "indexed", "--index"]) is False
+
+    assert index_cmds.index(["drop", "indexed"]) is True
+    assert not list(index_dir.glob("*.db"))
+
+
+def test_grep_fixed_and_multiple_patterns(temp_dir, capsys):
+    commands = GrepCommand()
+    (temp_dir / "log.txt").write_text("req-101 ok\nreq-202 fail\nx.y literal\nxzy\n", encoding='utf-8')
+    (temp_dir / "ids.txt").write_text("req-101\nreq-202\n\nreq-303\n", encoding='utf-8')
+
+    assert commands.grep(["-F", "x.y", "log.txt"]) is True
+    out = capsys.readouterr().out
+    assert "log.txt:3:x.y literal" in out
+    assert "xzy" not in out
+
+    assert commands.grep(["-e", "REQ-101", "-e", "x.y", "-i", "log.txt"]) is True
+    out = capsys.readouterr().out
+    assert "log.txt:1:req-101 ok" in out
+    assert "log.txt:4:xzy" in out
+
+    assert commands.grep(["-f", "ids.txt", "log.txt"]) is True
+    out = capsys.readouterr().out
+    assert "log.txt:1:" in out and "log.txt:2:" in out
+    assert "log.txt:3:" not in out
+
+
+def test_grep_output_modes(temp_dir, capsys):
+    commands = GrepCommand()
+    (temp_dir / "many.txt").write_text("hit 1\nmiss\nhit 2\nhit 3\n", encoding='utf-8')
+
+    assert commands.grep(["-c", "hit", "many.txt"]) is True
+    assert capsys.readouterr().out.strip().endswith("many.txt:3")
+
+    assert commands.grep(["-m", "2", "hit", "many.txt"]) is True
+    out = capsys.readouterr().out
+    assert "many.txt:3:hit 2" in out
+    assert "hit 3" not in out
+
+    assert commands.grep(["-l", "Содержимое", "."]) is True
+    out = capsys.readouterr().out.splitlines()
+    assert sorted(Path(line).name for line in out) == ["file1.txt", "file2.txt"]
+
+    assert commands.grep(["-q", "hit", "many.txt"]) is True
+    assert commands.grep(["-q", "nothing", ".", "-r"]) is False
+    assert capsys.readouterr().out == ""
+
+
+def test_grep_walker_filters(temp_dir, capsys):
+    commands = GrepCommand()
+    tree = temp_dir / "proj"
+    (tree / ".git").mkdir(parents=True)
+    (tree / "node_modules" / "pkg").mkdir(parents=True)
+    (tree / "src" / "deep").mkdir(parents=True)
+    (tree / ".gitignore").write_text("*.log\nbuild/\n", encoding='utf-8')
+    (tree / "build").mkdir()
+
+    for path in [".git/config", "node_modules/pkg/index.js", "src/main.py", "src/main.js",
+                 "src/deep/util.py", "app.log", "build/out.py"]:
+        (tree / path).write_text("TODO item\n", encoding='utf-8')
+    (tree / "blob.bin").write_bytes(b"TODO\0\1\2")
+
+    assert commands.grep(["TODO", "proj", "-r", "--exclude", "node_modules"]) is True
+    out = capsys.readouterr().out
+    found = sorted(Path(line.split(":")[0]).relative_to(tree).as_posix() for line in out.splitlines())
+    assert found == ["src/deep/util.py", "src/main.js", "src/main.py"]
+
+    assert commands.grep(["-l", "TODO", "proj", "-r", "--include=*.py", "--max-depth", "2"]) is True
+    out = capsys.readouterr().out
+    assert "main.py" in out and "util.py" not in out and "main.js" not in out
+
+
+def test_grep_inside_archives(temp_dir, capsys):
+    archive_cmds = ArchiveCommands()
+    commands = GrepCommand()
+    assert archive_cmds.zip(["subdir", "bundle.zip"]) is True
+    assert archive_cmds.tar(["subdir", "bundle.tar.gz"]) is True
+    capsys.readouterr()
+
+    assert commands.grep(["-z", "подфайла", "bundle.zip"]) is True
+    assert "bundle.zip!subfile.txt:1:Содержимое подфайла" in capsys.readouterr().out
+
+    assert commands.grep(["-z", "-l", "подфайла", "."]) is True
+    out = capsys.readouterr().out
+    assert "bundle.zip!subfile.txt" in out
+    assert "bundle.tar.gz!subdir/subfile.txt" in out
+
+    # Без -z архивы считаются двоичными и пропускаются
+    assert commands.grep(["подфайла", "."]) is False
+
+
+def test_head_tail_commands(temp_dir, history_manager, undo_manager, capsys):
+    commands = BasicCommands(history_manager, undo_manager)
+    lines = [f"строка {i}" for i in range(1, 101)]
+    (temp_dir / "numbers.txt").write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+    assert commands.head(["-n", "3", "numbers.txt"]) is True
+    assert capsys.readouterr().out == "строка 1\nстрока 2\nстрока 3\n"
+
+    assert commands.tail(["-n", "2", "numbers.txt"]) is True
+    assert capsys.readouterr().out == "строка 99\nстрока 100\n"
+
+    assert commands.tail(["numbers.txt"]) is True
+    assert capsys.readouterr().out.splitlines() == lines[-10:]
+
+    assert commands.tail(["-n", "500", "numbers.txt"]) is True
+    assert capsys.readouterr().out.splitlines() == lines
+
+    assert commands.head(["-n", "x", "numbers.txt"]) is False
+    assert commands.tail([]) is False
+
+    # Незнакомый флаг — ошибка, а не 10 строк по умолчанию
+    capsys.readouterr()
+    assert commands.head(["-1", "numbers.txt"]) is False
+    assert commands.tail(["-x", "numbers.txt"]) is False
+    assert capsys.readouterr().out.count("Использование:") == 2
+
+
+def test_tail_follow(temp_dir, history_manager, undo_manager, capsys, monkeypatch):
+    commands = BasicCommands(history_manager, undo_manager)
+    log = temp_dir / "service.log"
+    log.write_text("старт\n", encoding='utf-8')
+
+    # Каждая пауза опроса имитирует работу сервиса, последняя — нажатие Ctrl-C
+    actions = [
+        lambda: log.open('a', encoding='utf-8').write("запрос 1\n"),
+        lambda: log.write_text("", encoding='utf-8'),
+        lambda: log.write_text("после усечения\n", encoding='utf-8'),
+        lambda: (log.rename(temp_dir / "service.log.1"), log.write_text("новый файл\n", encoding='utf-8')),
+        lambda: (log.rename(temp_dir / "service.log.2"), log.write_text("ещё один\n", encoding='utf-8')),
+    ]
+
+    # При повторной ротации предыдущий заново открытый файл закрывается сразу
+    handles = []
+
+    def fake_sleep(interval):
+        if not actions:
+            assert [handle.closed for handle in handles] == [False, True, False]
+            raise KeyboardInterrupt
+        actions.pop(0)()
+
+    real_open = open
+
+    def tracking_open(*args, **kwargs):
+        handle = real_open(*args, **kwargs)
+        handles.append(handle)
+        return handle
+
+    monkeypatch.setattr("src.commands.basic.time.sleep", fake_sleep)
+    monkeypatch.setattr("builtins.open", tracking_open)
+    assert commands.tail(["-f", "-n", "1", "service.log"]) is True
+    assert capsys.readouterr().out == "старт\nзапрос 1\nпосле усечения\nновый файл\nещё один\n"
+    assert len(handles) == 3 and all(handle.closed for handle in handles)
+
+
+def test_ls_command(temp_dir, history_manager, undo_manager, capsys):
+    commands = BasicCommands(history_manager, undo_manager)
+
+    assert commands.ls([]) is True
+    out = capsys.readouterr().out.splitlines()
+    assert out == sorted(out)
+    assert "subdir/" in out and "file1.txt" in out
+
+    assert commands.ls(["-l", "subdir"]) is True
+    line = capsys.readouterr().out.strip()
+    assert line.startswith("-rw") and line.endswith("subfile.txt")
+
+    assert commands.ls(["--offset", "1", "--limit", "2"]) is True
+    assert capsys.readouterr().out.splitlines() == out[1:3]
+
+    assert commands.ls(["-U"]) is True
+    assert sorted(capsys.readouterr().out.splitlines()) == out
+
+    (temp_dir / "empty").mkdir()
+    assert commands.ls(["empty"]) is True
+    assert "Директория пуста" in capsys.readouterr().out
+
+
+def test_cp_recursive_parallel(temp_dir, history_manager, undo_manager, capsys):
+    commands = BasicCommands(history_manager, undo_manager)
+    src = temp_dir / "tree_src"
+    for d in range(3):
+        (src / f"d{d}" / "inner").mkdir(parents=True)
+        for f in range(10):
+            (src / f"d{d}" / "inner" / f"{f}.txt").write_text(f"данные {d} {f}", encoding='utf-8')
+    (src / ".git").mkdir()
+    (src / ".git" / "HEAD").write_text("ref", encoding='utf-8')
+    os.symlink("d0", src / "link")
+
+    assert commands.cp(["-r", "-j", "4", "tree_src", "tree_dst"]) is True
+    out = capsys.readouterr().out
+    assert "файлов: 31" in out
+
+    dst = temp_dir / "tree_dst"
+    assert (dst / "d2" / "inner" / "9.txt").read_text(encoding='utf-8') == "данные 2 9"
+    assert (dst / ".git" / "HEAD").exists()
+    assert os.readlink(dst / "link") == "d0"
+
+
+def test_sync_command(temp_dir, history_manager, undo_manager, capsys):
+    commands = BasicCommands(history_manager, undo_manager)
+    history_cmds = HistoryCommands(history_manager, undo_manager)
+    src = temp_dir / "deploy"
+    (src / "conf").mkdir(parents=True)
+    (src / "app.py").write_text("v1", encoding='utf-8')
+    (src / "conf" / "settings.ini").write_text("a=1", encoding='utf-8')
+
+    assert commands.sync(["deploy", "mirror"]) is True
+    mirror = temp_dir / "mirror"
+    assert (mirror / "conf" / "settings.ini").read_text(encoding='utf-8') == "a=1"
+    capsys.readouterr()
+
+    assert commands.sync(["deploy", "mirror"]) is True
+    assert "Без изменений" in capsys.readouterr().out
+
+    (src / "app.py").write_text("version 2", encoding='utf-8')
+    (src / "new.txt").write_text("new", encoding='utf-8')
+    (mirror / "stale.txt").write_text("old", encoding='utf-8')
+
+    assert commands.sync(["--dry-run", "--delete", "deploy", "mirror"]) is True
+    out = capsys.readouterr().out
+    assert "~ app.py" in out and "+ new.txt" in out and "- stale.txt" in out
+    assert (mirror / "stale.txt").exists()
+
+    assert commands.sync(["--delete", "deploy", "mirror"]) is True
+    assert (mirror / "app.py").read_text(encoding='utf-8') == "version 2"
+    assert (mirror / "new.txt").exists()
+    assert not (mirror / "stale.txt").exists()
+
+    # Одна отмена возвращает состояние до синхронизации целиком
+    assert history_cmds.undo([]) is True
+    assert (mirror / "app.py").read_text(encoding='utf-8') == "v1"
+    assert not (mirror / "new.txt").exists()
+    assert (mirror / "stale.txt").read_text(encoding='utf-8') == "old"
+
+    assert commands.cp(["-r", "--update", "deploy", "mirror"]) is True
+    assert (mirror / "deploy" / "new.txt").exists()
+
+
+def test_rm_moves_into_trash(temp_dir, history_manager, undo_manager):
+    commands = BasicCommands(history_manager, undo_manager)
+    history_cmds = HistoryCommands(history_manager, undo_manager)
+    big_dir = temp_dir / "big"
+    big_dir.mkdir()
+    (big_dir / "data.bin").write_bytes(b"x" * 1024)
+    inode = (big_dir / "data.bin").stat().st_ino
+
+    import io
+    original_stdin = sys.stdin
+    try:
+        sys.stdin = io.StringIO('y\n')
+        assert commands.rm(["-r", "big"]) is True
+    finally:
+        sys.stdin = original_stdin
+
+    # Каталог переименован в корзину, а не скопирован
+    trashed = Path(undo_manager.undo_history[-1]['source'])
+    assert (trashed / "data.bin").stat().st_ino == inode
+
+    assert history_cmds.undo([]) is True
+    assert (big_dir / "data.bin").stat().st_ino == inode
+    assert not trashed.exists()
+
+
+def test_trash_dedup_and_quota(temp_dir, history_manager, undo_manager, capsys):
+    commands = BasicCommands(history_manager, undo_manager)
+    history_cmds = HistoryCommands(history_manager, undo_manager)
+    trash_cmds = TrashCommands(undo_manager)
+    store = TrashStore(undo_manager.trash_dir)
+
+    (temp_dir / "a.txt").write_text("одинаковое содержимое", encoding='utf-8')
+    (temp_dir / "b.txt").write_text("одинаковое содержимое", encoding='utf-8')
+    os.chmod(temp_dir / "b.txt", 0o600)
+    assert commands.rm(["a.txt"]) is True
+    assert commands.rm(["b.txt"]) is True
+
+    # Два объекта, но содержимое хранится один раз
+    stats = store.stats()
+    assert stats['items'] == 2
+    assert stats['blobs'] == 1
+    assert stats['stored_bytes'] * 2 == stats['logical_bytes']
+
+    # Восстановление общего содержимого сохраняет права каждого файла
+    assert history_cmds.undo([]) is True
+    assert (temp_dir / "b.txt").read_text(encoding='utf-8') == "одинаковое содержимое"
+    assert (temp_dir / "b.txt").stat().st_mode & 0o777 == 0o600
+    assert store.stats()['items'] == 1
+
+    assert trash_cmds.trash(["list"]) is True
+    assert "a.txt" in capsys.readouterr().out
+
+    # При превышении лимита вытесняются самые давно удалённые объекты
+    (temp_dir / "big.bin").write_bytes(b"x" * 4096)
+    assert commands.rm(["big.bin"]) is True
+    assert trash_cmds.trash(["quota", "--size", "4K"]) is True
+    assert [item['name'] for _, item in store.items()] == ["big.bin"]
+
+    # Отмена удаления вытесненного файла не удаётся, и операция остаётся в стеке
+    undo_manager.undo_history.pop()
+    record = undo_manager.undo_history[-1]
+    assert history_cmds.undo([]) is False
+    assert "не найден в корзине" in capsys.readouterr().out
+    assert undo_manager.undo_history[-1] is record and record not in undo_manager.redo_history
+    undo_manager.undo_history.pop()
+
+    # Удаление каталога не обходит его дерево и не переписывает манифест:
+    # размер считается при первой проверке квоты или trash stats
+    manifest = undo_manager.trash_dir / "manifest.json"
+    before = manifest.stat().st_mtime_ns if manifest.exists() else None
+    (temp_dir / "tree" / "deep").mkdir(parents=True)
+    (temp_dir / "tree" / "deep" / "f.bin").write_bytes(b"y" * 1000)
+    assert commands.rm(["-r", "-y", "tree"]) is True
+    assert [item['size'] for _, item in store.items()][-1] is None
+    assert (manifest.stat().st_mtime_ns if manifest.exists() else None) == before
+    assert store.stats()['logical_bytes'] >= 1000
+
+    # Состояние восстанавливается из снимка и журнала в новом процессе
+    from src import trash as trash_module
+    expected = store.stats()
+    trash_module._states.clear()
+    assert TrashStore(undo_manager.trash_dir).stats() == expected
+
+    assert trash_cmds.trash(["purge", "--all"]) is True
+    assert store.stats()['items'] == 0
+
+    # Корзина по умолчанию не зависит от cd: после перехода rm пишет в ту же корзину
+    session = UndoManager(journal_file=undo_manager.journal_file)
+    session_cmds = BasicCommands(history_manager, session)
+    assert session.trash_dir == (temp_dir / "data" / ".trash").resolve()
+    assert session_cmds.cd(["subdir"]) is True
+    try:
+        assert session_cmds.rm(["subfile.txt"]) is True
+    finally:
+        os.chdir(temp_dir)
+    assert not (temp_dir / "subdir" / "data").exists()
+    assert [item['name'] for _, item in TrashStore(session.trash_dir).items()] == ["subfile.txt"]
+
+
+def test_undo_journal_across_sessions(temp_dir, history_manager, undo_manager, capsys):
+    commands = BasicCommands(history_manager, undo_manager)
+    history_manager.add_command("cp file1.txt copy1.txt")
+    assert commands.cp(["file1.txt", "copy1.txt"]) is True
+    history_manager.add_command("mv file2.txt moved.txt")
+    assert commands.mv(["file2.txt", "moved.txt"]) is True
+
+    # Новая сессия восстанавливает стек отмены из журнала
+    session = UndoManager(journal_file=undo_manager.journal_file)
+    session.trash_dir = undo_manager.trash_dir
+    history_cmds = HistoryCommands(history_manager, session)
+    assert [op['operation'] for op in session.undo_history] == ['cp', 'mv']
+
+    # Номера команд в журнале относятся к истории прежнего сеанса:
+    # отмена таких операций историю не трогает
+    history_manager.clear_history()
+    history_manager.add_command("ls -l")
+    history_manager.add_command("cat file1.txt")
+    assert history_cmds.undo(["2"]) is True
+    assert (temp_dir / "file2.txt").exists()
+    assert not (temp_dir / "copy1.txt").exists()
+    assert [cmd for _, cmd in history_manager.get_history()] == ["ls -l", "cat file1.txt"]
+
+    assert history_cmds.redo([]) is True
+    assert (temp_dir / "copy1.txt").read_text(encoding='utf-8') == "Содержимое файла 1"
+    assert (temp_dir / "file2.txt").exists()
+
+    # Операция, прерванная сбоем: begin без commit, частично записанный результат
+    session.begin_operation('cp', str(temp_dir / "file1.txt"), str(temp_dir / "partial.txt"),
+                            details={'existed': False})
+    (temp_dir / "partial.txt").write_text("обрыв", encoding='utf-8')
+
+    recovered = UndoManager(journal_file=undo_manager.journal_file)
+    assert not (temp_dir / "partial.txt").exists()
+    assert "Восстановление после сбоя" in capsys.readouterr().out
+    assert [op['operation'] for op in recovered.undo_history] == ['cp']
+    assert [op['operation'] for op in recovered.redo_history] == ['mv']
+
+    recovered.compact()
+    compacted = UndoManager(journal_file=undo_manager.journal_file)
+    assert [op['id'] for op in compacted.undo_history] == [op['id'] for op in recovered.undo_history]
+    assert [op['id'] for op in compacted.redo_history] == [op['id'] for op in recovered.redo_history]
+
+
+def test_history_append_only_log(temp_dir):
+    history_file = temp_dir / "log" / ".history"
+    hm = HistoryManager(history_file)
+    for i in range(5):
+        hm.add_command(f"cmd {i}")
+    assert hm.remove_command(2) is True
+
+    # Команды только дописываются, удаление — метка в конце журнала
+    lines = history_file.read_text(encoding='utf-8').splitlines()
+    assert lines[:5] == [f"cmd {i}" for i in range(5)]
+    assert lines[5] == "\0" + "2"
+
+    # Новая сессия: число команд и последние N — без загрузки всей истории
+    reopened = HistoryManager(history_file)
+    assert reopened.count() == 4
+    assert reopened._history is None
+    assert reopened.get_history() == [(1, "cmd 0"), (2, "cmd 2"), (3, "cmd 3"), (4, "cmd 4")]
+
+    fresh = HistoryManager(history_file)
+    fresh.add_command("cmd 5")
+    fresh.close()
+    assert HistoryManager(history_file).get_history(2) == [(4, "cmd 4"), (5, "cmd 5")]
+
+    # Накопившиеся метки удаления сжимаются перезаписью журнала
+    for i in range(HISTORY_COMPACT_MIN + 1):
+        fresh.add_command(f"extra {i}")
+        fresh.remove_command(fresh.count())
+    assert len(history_file.read_text(encoding='utf-8').splitlines()) < 10
+    assert HistoryManager(history_file).count() == 5
+
+    fresh.clear_history()
+    assert HistoryManager(history_file).get_history() == []
+
+    # Путь по умолчанию фиксируется при создании: после cd история та же
+    first = HistoryManager()
+    first.add_command("cp a b")
+    first.close()
+    default = HistoryManager()
+    os.chdir(temp_dir / "subdir")
+    try:
+        assert default.get_history(3) == [(1, "cp a b")]
+        default.clear_history()
+    finally:
+        os.chdir(temp_dir)
+    assert not (temp_dir / "subdir" / "data").exists()
+    assert HistoryManager().get_history() == []
+
+
+def test_history_search(temp_dir, history_manager, undo_manager, capsys, monkeypatch):
+    commands = HistoryCommands(history_manager, undo_manager)
+    for command in ["ls -l", "cp a.txt b.txt", "grep needle src -r", "ls -l",
+                    "cat notes.txt", "grep needle docs -r", "ls -l"]:
+        history_manager.add_command(command)
+
+    # Частые команды выше, при равной частоте — более свежие
+    assert history_manager.prefix_search("ls")[0] == (7, "ls -l", 3)
+    assert [cmd for _, cmd, _ in history_manager.search("needle")] == [
+        "grep needle docs -r", "grep needle src -r"]
+    assert [cmd for _, cmd, _ in history_manager.search("needle sr")] == ["grep needle src -r"]
+    assert [cmd for _, cmd, _ in history_manager.search("nee")] == [
+        "grep needle docs -r", "grep needle src -r"]
+
+    # Индекс обновляется при добавлении команд
+    history_manager.add_command("grep needle src -r")
+    assert history_manager.search("needle")[0] == (8, "grep needle src -r", 2)
+    assert history_manager.prefix_search("grep needle s")[0][1] == "grep needle src -r"
+
+    assert commands.history(["search", "notes"]) is True
+    assert "5: cat notes.txt" in capsys.readouterr().out
+    assert commands.history(["--prefix", "ls"]) is True
+    assert "7: ls -l  (×3)" in capsys.readouterr().out
+
+    # Без терминала history -r выбирает лучший результат для подстановки
+    monkeypatch.setattr(sys.stdin, "isatty", lambda: False, raising=False)
+    assert commands.history(["-r", "cp"]) is True
+    assert commands.pending_input == "cp a.txt b.txt"
+
+
+def test_batch_mode(temp_dir, capsys, monkeypatch):
+    import io
+    from main import ShellManager, main
+
+    manager = ShellManager()
+    script = ["# комментарий", "cp file1.txt copy.txt", "cat missing.txt", "cat copy.txt"]
+    assert manager.run_batch(script) == 1
+    assert "Содержимое файла 1" in capsys.readouterr().out
+
+    # --fail-fast: после первой ошибки команды не выполняются
+    assert manager.run_batch(["cat missing.txt", "cp file1.txt never.txt"], fail_fast=True) == 1
+    assert not (temp_dir / "never.txt").exists()
+
+    assert manager.run_batch(["cat file1.txt", "exit 3", "cat file2.txt"]) == 3
+    manager.history_manager.close()
+    assert manager.history_manager.get_history()[-1] == (5, "cat file1.txt")
+
+    (temp_dir / "script.msh").write_text("mv copy.txt moved.txt\nls\n", encoding='utf-8')
+    assert main(["script.msh"]) == 0
+    assert (temp_dir / "moved.txt").exists()
+    assert main(["-c", "rm moved.txt"]) == 0
+    assert not (temp_dir / "moved.txt").exists()
+
+    # Сценарий из stdin: подтверждение rm -r не читает следующую строку сценария
+    monkeypatch.setattr(sys, "stdin", io.StringIO("rm -r subdir\ny\ncp file1.txt after.txt\n"))
+    assert main([]) == 1
+    assert (temp_dir / "subdir").is_dir() and (temp_dir / "after.txt").exists()
+    assert main(["-c", "rm -r -y subdir"]) == 0
+    assert not (temp_dir / "subdir").exists()
+
+
+def test_pipeline(temp_dir, history_manager, undo_manager, capsys):
+    from main import ShellManager
+    from src.pipeline import run_pipeline
+
+    (temp_dir / "big.txt").write_text("".join(f"line {i}\n" for i in range(1, 100001)), encoding='utf-8')
+    manager = ShellManager()
+
+    assert manager.run_batch(["cat big.txt | grep 99 | head -n 3"]) == 0
+    assert capsys.readouterr().out == "line 99\nline 199\nline 299\n"
+
+    assert manager.run_batch(['cat big.txt | tail -n 2', 'cat "big.txt" | grep -c "line 5"']) == 0
+    assert capsys.readouterr().out == "line 99999\nline 100000\n11111\n"
+
+    assert manager.run_batch(["cat big.txt | ls"]) == 1
+    assert "не поддерживает конвейер" in capsys.readouterr().out
+
+    # head прекращает чтение источника, не дожидаясь его конца
+    read = []
+
+    def source(args, stdin=None):
+        for i in range(1000):
+            read.append(i)
+            yield f"{i}\n".encode()
+
+    stream_commands = dict(manager.stream_commands, seq=source)
+    assert run_pipeline([('seq', []), ('head', ['-n', '2'])], stream_commands)
+    assert capsys.readouterr().out == "0\n1\n"
+    assert len(read) < 10
+
+
+def test_background_jobs(temp_dir, capsys):
+    from main import ShellManager
+
+    manager = ShellManager()
+    (temp_dir / "sub").mkdir()
+    (temp_dir / "sub" / "inner.txt").write_text("внутри", encoding='utf-8')
+
+    # Директория задачи захватывается при запуске и не зависит от последующего cd
+    manager.job_manager.set_limit(1)
+    assert manager.run_batch(["cd sub", "cat inner.txt &", "cd ..", "cp file1.txt copy.txt &", "wait"]) == 0
+    out = capsys.readouterr().out
+    assert "[1] Завершено  cat inner.txt\nвнутри" in out
+    assert (temp_dir / "copy.txt").exists()
+
+    # Вывод задачи не смешивается с выводом оболочки до её завершения
+    manager.execute_command("tail -f file1.txt &")
+    manager.execute_command("cat file2.txt &")
+    jobs = {job.command_line: job for job in manager.job_manager.jobs()}
+    assert jobs["cat file2.txt"].status == 'queued'
+    assert manager.execute_command("kill 3")
+    assert not manager.job_manager.wait(timeout=5)
+    out = capsys.readouterr().out
+    assert "[3] Прерывается" in out and "Содержимое файла 2" not in out
+
+    manager.job_manager.report()
+    out = capsys.readouterr().out
+    assert "[3] Прервано  tail -f file1.txt" in out
+    assert "[4] Завершено  cat file2.txt\nСодержимое файла 2" in out
+    assert manager.job_manager.jobs() == []
+
+    # Задача из очереди отменяется вместе со своей строкой истории, а не с командой,
+    # введённой последней к моменту её запуска
+    blocker = manager.job_manager._next_id
+    assert manager.run_batch(["tail -f file1.txt &", "cp file1.txt queued.txt &", "ls",
+                              "cat file2.txt", f"kill {blocker}", f"wait {blocker + 1}", "undo"]) == 0
+    capsys.readouterr()
+    assert not (temp_dir / "queued.txt").exists()
+    commands = [cmd for _, cmd in manager.history_manager.get_history()]
+    assert "cat file2.txt" in commands and "cp file1.txt queued.txt &" not in commands
+
+    # Файл шаблонов grep -f ищется в директории задачи, а не процесса
+    from src.validator import set_working_dir
+    (temp_dir / "subdir" / "pats.txt").write_text("подфайла\n", encoding='utf-8')
+    set_working_dir(temp_dir / "subdir")
+    try:
+        assert GrepCommand().grep(["-f", "pats.txt", "subfile.txt"]) is True
+    finally:
+        set_working_dir(None)
+
+
+def test_zip_parallel_levels(temp_dir, capsys):
+    import zipfile
+
+    archive_cmds = ArchiveCommands()
+    tree = temp_dir / "photos"
+    (tree / "nested").mkdir(parents=True)
+    (tree / "notes.txt").write_text("заметка " * 5000, encoding='utf-8')
+    (tree / "nested" / "img.JPG").write_bytes(b"jpeg" * 5000)
+    (tree / "nested" / "empty.txt").write_bytes(b"")
+
+    # Имя архива используется как есть: .zip в середине пути не вырезается
+    (temp_dir / "out.zip.d").mkdir()
+    assert archive_cmds.zip(["-j", "3", "photos", "out.zip.d/photos.zip"]) is True
+    assert "ZIP архив создан" in capsys.readouterr().out
+    with zipfile.ZipFile(temp_dir / "out.zip.d" / "photos.zip") as zf:
+        assert zf.testzip() is None
+        assert sorted(zf.namelist()) == ["nested/", "nested/empty.txt", "nested/img.JPG", "notes.txt"]
+        assert zf.read("notes.txt") == ("заметка " * 5000).encode('utf-8')
+        assert zf.getinfo("notes.txt").compress_type == zipfile.ZIP_DEFLATED
+        # Уже сжатые форматы сохраняются без сжатия
+        assert zf.getinfo("nested/img.JPG").compress_type == zipfile.ZIP_STORED
+
+    assert archive_cmds.zip(["--level", "0", "photos", "photos/self.zip"]) is True
+    with zipfile.ZipFile(tree / "self.zip") as zf:
+        assert "self.zip" not in zf.namelist()
+        assert all(info.compress_type == zipfile.ZIP_STORED for info in zf.infolist())
+
+    assert archive_cmds.zip(["--level", "10", "photos", "x.zip"]) is False
+
+
+def test_tar_codecs(temp_dir, capsys, monkeypatch):
+    import gzip
+    import io
+    import tarfile
+    from src.archiver import TAR_CODECS, ParallelCompressor, open_tar_stream
+
+    archive_cmds = ArchiveCommands()
+    for archive, codec, kind in [("a.tar", None, "TAR"), ("a.tar.bz2", None, "TAR.BZ2"),
+                                 ("a.tar.xz", None, "TAR.XZ"), ("a.bin", "gz", "TAR.GZ")]:
+        args = ["-j", "2", "subdir", archive] if codec is None else ["--codec", codec, "subdir", archive]
+        assert archive_cmds.tar(args) is True
+        assert f"{kind} архив создан" in capsys.readouterr().out
+
+        # Кодек при распаковке определяется автоматически
+        out_dir = temp_dir / f"out-{archive}"
+        assert archive_cmds.untar([archive, str(out_dir)]) is True
+        assert (out_dir / "subdir" / "subfile.txt").read_text(encoding='utf-8') == "Содержимое подфайла"
+
+    with tarfile.open(temp_dir / "a.tar", "r:") as tar:
+        assert "subdir/subfile.txt" in tar.getnames()
+    assert archive_cmds.tar(["--codec", "zstd", "subdir", "a.tar.zst"]) is False
+
+    # Блоки сжимаются независимо: получается обычный многочленный gzip
+    data = b"".join(b"line %d\n" % i for i in range(20000))
+    raw = io.BytesIO()
+    writer = ParallelCompressor(raw, lambda block: gzip.compress(block, mtime=0), 4096, jobs=3)
+    writer.write(data)
+    writer.close()
+    assert raw.getvalue().count(b"\x1f\x8b\x08") > 10
+    assert gzip.decompress(raw.getvalue()) == data
+
+    # Потоковое чтение tar (grep -z) понимает многочленный gzip
+    monkeypatch.setitem(TAR_CODECS, 'gz', (('.tar.gz',), lambda block: gzip.compress(block, mtime=0), 512))
+    assert archive_cmds.tar(["subdir", "multi.tar.gz"]) is True
+    with open_tar_stream(temp_dir / "multi.tar.gz") as tar:
+        assert [member.name for member in tar] == ["subdir", "subdir/subfile.txt"]
+
+
+def test_archive_listing_and_selective_extract(temp_dir, capsys, monkeypatch):
+    import gzip
+    from src.archiver import TAR_CODECS, TAR_INDEX_SUFFIX, load_tar_index
+
+    # Мелкие блоки: в архиве много точек перезапуска, распаковка по индексу перескакивает
+    monkeypatch.setitem(TAR_CODECS, 'gz', (('.tar.gz',), lambda block: gzip.compress(block, mtime=0), 4096))
+    archive_cmds = ArchiveCommands()
+    tree = temp_dir / "proj"
+    (tree / "docs").mkdir(parents=True)
+    for i in range(30):
+        (tree / f"f{i}.txt").write_text(f"файл {i}\n" * 100, encoding='utf-8')
+    (tree / "docs" / "readme.md").write_text("документация", encoding='utf-8')
+
+    assert archive_cmds.tar(["--index", "proj", "proj.tar.gz"]) is True
+    assert len(load_tar_index(temp_dir / "proj.tar.gz")['restart_points']) > 10
+    assert archive_cmds.tar(["-t", "proj.tar.gz"]) is True
+    out = capsys.readouterr().out
+    assert "proj/docs/" in out and "proj/f29.txt" in out and "Всего: 33" in out
+
+    # С индексом и без него выборочная распаковка даёт одно и то же
+    assert archive_cmds.untar(["proj.tar.gz", "a", "--member", "proj/f2*.txt", "--member", "proj/docs"]) is True
+    (temp_dir / ("proj.tar.gz" + TAR_INDEX_SUFFIX)).unlink()
+    assert archive_cmds.untar(["proj.tar.gz", "b", "--member", "proj/f2*.txt", "--member", "proj/docs"]) is True
+    for out_dir in ("a", "b"):
+        extracted = sorted(p.relative_to(temp_dir / out_dir).as_posix()
+                           for p in (temp_dir / out_dir).rglob("*") if p.is_file())
+        assert extracted == ["proj/docs/readme.md", "proj/f2.txt"] + [f"proj/f2{i}.txt" for i in range(10)]
+    assert (temp_dir / "a" / "proj" / "f25.txt").read_text(encoding='utf-8') == "файл 25\n" * 100
+    assert archive_cmds.untar(["proj.tar.gz", "c", "--member", "proj/missing.txt"]) is False
+
+    # Архив без сжатия: член читается прямо с его смещения в файле
+    assert archive_cmds.tar(["--index", "proj", "proj.tar"]) is True
+    assert archive_cmds.untar(["proj.tar", "d", "--member", "proj/f25.txt"]) is True
+    assert (temp_dir / "d" / "proj" / "f25.txt").read_text(encoding='utf-8') == "файл 25\n" * 100
+
+    # Индекс устаревшего архива не используется
+    assert archive_cmds.tar(["--index", "proj", "proj.tar.gz"]) is True
+    os.utime(temp_dir / "proj.tar.gz", ns=(0, 0))
+    assert load_tar_index(temp_dir / "proj.tar.gz") is None
+
+    assert archive_cmds.zip(["proj", "proj.zip"]) is True
+    capsys.readouterr()
+    assert archive_cmds.zip(["-t", "proj.zip"]) is True
+    assert "docs/readme.md" in capsys.readouterr().out
+    assert archive_cmds.unzip(["proj.zip", "docs/*", "f1.txt", "-d", "z"]) is True
+    assert sorted(p.name for p in (temp_dir / "z").rglob("*") if p.is_file()) == ["f1.txt", "readme.md"]
+    # Прежняя форма: второй аргумент — папка назначения
+    assert archive_cmds.unzip(["proj.zip", "full"]) is True
+    assert len(list((temp_dir / "full").glob("*.txt"))) == 30
+
+
+def test_unzip_parallel_and_traversal(temp_dir):
+    import zipfile
+
+    archive_cmds = ArchiveCommands()
+    tree = temp_dir / "data"
+    (tree / "sub" / "deep").mkdir(parents=True)
+    (tree / "empty").mkdir()
+    for i in range(20):
+        (tree / "sub" / f"f{i}.bin").write_bytes(os.urandom(1000 * (i + 1)))
+    (tree / "sub" / "deep" / "note.txt").write_text("заметка", encoding='utf-8')
+    assert archive_cmds.zip(["data", "data.zip"]) is True
+
+    # Несколько потоков распаковывают то же, что и один
+    assert archive_cmds.unzip(["-j", "4", "data.zip", "-d", "par"]) is True
+    assert archive_cmds.unzip(["-j1", "data.zip", "-d", "seq"]) is True
+    for out_dir in ("par", "seq"):
+        files = sorted(p.relative_to(temp_dir / out_dir) for p in (temp_dir / out_dir).rglob("*") if p.is_file())
+        assert files == sorted(p.relative_to(tree) for p in tree.rglob("*") if p.is_file())
+        for rel in files:
+            assert (temp_dir / out_dir / rel).read_bytes() == (tree / rel).read_bytes()
+    assert (temp_dir / "par" / "empty").is_dir()
+    assert archive_cmds.unzip(["-j", "0", "data.zip"]) is False
+
+    # Член за пределами папки назначения: ничего не распаковывается
+    with zipfile.ZipFile(temp_dir / "evil.zip", "w") as zf:
+        zf.writestr("ok.txt", "ok")
+        zf.writestr("../evil.txt", "evil")
+    assert archive_cmds.unzip(["-j", "2", "evil.zip", "-d", "out"]) is False
+    assert not (temp_dir / "evil.txt").exists()
+    assert not (temp_dir / "out" / "ok.txt").exists()
+
+
+def test_tar_incremental_chain(temp_dir, undo_manager, capsys):
+    from src.archiver import list_tar as list_tar_members, load_snapshot, read_incremental_header
+
+    archive_cmds = ArchiveCommands(undo_manager=undo_manager)
+    tree = temp_dir / "proj"
+    (tree / "old").mkdir(parents=True)
+    (tree / "keep.txt").write_text("без изменений", encoding='utf-8')
+    (tree / "edit.txt").write_text("версия 1", encoding='utf-8')
+    (tree / "old" / "gone.txt").write_text("будет удалён", encoding='utf-8')
+
+    assert archive_cmds.tar(["--incremental", "proj.snap", "proj", "l0.tar.gz"]) is True
+    assert "Уровень 0: файлов 3, удалено 0" in capsys.readouterr().out
+
+    (tree / "edit.txt").write_text("версия 2", encoding='utf-8')
+    os.utime(tree / "edit.txt", ns=(0, 10 ** 9))
+    (tree / "new.txt").write_text("новый", encoding='utf-8')
+    shutil.rmtree(tree / "old")
+    assert archive_cmds.tar(["--incremental", "proj.snap", "proj", "l1.tar.gz"]) is True
+    header = read_incremental_header(temp_dir / "l1.tar.gz")
+    assert (header['level'], header['files'], header['deleted']) == (1, 2, ["proj/old", "proj/old/gone.txt"])
+    files = sorted(name for name, _, _, is_dir in list_tar_members(temp_dir / "l1.tar.gz") if not is_dir)
+    assert files == [".incremental.json", "proj/edit.txt", "proj/new.txt"]
+
+    # Отмена удаляет только новый архив; следующий уровень строится заново от уровня 0
+    assert undo_manager.undo_last_operation(None) is True
+    assert not (temp_dir / "l1.tar.gz").exists() and (temp_dir / "l0.tar.gz").exists()
+    assert len(load_snapshot(temp_dir / "proj.snap", tree)[1]) == 1
+    assert archive_cmds.tar(["--incremental", "proj.snap", "proj", "l1b.tar.gz"]) is True
+    assert read_incremental_header(temp_dir / "l1b.tar.gz")['level'] == 1
+
+    assert archive_cmds.untar(["--incremental", "l1b.tar.gz", "-d", "bad"]) is False
+    assert archive_cmds.untar(["--incremental", "l0.tar.gz", "l1b.tar.gz", "-d", "restored"]) is True
+    restored = temp_dir / "restored" / "proj"
+    assert sorted(p.relative_to(restored).as_posix() for p in restored.rglob("*")) == \
+        ["edit.txt", "keep.txt", "new.txt"]
+    assert (restored / "edit.txt").read_text(encoding='utf-8') == "версия 2"
+    assert not (temp_dir / "restored" / ".incremental.json").exists()